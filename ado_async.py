@@ -0,0 +1,409 @@
+import asyncio
+import codecs
+import logging
+import random
+
+from msrest import Deserializer
+
+import ado_report_parser
+import ado_scheduler
+
+
+logger = logging.getLogger()
+
+# REST api-version of each endpoint we call - the same versions the azure.devops v6_0 clients use
+DEFINITIONS_API_VERSION = '6.0-preview.7'
+BUILDS_API_VERSION = '6.0-preview.6'
+BUILD_REPORT_API_VERSION = '6.0-preview.2'
+PROJECTS_API_VERSION = '6.0-preview.4'
+TEST_RUNS_API_VERSION = '6.0-preview.3'
+TEST_RESULTS_API_VERSION = '6.0-preview.6'
+TEST_ATTACHMENTS_API_VERSION = '6.0-preview.1'
+
+DEFAULT_MAX_CONNECTIONS = 100
+DEFINITIONS_PAGE_SIZE = 1000
+PROJECTS_PAGE_SIZE = 100
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# same as our sync objects use (ado_utils)
+TEST_RUN_QUERY_PAGE_SIZE = 100
+TEST_RUN_QUERY_BUILD_IDS_PER_QUERY = 10
+TEST_RESULTS_PAGE_SIZE = 1000
+
+
+def return_deserializer():
+    """
+    :return: msrest Deserializer for the build, core and test models, so we hand back the same objects as
+             the (sync) azure.devops clients do
+    """
+    from azure.devops.v6_0.build import models as build_models
+    from azure.devops.v6_0.core import models as core_models
+    from azure.devops.v6_0.test import models as test_models
+
+    client_models = {}
+    for models in (core_models, build_models, test_models):
+        client_models.update((name, model) for name, model in models.__dict__.items() if isinstance(model, type))
+    return Deserializer(client_models)
+
+
+class AsyncADOSession(object):
+    """One pooled aiohttp session to an ADO org, shared by all our async ADO objects, so thousands of requests can
+    be in flight from a single thread.
+
+    Requests are capped at max_connections in flight, and throttled (429), 5xx and network failures are retried
+    with the same jittered exponential backoff (or Retry-After) as ado_scheduler.ADORequestScheduler.
+    org_url can point at a local stub server for testing.
+
+    Needs aiohttp (pip install aiohttp), which is only imported when one of these is made. Use it as an async
+    context manager (the aiohttp session is opened on entering, within the running event loop - or else on the
+    first request), or await close() when done.
+    """
+
+    def __init__(self, org_url, creds, max_connections=DEFAULT_MAX_CONNECTIONS,
+                 max_retries=ado_scheduler.DEFAULT_MAX_RETRIES,
+                 backoff_base_seconds=ado_scheduler.DEFAULT_BACKOFF_BASE_SECONDS,
+                 backoff_cap_seconds=ado_scheduler.DEFAULT_BACKOFF_CAP_SECONDS):
+        """
+        :param org_url: e.g. 'https://mycompany.visualstudio.com'
+        :param creds: msrest BasicAuthentication, as our sync ADO objects take
+        """
+        try:
+            import aiohttp
+        except ImportError:
+            raise BaseException('aiohttp is needed for the async ADO objects - pip install aiohttp')
+        self._aiohttp = aiohttp
+
+        self.org_url = org_url.rstrip('/')
+        self.max_retries = max_retries
+        self.backoff_base_seconds = backoff_base_seconds
+        self.backoff_cap_seconds = backoff_cap_seconds
+        self.stats = {'requests': 0, 'retries': 0, 'throttled': 0, 'failed': 0}
+        self.deserializer = return_deserializer()
+
+        self._auth = aiohttp.BasicAuth(creds.username, creds.password)
+        self._max_connections = max_connections
+        # aiohttp sessions belong to the event loop they are made in, so this is only made once one is running
+        self._session = None
+        # loop.time() before which no request is started, e.g. after a Retry-After
+        self._paused_until = 0.0
+
+    async def __aenter__(self):
+        self._open()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    def _open(self):
+        if self._session is None:
+            self._session = self._aiohttp.ClientSession(
+                connector=self._aiohttp.TCPConnector(limit=self._max_connections), auth=self._auth,
+                raise_for_status=False)
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def deserialize(self, model_name, data):
+        return self.deserializer(model_name, data)
+
+    async def get_json(self, path, params, api_version):
+        """
+        :param path: path under the org url, e.g. '<project id>/_apis/build/definitions'
+        :param params: dict of query parameters - None values are left out
+        :return: tuple of (decoded json, continuation token for the next page or None)
+        """
+        async with await self._request(path, params, api_version, 'application/json') as response:
+            return await response.json(), response.headers.get('x-ms-continuationtoken')
+
+    async def iter_content(self, path, params, api_version, accept):
+        """
+        :return: async generator of bytes chunks of the response body, as it downloads
+        """
+        async with await self._request(path, params, api_version, accept) as response:
+            async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                yield chunk
+
+    async def _request(self, path, params, api_version, accept):
+        url = '%s/%s' % (self.org_url, path)
+        query = dict((name, value) for name, value in params.items() if value is not None)
+        query['api-version'] = api_version
+        loop = asyncio.get_running_loop()
+
+        attempt = 0
+        while True:
+            if self._paused_until > loop.time():
+                await asyncio.sleep(self._paused_until - loop.time())
+
+            self.stats['requests'] += 1
+            status_code = None
+            retry_after = None
+            try:
+                response = await self._open().get(url, params=query, headers={'Accept': accept})
+            except (self._aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                error = e
+            else:
+                if response.status < 400:
+                    return response
+                status_code = response.status
+                retry_after = ado_scheduler.return_retry_after_seconds_from_headers(response.headers)
+                error = BaseException('GET %s returned a %s status code: %s'
+                                      % (path, status_code, await response.text()))
+                response.release()
+
+            if (status_code is not None and status_code not in ado_scheduler.RETRY_STATUS_CODES) \
+                    or attempt >= self.max_retries:
+                self.stats['failed'] += 1
+                raise error
+
+            attempt += 1
+            self.stats['retries'] += 1
+            if status_code == 429:
+                self.stats['throttled'] += 1
+            if retry_after is not None:
+                delay = retry_after
+                self._paused_until = max(self._paused_until, loop.time() + retry_after)
+            else:
+                delay = random.uniform(0, min(self.backoff_cap_seconds, self.backoff_base_seconds * 2 ** attempt))
+
+            logger.warning('ADO call %s failed (%s), retry %s of %s in %.1f seconds'
+                           % (path, status_code or type(error).__name__, attempt, self.max_retries, delay))
+            await asyncio.sleep(delay)
+
+    async def iter_pages(self, path, params, api_version, page_size):
+        """
+        :return: async generator of the items of a list response, following continuation tokens
+        """
+        continuation_token = None
+        while True:
+            page_params = dict(params, **{'$top': page_size, 'continuationToken': continuation_token})
+            body, continuation_token = await self.get_json(path, page_params, api_version)
+            for item in body['value']:
+                yield item
+            if not continuation_token:
+                break
+
+
+class AsyncOurADOObj(object):
+    """Base Class for the async variants of our ADO objects - see ado_utils.OurADOObj.
+
+    Calls the same REST endpoints as the azure.devops clients and returns the same (msrest model) objects,
+    over a shared AsyncADOSession. The project is looked up on first use, so create these freely then await
+    their methods.
+    """
+
+    def __init__(self, session, project_name_str='My Default Project Name'):
+        self.session = session
+        self.project_name_str = project_name_str
+        self.top_level_folder_path = '\\Automation'
+        self.verbose_logging = False
+        self._ado_project = None
+        # so many coroutines wanting the project at once only look it up once
+        self._ado_project_lock = asyncio.Lock()
+
+    async def get_ado_project(self):
+        """
+        :return: TeamProjectReference object
+        """
+        async with self._ado_project_lock:
+            if self._ado_project is None:
+                async for project in self.session.iter_pages('_apis/projects', {}, PROJECTS_API_VERSION,
+                                                             PROJECTS_PAGE_SIZE):
+                    if project['name'] == self.project_name_str:
+                        logger.info('Successfully found %s project:' % self.project_name_str)
+                        self._ado_project = self.session.deserialize('TeamProjectReference', project)
+                        break
+                else:
+                    raise BaseException('Could not find the project %s in %s'
+                                        % (self.project_name_str, self.session.org_url))
+
+        return self._ado_project
+
+    async def project_path(self, path):
+        project = await self.get_ado_project()
+        return '%s/%s' % (project.id, path)
+
+
+class AsyncADOBuildObj(AsyncOurADOObj):
+    """Async variant of ado_utils.ADOBuildObj
+    """
+
+    async def get_list_of_build_definition_references_under_project(self, path=None, name=None):
+        """
+        :return: list of BuildDefinitionReference objects
+        """
+        logger.info('Getting definitions under project: %s, path: %s' % (self.project_name_str, path or '\\'))
+
+        return [self.session.deserialize('BuildDefinitionReference', definition)
+                async for definition in self.session.iter_pages(await self.project_path('_apis/build/definitions'),
+                                                                {'path': path, 'name': name}, DEFINITIONS_API_VERSION,
+                                                                DEFINITIONS_PAGE_SIZE)]
+
+    async def get_single_build_definition_by_id(self, our_definition_id):
+        """
+        :return: a single BuildDefinition object, including its latest builds
+        """
+        body, _ = await self.session.get_json(
+            await self.project_path('_apis/build/definitions/%s' % our_definition_id),
+            {'includeLatestBuilds': 'true'}, DEFINITIONS_API_VERSION)
+
+        return self.session.deserialize('BuildDefinition', body)
+
+    async def iter_completed_builds(self, definition_id, max_builds=None, min_finish_time=None, page_size=100):
+        """
+        :return: async generator of the definition's completed Build objects, most recently finished first
+        """
+        params = {'definitions': definition_id, 'statusFilter': 'completed', 'queryOrder': 'finishTimeDescending',
+                  'minTime': min_finish_time.isoformat() if min_finish_time else None}
+        builds_yielded = 0
+        async for build in self.session.iter_pages(await self.project_path('_apis/build/builds'), params,
+                                                   BUILDS_API_VERSION, page_size):
+            yield self.session.deserialize('Build', build)
+            builds_yielded += 1
+            if max_builds is not None and builds_yielded >= max_builds:
+                return
+
+    async def get_build_report_summary(self, build_id):
+        """
+        Get the test summary from the build 'report' for a specific build (run), parsing it as it downloads
+
+        :return: summary dict - see ado_report_parser.BuildReportSummaryParser
+        """
+        parser = ado_report_parser.BuildReportSummaryParser()
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+
+        async for chunk in self.session.iter_content(
+                await self.project_path('_apis/build/builds/%s/report' % build_id), {},
+                BUILD_REPORT_API_VERSION, 'text/html'):
+            parser.feed(decoder.decode(chunk))
+
+        parser.feed(decoder.decode(b'', final=True))
+        parser.close()
+
+        return parser.summary()
+
+
+class AsyncADOTestClientObj(AsyncOurADOObj):
+    """Async variant of ado_utils.ADOTestClientObj
+    """
+
+    async def get_test_runs(self, our_build_uri):
+        """
+        :return: list of TestRun objects for the build
+        """
+        body, _ = await self.session.get_json(await self.project_path('_apis/test/runs'),
+                                              {'buildUri': our_build_uri, 'includeRunDetails': 'true'},
+                                              TEST_RUNS_API_VERSION)
+
+        return [self.session.deserialize('TestRun', test_run) for test_run in body['value']]
+
+    async def query_test_runs(self, min_last_updated_date, max_last_updated_date, build_ids):
+        """
+        :return: list of TestRun objects for these build ids, updated within the dates (at most 7 days apart) -
+                 queried TEST_RUN_QUERY_BUILD_IDS_PER_QUERY build ids at a time (ADO allows at most 10), concurrently
+        """
+        path = await self.project_path('_apis/test/runs')
+        build_ids = list(build_ids)
+
+        async def query_chunk(chunk_build_ids):
+            params = {'minLastUpdatedDate': min_last_updated_date.isoformat(),
+                      'maxLastUpdatedDate': max_last_updated_date.isoformat(),
+                      'buildIds': ','.join(str(build_id) for build_id in chunk_build_ids)}
+            return [self.session.deserialize('TestRun', test_run)
+                    async for test_run in self.session.iter_pages(path, params, TEST_RUNS_API_VERSION,
+                                                                  TEST_RUN_QUERY_PAGE_SIZE)]
+
+        chunks_test_runs = await asyncio.gather(*[
+            query_chunk(build_ids[start:start + TEST_RUN_QUERY_BUILD_IDS_PER_QUERY])
+            for start in range(0, len(build_ids), TEST_RUN_QUERY_BUILD_IDS_PER_QUERY)])
+
+        return [test_run for chunk_test_runs in chunks_test_runs for test_run in chunk_test_runs]
+
+    async def get_test_run_statistics(self, run_id):
+        """
+        :return: TestRunStatistic object
+        """
+        body, _ = await self.session.get_json(await self.project_path('_apis/test/runs/%s/Statistics' % run_id), {},
+                                              TEST_RUNS_API_VERSION)
+
+        return self.session.deserialize('TestRunStatistic', body)
+
+
+class AsyncADOTestResultsObj(AsyncOurADOObj):
+    """Async variant of ado_utils.ADOTestResultsObj
+    """
+
+    async def iter_test_results(self, run_id):
+        """
+        :return: async generator of TestCaseResult objects for a test run, a page (top) at a time
+        """
+        path = await self.project_path('_apis/test/Runs/%s/results' % run_id)
+        skip = 0
+        while True:
+            body, _ = await self.session.get_json(path, {'$skip': skip, '$top': TEST_RESULTS_PAGE_SIZE},
+                                                  TEST_RESULTS_API_VERSION)
+            for test_result in body['value']:
+                yield self.session.deserialize('TestCaseResult', test_result)
+
+            if len(body['value']) < TEST_RESULTS_PAGE_SIZE:
+                break
+            skip += len(body['value'])
+
+    async def get_test_result_attachments(self, run_id, result_id):
+        """
+        :param result_id: id of the test result within the run, or None for the attachments of the run itself
+        :return: list of TestAttachment objects
+        """
+        path = 'Runs/%s/attachments' % run_id if result_id is None \
+            else 'Runs/%s/Results/%s/attachments' % (run_id, result_id)
+        body, _ = await self.session.get_json(await self.project_path('_apis/test/' + path), {},
+                                              TEST_ATTACHMENTS_API_VERSION)
+
+        return [self.session.deserialize('TestAttachment', attachment) for attachment in body['value']]
+
+    async def iter_test_result_attachment_content(self, run_id, result_id, attachment_id):
+        """
+        :return: async generator of bytes chunks of the attachment, as it downloads
+        """
+        path = 'Runs/%s/attachments/%s' % (run_id, attachment_id) if result_id is None \
+            else 'Runs/%s/Results/%s/attachments/%s' % (run_id, result_id, attachment_id)
+        async for chunk in self.session.iter_content(await self.project_path('_apis/test/' + path), {},
+                                                     TEST_ATTACHMENTS_API_VERSION, 'application/octet-stream'):
+            yield chunk
+
+
+async def gather_latest_test_run_statistics(build_obj, test_obj, definition_ids):
+    """
+    For each definition, get its latest completed build, that build's first test run and the run's statistics -
+    every definition's chain of calls running concurrently
+
+    :param build_obj: AsyncADOBuildObj
+    :param test_obj: AsyncADOTestClientObj
+    :param definition_ids: list of build definition ids
+    :return: dict of definition id: dict with 'last_comp_build_id', 'last_comp_build_uri',
+             'last_comp_build_finish_time', 'test_run_id' and test_run_stat<outcome> keys, as in our csv results
+    """
+    async def get_one(definition_id):
+        this_def = await build_obj.get_single_build_definition_by_id(definition_id)
+        latest_build = this_def.latest_completed_build
+        if latest_build is None:
+            return {}
+
+        finish_time = latest_build.finish_time
+        results = {'last_comp_build_id': latest_build.id,
+                   'last_comp_build_uri': latest_build.uri,
+                   'last_comp_build_finish_time': finish_time.isoformat() if finish_time else None}
+
+        test_runs = await test_obj.get_test_runs(latest_build.uri)
+        if test_runs:
+            results['test_run_id'] = test_runs[0].id
+            run_statistics = await test_obj.get_test_run_statistics(test_runs[0].id)
+            for this_stat in run_statistics.run_statistics:
+                results['test_run_stat' + this_stat.outcome] = this_stat.count
+
+        return results
+
+    all_results = await asyncio.gather(*[get_one(definition_id) for definition_id in definition_ids])
+
+    return dict(zip(definition_ids, all_results))
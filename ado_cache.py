@@ -0,0 +1,127 @@
+import pickle
+import sqlite3
+import threading
+import time
+
+# Kinds of things we cache, and how long (seconds) we trust each of them for by default.
+# Anything keyed by a completed build / test run never changes, so is only evicted when the cache is too big;
+# definitions (and so their latest_completed_build) move on as new builds complete.
+PROJECTS = 'projects'
+DEFINITION_REFS = 'definition_refs'
+DEFINITION = 'definition'
+BUILD_REPORT = 'build_report'
+BUILD_REPORT_SUMMARY = 'build_report_summary'
+TEST_RUNS = 'test_runs'
+TEST_RUN_STATS = 'test_run_stats'
+
+DEFAULT_TTLS = {PROJECTS: 24 * 60 * 60,
+                DEFINITION_REFS: 60 * 60,
+                DEFINITION: 10 * 60,
+                BUILD_REPORT: 30 * 24 * 60 * 60,
+                BUILD_REPORT_SUMMARY: 30 * 24 * 60 * 60,
+                TEST_RUNS: 30 * 24 * 60 * 60,
+                TEST_RUN_STATS: 30 * 24 * 60 * 60}
+
+DEFAULT_MAX_ENTRIES = 20000
+
+
+class ADOResultsCache(object):
+    """On disk (SQLite) cache of the ADO objects we fetch, so a run only has to go to ADO for what is new.
+
+    Entries are keyed by kind (DEFINITION, BUILD_REPORT, etc.) and an id - the definition id for definitions,
+    the build id for build reports (and their summaries), the build uri for test runs and the test run id
+    for test run statistics, each qualified by the project id (see OurADOObj.cache_key) - and the org url for
+    the org's projects.
+    Entries older than their kind's TTL are ignored (and deleted), and once the cache holds more than max_entries
+    the least recently used entries are evicted.
+    """
+
+    def __init__(self, cache_file_path, ttls=None, max_entries=DEFAULT_MAX_ENTRIES):
+        """
+        :param cache_file_path: path of the SQLite file to use, created if it does not exist
+        :param ttls: dict of kind: seconds, overriding DEFAULT_TTLS for those kinds
+        :param max_entries: number of entries to keep before evicting the least recently used ones
+        """
+        self.cache_file_path = cache_file_path
+        self.ttls = dict(DEFAULT_TTLS)
+        self.ttls.update(ttls or {})
+        self.max_entries = max_entries
+        self.stats = {'hits': 0, 'misses': 0, 'evicted': 0}
+
+        # one connection shared by our worker threads, serialised by our lock
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(cache_file_path, check_same_thread=False)
+        self._db.execute('CREATE TABLE IF NOT EXISTS entries (kind TEXT NOT NULL, key TEXT NOT NULL,'
+                         ' created REAL NOT NULL, last_used REAL NOT NULL, value BLOB NOT NULL,'
+                         ' PRIMARY KEY (kind, key))')
+        self._db.execute('CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)')
+        self._db.commit()
+        # an upper bound on the entries in the cache, so we only count them properly when we might be too big
+        self._max_possible_entries = self._db.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+
+    def get(self, kind, key):
+        """
+        :return: the cached object, or None if there is no (unexpired) entry for it
+        """
+        now = time.time()
+        with self._lock:
+            row = self._db.execute('SELECT created, value FROM entries WHERE kind = ? AND key = ?',
+                                   (kind, str(key))).fetchone()
+            if row is None:
+                self.stats['misses'] += 1
+                return None
+
+            created, value = row
+            if now - created > self.ttls[kind]:
+                self._db.execute('DELETE FROM entries WHERE kind = ? AND key = ?', (kind, str(key)))
+                self._db.commit()
+                self.stats['misses'] += 1
+                return None
+
+            self._db.execute('UPDATE entries SET last_used = ? WHERE kind = ? AND key = ?', (now, kind, str(key)))
+            self._db.commit()
+            self.stats['hits'] += 1
+
+        return pickle.loads(value)
+
+    def put(self, kind, key, value):
+        now = time.time()
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO entries (kind, key, created, last_used, value)'
+                             ' VALUES (?, ?, ?, ?, ?)',
+                             (kind, str(key), now, now, pickle.dumps(value, pickle.HIGHEST_PROTOCOL)))
+            self._max_possible_entries += 1
+            if self._max_possible_entries > self.max_entries:
+                self._evict_over_size()
+            self._db.commit()
+
+    def delete(self, kind, key):
+        with self._lock:
+            self._db.execute('DELETE FROM entries WHERE kind = ? AND key = ?', (kind, str(key)))
+            self._db.commit()
+
+    def evict_expired(self):
+        """
+        Delete every entry older than its kind's TTL
+        """
+        now = time.time()
+        with self._lock:
+            for kind, ttl in self.ttls.items():
+                cursor = self._db.execute('DELETE FROM entries WHERE kind = ? AND created < ?', (kind, now - ttl))
+                self.stats['evicted'] += cursor.rowcount
+            self._db.commit()
+
+    def _evict_over_size(self):
+        # caller holds our lock
+        count = self._db.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+        if count > self.max_entries:
+            cursor = self._db.execute('DELETE FROM entries WHERE rowid IN'
+                                      ' (SELECT rowid FROM entries ORDER BY last_used LIMIT ?)',
+                                      (count - self.max_entries,))
+            self.stats['evicted'] += cursor.rowcount
+            count = self.max_entries
+        self._max_possible_entries = count
+
+    def close(self):
+        with self._lock:
+            self._db.close()
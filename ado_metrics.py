@@ -0,0 +1,227 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections.abc import Iterator
+
+
+logger = logging.getLogger()
+
+# upper bounds of each histogram's buckets - anything over the last one only counts towards +Inf
+LATENCY_BUCKETS_SECONDS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+BYTES_BUCKETS = (1024, 10 * 1024, 100 * 1024, 1024 * 1024, 10 * 1024 * 1024, 100 * 1024 * 1024)
+RETRIES_BUCKETS = (0, 1, 2, 3, 5)
+
+# name, help text and ADOCallMetrics histogram attribute of each histogram we export
+PROMETHEUS_HISTOGRAMS = (('ado_client_call_duration_seconds', 'Time taken by ADO client calls, retries included',
+                          'latency_seconds'),
+                         ('ado_client_response_bytes', 'Bytes received by ADO client calls', 'bytes_received'),
+                         ('ado_client_call_retries', 'Retries needed by ADO client calls', 'retries'))
+
+
+class Histogram(object):
+    """Prometheus style histogram - a count of the values observed in (or under) each bucket, plus their sum
+    """
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        # the last count is for values over every bound
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.bounds):
+            if value <= bound:
+                break
+        else:
+            index = len(self.bounds)
+        self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative_buckets(self):
+        """
+        :return: list of (upper bound, values observed up to it) - the last being ('+Inf', count)
+        """
+        buckets = []
+        running_count = 0
+        for bound, count in zip(list(self.bounds) + ['+Inf'], self.counts):
+            running_count += count
+            buckets.append((bound, running_count))
+        return buckets
+
+    def as_dict(self):
+        return {'count': self.count, 'sum': round(self.sum, 6), 'buckets': self.cumulative_buckets()}
+
+
+class EndpointMetrics(object):
+    """Counts and histograms for one endpoint (e.g. 'BuildClient.get_definition') at one API version
+    """
+
+    def __init__(self, endpoint, api_version):
+        self.endpoint = endpoint
+        self.api_version = api_version
+        self.calls = 0
+        self.failed = 0
+        self.latency_seconds = Histogram(LATENCY_BUCKETS_SECONDS)
+        self.bytes_received = Histogram(BYTES_BUCKETS)
+        self.retries = Histogram(RETRIES_BUCKETS)
+
+    def as_dict(self):
+        return {'endpoint': self.endpoint,
+                'api_version': self.api_version,
+                'calls': self.calls,
+                # every attempt at a call is a request to ADO
+                'requests': self.calls + int(self.retries.sum),
+                'failed': self.failed,
+                'total_seconds': round(self.latency_seconds.sum, 3),
+                'mean_seconds': round(self.latency_seconds.sum / self.calls, 3) if self.calls else None,
+                'bytes_received': self.bytes_received.sum,
+                'latency_seconds': self.latency_seconds.as_dict(),
+                'bytes_received_histogram': self.bytes_received.as_dict(),
+                'retries': self.retries.as_dict()}
+
+
+class ADOCallMetrics(object):
+    """Thread safe timings and counts of every ADO client call made through our scheduled clients
+    (ado_scheduler.ScheduledClient), by endpoint and API version.
+
+    Bytes received are taken from each response's Content-Length, seen through the clients' response hook,
+    or counted as they arrive for streamed content (e.g. build reports) - whose calls are timed until the
+    stream has been read.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+        # the call each thread is making, so response_hook can tell which call a response is for
+        self._local = threading.local()
+        self.started = time.time()
+
+    def measure(self, endpoint, api_version, func):
+        """
+        Make one ADO client call, recording how long it took, the bytes it received and the retries it needed
+
+        :param func: callable taking a call stats dict, in which it can set the 'retries' the call took
+        :return: whatever func returns - iterators (streamed content) are wrapped, so they are measured as read
+        """
+        call_stats = {'retries': 0, 'bytes': 0}
+        self._local.call_stats = call_stats
+        started = time.perf_counter()
+        try:
+            result = func(call_stats)
+        except BaseException:
+            self.record(endpoint, api_version, time.perf_counter() - started, call_stats['bytes'],
+                        call_stats['retries'], failed=True)
+            raise
+        finally:
+            self._local.call_stats = None
+
+        if isinstance(result, Iterator):
+            return self._measure_stream(endpoint, api_version, result, started, call_stats)
+
+        self.record(endpoint, api_version, time.perf_counter() - started, call_stats['bytes'], call_stats['retries'])
+        return result
+
+    def _measure_stream(self, endpoint, api_version, chunks, started, call_stats):
+        bytes_received = 0
+        failed = True
+        try:
+            for chunk in chunks:
+                bytes_received += len(chunk)
+                yield chunk
+            failed = False
+        finally:
+            self.record(endpoint, api_version, time.perf_counter() - started, bytes_received, call_stats['retries'],
+                        failed=failed)
+
+    def response_hook(self, response, *args, **kwargs):
+        # requests 'response' hook signature - runs on the thread making the call
+        call_stats = getattr(self._local, 'call_stats', None)
+        if call_stats is not None:
+            try:
+                call_stats['bytes'] += int(response.headers.get('Content-Length') or 0)
+            except ValueError:
+                pass
+        return response
+
+    def record(self, endpoint, api_version, seconds, bytes_received, retries, failed=False):
+        key = (endpoint, api_version)
+        with self._lock:
+            if key not in self._endpoints:
+                self._endpoints[key] = EndpointMetrics(endpoint, api_version)
+            endpoint_metrics = self._endpoints[key]
+            endpoint_metrics.calls += 1
+            if failed:
+                endpoint_metrics.failed += 1
+            endpoint_metrics.latency_seconds.observe(seconds)
+            endpoint_metrics.bytes_received.observe(bytes_received)
+            endpoint_metrics.retries.observe(retries)
+
+    def summary(self):
+        """
+        :return: dict of the run's 'totals' and each endpoint's metrics, most time consuming endpoint first
+        """
+        with self._lock:
+            endpoints = [endpoint_metrics.as_dict() for endpoint_metrics in self._endpoints.values()]
+        endpoints.sort(key=lambda endpoint: endpoint['total_seconds'], reverse=True)
+
+        totals = dict((total, sum(endpoint[total] for endpoint in endpoints))
+                      for total in ('calls', 'requests', 'failed', 'bytes_received'))
+        totals['total_seconds'] = round(sum(endpoint['total_seconds'] for endpoint in endpoints), 3)
+        totals['wall_seconds'] = round(time.time() - self.started, 3)
+
+        return {'totals': totals, 'endpoints': endpoints}
+
+    def write_json_summary(self, filename):
+        _write_atomically(filename, json.dumps(self.summary(), indent=2))
+
+    def prometheus_text(self):
+        """
+        :return: every endpoint's histograms and counts in the Prometheus text exposition format
+        """
+        with self._lock:
+            endpoints = sorted(self._endpoints.values(), key=lambda metrics: (metrics.endpoint, metrics.api_version))
+            lines = []
+            for name, help_text, attribute in PROMETHEUS_HISTOGRAMS:
+                lines.append('# HELP %s %s' % (name, help_text))
+                lines.append('# TYPE %s histogram' % name)
+                for endpoint_metrics in endpoints:
+                    labels = 'endpoint="%s",api_version="%s"' % (endpoint_metrics.endpoint,
+                                                                  endpoint_metrics.api_version)
+                    histogram = getattr(endpoint_metrics, attribute)
+                    for bound, count in histogram.cumulative_buckets():
+                        lines.append('%s_bucket{%s,le="%s"} %s' % (name, labels, bound, count))
+                    lines.append('%s_sum{%s} %s' % (name, labels, histogram.sum))
+                    lines.append('%s_count{%s} %s' % (name, labels, histogram.count))
+
+            for name, help_text, attribute in (('ado_client_calls_total', 'ADO client calls made', 'calls'),
+                                               ('ado_client_call_failures_total', 'ADO client calls that failed',
+                                                'failed')):
+                lines.append('# HELP %s %s' % (name, help_text))
+                lines.append('# TYPE %s counter' % name)
+                for endpoint_metrics in endpoints:
+                    lines.append('%s{endpoint="%s",api_version="%s"} %s'
+                                 % (name, endpoint_metrics.endpoint, endpoint_metrics.api_version,
+                                    getattr(endpoint_metrics, attribute)))
+
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus_text(self, filename):
+        # e.g. for the node_exporter textfile collector, which must never see half a file
+        _write_atomically(filename, self.prometheus_text())
+
+    def log_summary(self):
+        summary = self.summary()
+        for endpoint in summary['endpoints']:
+            logger.info('%(endpoint)s (%(api_version)s): %(calls)s calls, %(total_seconds)s s in total,'
+                        ' %(mean_seconds)s s mean, %(bytes_received)s bytes, %(failed)s failed' % endpoint)
+
+
+def _write_atomically(filename, text):
+    temp_filename = filename + '.tmp'
+    with open(temp_filename, 'w') as our_file:
+        our_file.write(text)
+    os.replace(temp_filename, filename)
@@ -0,0 +1,479 @@
+import hashlib
+import importlib
+import json
+import os
+import pickle
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+
+# client methods whose responses are recorded to (and replayed from) fixtures - every call we make per pipeline,
+# plus what we call once per run to find our project and definitions
+RECORDED_ENDPOINTS = ('get_projects', 'get_project', 'get_definitions', 'get_definition', 'get_builds',
+                      'get_build_report', 'get_build_report_html_content', 'get_test_runs', 'query_test_runs',
+                      'get_test_run_statistics')
+
+SYNTHETIC_PROJECT_ID = '00000000-0000-0000-0000-000000000001'
+SYNTHETIC_ENVTS = ('staging', 'uatcopy1')
+SYNTHETIC_BUILDS_PER_DEFINITION = 5
+SYNTHETIC_TESTS_PER_RUN = 200
+# the failed test results of every run each have an attachment of this many bytes
+SYNTHETIC_ATTACHMENT_SIZE = 10000
+# builds finish on the days before this, so every run's synthetic data is the same
+SYNTHETIC_LATEST_FINISH_TIME = datetime(2026, 1, 31, tzinfo=timezone.utc)
+SYNTHETIC_REPORT_CHUNK_SIZE = 4096
+# most build ids ADO takes in one query_test_runs call
+SYNTHETIC_QUERY_TEST_RUNS_MAX_BUILD_IDS = 10
+
+
+# API versions whose clients drop the continuation token of paged endpoints, returning just the page's list
+UNPAGED_API_VERSIONS = ('v6_0',)
+
+
+class PagedResponse(object):
+    """The shape of the released (and v5_1) azure.devops clients' paged responses, e.g. GetDefinitionsResponseValue
+    """
+
+    def __init__(self, value, continuation_token):
+        self.value = value
+        self.continuation_token = continuation_token
+
+
+def return_throttled_error():
+    """
+    :return: the error azure.devops raises for a throttled (429) ADO response - an AzureDevOpsServiceError with
+             neither the status code nor the response, as the real one has
+    """
+    return return_service_error('TF400733: The request has been canceled: Request was blocked due to exceeding'
+                                ' usage of resource \'Concurrency\' in namespace \'User\'.',
+                                'RequestBlockedException', event_id=3000)
+
+
+def return_service_error(message, type_key, event_id=0):
+    """
+    :return: an AzureDevOpsServiceError, as azure.devops raises for the (JSON wrapped) errors ADO responds with
+    """
+    from azure.devops._models import WrappedException
+    from azure.devops.exceptions import AzureDevOpsServiceError
+
+    return AzureDevOpsServiceError(WrappedException(
+        message=message, type_name='Microsoft.TeamFoundation.Framework.Server.%s' % type_key, type_key=type_key,
+        error_code=0, event_id=event_id))
+
+
+def return_client_name(client_getter_name):
+    """
+    :param client_getter_name: name of the Connection clients method, e.g. 'get_test_results_client'
+    :return: name of the azure.devops client class it builds, e.g. 'TestResultsClient'
+    """
+    return ''.join(part.title() for part in client_getter_name[len('get_'):].split('_'))
+
+
+def return_fixture_key(endpoint, args, kwargs):
+    """
+    :return: file name safe key for one call of an endpoint with these arguments
+    """
+    call = json.dumps([endpoint, list(args), sorted(kwargs.items())], default=str)
+    return '%s-%s' % (endpoint, hashlib.sha1(call.encode('utf-8')).hexdigest())
+
+
+class FixtureStore(object):
+    """Directory of recorded ADO client responses, one pickled file per distinct call - pickled, as in ado_cache,
+    so they replay as the same msrest objects the clients returned
+    """
+
+    def __init__(self, fixtures_path):
+        self.fixtures_path = os.path.abspath(fixtures_path)
+        os.makedirs(fixtures_path, exist_ok=True)
+
+    def _path(self, api_version, client_name, key):
+        return os.path.join(self.fixtures_path, api_version, client_name, key + '.pickle')
+
+    def save(self, api_version, client_name, key, value):
+        path = self._path(api_version, client_name, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'wb') as fixture_file:
+            pickle.dump(value, fixture_file, pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.tmp', path)
+
+    def load(self, api_version, client_name, key):
+        path = self._path(api_version, client_name, key)
+        if not os.path.exists(path):
+            raise BaseException('No fixture recorded for %s %s call %s in %s'
+                                % (api_version, client_name, key, self.fixtures_path))
+        with open(path, 'rb') as fixture_file:
+            return pickle.load(fixture_file)
+
+    def get_client(self, client_getter_name, api_version):
+        return FixtureClient(self, api_version, return_client_name(client_getter_name))
+
+
+class FixtureClient(object):
+    """Stands in for an ADO client, answering the recorded endpoints' calls from a FixtureStore
+    """
+
+    def __init__(self, store, api_version, client_name):
+        self._store = store
+        self._api_version = api_version
+        self.client_name = client_name
+
+    def __getattr__(self, name):
+        if name not in RECORDED_ENDPOINTS:
+            raise AttributeError('%s has no recorded endpoint %s' % (self.client_name, name))
+
+        def replayed_call(*args, **kwargs):
+            value = self._store.load(self._api_version, self.client_name, return_fixture_key(name, args, kwargs))
+            # streamed content is recorded as its list of chunks
+            return iter(value) if name == 'get_build_report_html_content' else value
+
+        return replayed_call
+
+
+class RecordingClient(object):
+    """Wraps a real ADO client, saving the response of every call to a recorded endpoint to a FixtureStore
+    """
+
+    def __init__(self, client, store, api_version):
+        self._client = client
+        self._store = store
+        self._api_version = api_version
+        self.client_name = getattr(client, 'client_name', type(client).__name__)
+
+    def __getattr__(self, name):
+        attribute = getattr(self._client, name)
+        if name not in RECORDED_ENDPOINTS:
+            return attribute
+
+        def recorded_call(*args, **kwargs):
+            value = attribute(*args, **kwargs)
+            if name == 'get_build_report_html_content':
+                value = list(value)
+            self._store.save(self._api_version, self.client_name, return_fixture_key(name, args, kwargs), value)
+            return iter(value) if name == 'get_build_report_html_content' else value
+
+        return recorded_call
+
+
+class ReplayClient(object):
+    """Wraps a fixture or synthetic client, adding a per call latency and, now and then, a throttled (429) response.
+
+    Like an azure.devops client, every response (a SimpleNamespace with a status_code and headers) is passed to the
+    hooks in config.hooks, so the status code and Retry-After of a 429 are only to be had from there.
+    """
+
+    def __init__(self, client, latency_seconds=0.0, throttle_rate=0.0, retry_after_seconds=0.05, seed=0):
+        """
+        :param latency_seconds: how long each call takes
+        :param throttle_rate: fraction (0 to 1) of calls to answer with a throttled error (see return_throttled_error)
+        :param retry_after_seconds: the Retry-After given with each throttled response
+        """
+        self._client = client
+        self.client_name = getattr(client, 'client_name', type(client).__name__)
+        self._latency_seconds = latency_seconds
+        self._throttle_rate = throttle_rate
+        self._retry_after_seconds = retry_after_seconds
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.stats = {'calls': 0, 'throttled': 0}
+        self.config = SimpleNamespace(hooks=[])
+
+    def __getattr__(self, name):
+        attribute = getattr(self._client, name)
+        if not callable(attribute) or name.startswith('_'):
+            return attribute
+
+        def replayed_call(*args, **kwargs):
+            with self._lock:
+                self.stats['calls'] += 1
+                throttled = self._random.random() < self._throttle_rate
+                if throttled:
+                    self.stats['throttled'] += 1
+            if self._latency_seconds:
+                time.sleep(self._latency_seconds)
+            if throttled:
+                self._call_hooks(429, {'Retry-After': str(self._retry_after_seconds)})
+                raise return_throttled_error()
+            self._call_hooks(200, {})
+            return attribute(*args, **kwargs)
+
+        return replayed_call
+
+    def _call_hooks(self, status_code, headers):
+        response = SimpleNamespace(status_code=status_code, headers=headers)
+        for hook in self.config.hooks:
+            hook(response)
+
+
+class RecordingTransport(object):
+    """Connection registry transport (see ADOConnectionRegistry.transport) recording real ADO responses as fixtures
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+    def get_client(self, registry, org_url, creds, client_getter_name, api_version):
+        return RecordingClient(registry.build_client(org_url, creds, client_getter_name, api_version), self.store,
+                               api_version)
+
+
+class ReplayTransport(object):
+    """Connection registry transport answering every client call from a backend - a FixtureStore of recorded
+    responses, or a SyntheticADOBackend - rather than ADO, with optional latency and 429 injection
+    """
+
+    def __init__(self, backend, latency_seconds=0.0, throttle_rate=0.0, retry_after_seconds=0.05):
+        self.backend = backend
+        self.latency_seconds = latency_seconds
+        self.throttle_rate = throttle_rate
+        self.retry_after_seconds = retry_after_seconds
+        self.clients = []
+
+    def get_client(self, registry, org_url, creds, client_getter_name, api_version):
+        replay_client = ReplayClient(self.backend.get_client(client_getter_name, api_version), self.latency_seconds,
+                                     self.throttle_rate, self.retry_after_seconds, seed=len(self.clients))
+        self.clients.append(replay_client)
+        return replay_client
+
+    @property
+    def stats(self):
+        return dict((stat, sum(replay_client.stats[stat] for replay_client in self.clients))
+                    for stat in ('calls', 'throttled'))
+
+
+class SyntheticADOBackend(object):
+    """Made up, but realistically shaped, ADO project with n_pipelines testrunner pipelines - so we can measure
+    and regression test our ADO code at any scale without an ADO org.
+
+    Every pipeline is an SF_CloudTests_<envt>_<n> definition under \\Automation\\MyDelivery, with
+    SYNTHETIC_BUILDS_PER_DEFINITION completed builds, each with a build report and one test run with statistics.
+    """
+
+    def __init__(self, n_pipelines, project_name='My Default Project Name'):
+        from azure.devops.v6_0.core import models as core_models
+
+        self.n_pipelines = n_pipelines
+        self.project = core_models.TeamProjectReference(id=SYNTHETIC_PROJECT_ID, name=project_name,
+                                                        state='wellFormed')
+
+    def get_client(self, client_getter_name, api_version):
+        # the same (v6_0 shaped) data whatever the API version, but paged as that version's clients page it
+        if client_getter_name == 'get_core_client':
+            return SyntheticCoreClient(self, api_version)
+        if client_getter_name == 'get_build_client':
+            return SyntheticBuildClient(self, api_version)
+        if client_getter_name == 'get_test_client':
+            return SyntheticTestClient(self, api_version)
+        if client_getter_name == 'get_test_results_client':
+            return SyntheticTestResultsClient(self, api_version)
+        raise BaseException('The synthetic ADO backend has no %s' % client_getter_name)
+
+    # the ids of everything follow from the definition id, so nothing needs to be stored
+    @staticmethod
+    def build_ids_for_definition(definition_id):
+        return [definition_id * 100 + build_index for build_index in range(SYNTHETIC_BUILDS_PER_DEFINITION)]
+
+    @staticmethod
+    def finish_time_for_build(build_id):
+        return SYNTHETIC_LATEST_FINISH_TIME - timedelta(days=build_id % 100, hours=build_id % 7)
+
+    @staticmethod
+    def test_counts_for_build(build_id):
+        failed = build_id % 4
+        return SYNTHETIC_TESTS_PER_RUN - failed, failed
+
+    def definition_name(self, definition_id):
+        return 'SF_CloudTests_%s_%05d' % (SYNTHETIC_ENVTS[definition_id % len(SYNTHETIC_ENVTS)], definition_id)
+
+
+def _page(items, top, continuation_token, api_version):
+    """
+    :return: one page of items - a PagedResponse with the continuation token for the next page, or just the page's
+             list from the clients of UNPAGED_API_VERSIONS, as azure.devops returns them
+    """
+    start = int(continuation_token or 0)
+    end = start + (top or len(items) or 1)
+    if api_version in UNPAGED_API_VERSIONS:
+        return items[start:end]
+    return PagedResponse(items[start:end], str(end) if end < len(items) else None)
+
+
+class SyntheticClient(object):
+    """Base Class for the synthetic clients. Like the azure.devops client of its API version (client_package and
+    client_name), it only has the endpoints that client has - e.g. the released TestClient has no attachment ones.
+    """
+
+    client_package = None
+    client_name = None
+
+    def __init__(self, backend, api_version):
+        self._backend = backend
+        self._api_version = api_version
+        real_client_class = getattr(importlib.import_module('azure.devops.%s.%s' % (api_version, self.client_package)),
+                                    self.client_name)
+        self._endpoints = frozenset(name for name in dir(real_client_class) if not name.startswith('_'))
+
+    def __getattribute__(self, name):
+        if not name.startswith('_') and name not in ('client_package', 'client_name') \
+                and name not in object.__getattribute__(self, '_endpoints'):
+            raise AttributeError("'%s' object (%s) has no attribute '%s'" % (self.client_name, self._api_version, name))
+        return object.__getattribute__(self, name)
+
+
+class SyntheticCoreClient(SyntheticClient):
+    client_package = 'core'
+    client_name = 'CoreClient'
+
+    def get_projects(self, top=None, continuation_token=None, **kwargs):
+        return _page([self._backend.project], top, continuation_token, self._api_version)
+
+    def get_project(self, project_id, include_capabilities=None, include_history=None):
+        if project_id not in (self._backend.project.id, self._backend.project.name):
+            raise return_service_error('TF200016: The following project does not exist: %s.' % project_id,
+                                       'ProjectDoesNotExistWithNameException')
+        return self._backend.project
+
+
+class SyntheticBuildClient(SyntheticClient):
+    client_package = 'build'
+    client_name = 'BuildClient'
+
+    def __init__(self, backend, api_version):
+        from azure.devops.v6_0.build import models as build_models
+
+        SyntheticClient.__init__(self, backend, api_version)
+        self._models = build_models
+
+    def _reference(self, definition_id, model='BuildDefinitionReference', **kwargs):
+        return getattr(self._models, model)(id=definition_id, name=self._backend.definition_name(definition_id),
+                                            path='\\Automation\\MyDelivery', queue_status='enabled', revision=1,
+                                            project=self._backend.project, **kwargs)
+
+    def _build(self, build_id):
+        return self._models.Build(id=build_id, build_number='2026.%d' % build_id, status='completed',
+                                  result='succeeded', uri='vstfs:///Build/Build/%d' % build_id,
+                                  finish_time=self._backend.finish_time_for_build(build_id),
+                                  queue_time=self._backend.finish_time_for_build(build_id) - timedelta(hours=1),
+                                  definition=self._models.DefinitionReference(id=build_id // 100),
+                                  project=self._backend.project)
+
+    def get_definitions(self, project, name=None, path=None, top=None, continuation_token=None, **kwargs):
+        definitions = []
+        if path is None or '\\Automation\\MyDelivery'.startswith(path.rstrip('\\')) or \
+                path.startswith('\\Automation\\MyDelivery'):
+            definitions = [self._reference(definition_id) for definition_id in range(1, self._backend.n_pipelines + 1)]
+        return _page(definitions, top, continuation_token, self._api_version)
+
+    def get_definition(self, project, definition_id, include_latest_builds=None, **kwargs):
+        latest_build = self._build(self._backend.build_ids_for_definition(definition_id)[0])
+        return self._reference(definition_id, model='BuildDefinition', latest_build=latest_build,
+                               latest_completed_build=latest_build, process={'type': 2})
+
+    def get_builds(self, project, definitions=None, min_time=None, max_time=None, top=None, continuation_token=None,
+                   **kwargs):
+        builds = [self._build(build_id) for definition_id in definitions or []
+                  for build_id in self._backend.build_ids_for_definition(definition_id)]
+        builds = [build for build in builds if (min_time is None or build.finish_time > min_time) and
+                  (max_time is None or build.finish_time < max_time)]
+        return _page(builds, top, continuation_token, self._api_version)
+
+    def get_build_report_html_content(self, project, build_id, **kwargs):
+        passed, failed = self._backend.test_counts_for_build(build_id)
+        report = ['<html><body><h2>Summary</h2><table>',
+                  '<tr><td>Total tests</td><td>%d</td></tr>' % (passed + failed),
+                  '<tr><td>Passed</td><td>%d</td></tr>' % passed,
+                  '<tr><td>Failed</td><td>%d</td></tr>' % failed,
+                  '<tr><td>Duration</td><td>0:%02d:13</td></tr></table>' % (build_id % 60),
+                  '<h3>Failed tests</h3><table>']
+        report.extend('<tr><td>Test_%d_%d</td><td>0:00:01</td></tr>' % (build_id, index) for index in range(failed))
+        # the rest of a real report - every test, passed or not
+        report.append('</table><h3>All tests</h3><table>')
+        report.extend('<tr><td>Passed_test_%d</td><td>0:00:01</td></tr>' % index for index in range(passed))
+        report.append('</table></body></html>')
+        html = ''.join(report).encode('utf-8')
+        return iter([html[start:start + SYNTHETIC_REPORT_CHUNK_SIZE]
+                     for start in range(0, len(html), SYNTHETIC_REPORT_CHUNK_SIZE)])
+
+    def get_build_report(self, project, build_id, **kwargs):
+        html = b''.join(self.get_build_report_html_content(project, build_id))
+        return self._models.BuildReportMetadata(build_id=build_id, content=html.decode('utf-8'), type='html')
+
+
+class SyntheticTestClient(SyntheticClient):
+    client_package = 'test'
+    client_name = 'TestClient'
+
+    def __init__(self, backend, api_version):
+        from azure.devops.v6_0.test import models as test_models
+
+        SyntheticClient.__init__(self, backend, api_version)
+        self._models = test_models
+
+    def _test_run(self, build_id):
+        passed, failed = self._backend.test_counts_for_build(build_id)
+        return self._models.TestRun(id=build_id * 10, name='Synthetic run %d' % build_id, state='Completed',
+                                    is_automated=True, total_tests=passed + failed, passed_tests=passed,
+                                    build=self._models.ShallowReference(id=str(build_id)),
+                                    completed_date=self._backend.finish_time_for_build(build_id))
+
+    def get_test_runs(self, project, build_uri=None, **kwargs):
+        return [self._test_run(int(build_uri.rsplit('/', 1)[1]))]
+
+    def query_test_runs(self, project, min_last_updated_date, max_last_updated_date, build_ids=None, top=None,
+                        continuation_token=None, **kwargs):
+        if len(build_ids or []) > SYNTHETIC_QUERY_TEST_RUNS_MAX_BUILD_IDS:
+            raise return_service_error('The number of build ids must not exceed %s.'
+                                       % SYNTHETIC_QUERY_TEST_RUNS_MAX_BUILD_IDS, 'InvalidArgumentValueException')
+        test_runs = [self._test_run(int(build_id)) for build_id in build_ids or []
+                     if min_last_updated_date <= self._backend.finish_time_for_build(int(build_id))
+                     <= max_last_updated_date]
+        return _page(test_runs, top, continuation_token, self._api_version)
+
+    def get_test_run_statistics(self, project, run_id):
+        passed, failed = self._backend.test_counts_for_build(run_id // 10)
+        return self._models.TestRunStatistic(
+            run=self._models.ShallowReference(id=str(run_id)),
+            run_statistics=[self._models.RunStatistic(outcome='Passed', count=passed, state='Completed'),
+                            self._models.RunStatistic(outcome='Failed', count=failed, state='Completed')])
+
+    # every run has one attachment, and each of its failed test results another
+    def get_test_results(self, project, run_id, details_to_include=None, skip=None, top=None, outcomes=None):
+        passed, failed = self._backend.test_counts_for_build(run_id // 10)
+        outcomes_by_result_id = [(result_id, 'Failed' if result_id <= failed else 'Passed')
+                                 for result_id in range(1, passed + failed + 1)]
+        start = skip or 0
+        end = start + (top or len(outcomes_by_result_id))
+        return [self._models.TestCaseResult(id=result_id, outcome=outcome,
+                                            test_run=self._models.ShallowReference(id=str(run_id)))
+                for result_id, outcome in outcomes_by_result_id[start:end]]
+
+    def _attachment(self, run_id, result_id):
+        return self._models.TestAttachment(id=1, file_name='%s.log' % ('run' if result_id is None else result_id),
+                                           attachment_type='GeneralAttachment', size=SYNTHETIC_ATTACHMENT_SIZE)
+
+    def get_test_run_attachments(self, project, run_id):
+        return [self._attachment(run_id, None)]
+
+    def get_test_result_attachments(self, project, run_id, test_case_result_id):
+        _, failed = self._backend.test_counts_for_build(run_id // 10)
+        return [self._attachment(run_id, test_case_result_id)] if test_case_result_id <= failed else []
+
+    @staticmethod
+    def _attachment_content(run_id, result_id):
+        line = ('Synthetic log of run %s, result %s\n' % (run_id, result_id)).encode('utf-8')
+        content = (line * (SYNTHETIC_ATTACHMENT_SIZE // len(line) + 1))[:SYNTHETIC_ATTACHMENT_SIZE]
+        return iter([content[start:start + SYNTHETIC_REPORT_CHUNK_SIZE]
+                     for start in range(0, len(content), SYNTHETIC_REPORT_CHUNK_SIZE)])
+
+    def get_test_run_attachment_content(self, project, run_id, attachment_id, **kwargs):
+        return self._attachment_content(run_id, None)
+
+    def get_test_result_attachment_content(self, project, run_id, test_case_result_id, attachment_id, **kwargs):
+        return self._attachment_content(run_id, test_case_result_id)
+
+
+class SyntheticTestResultsClient(SyntheticTestClient):
+    client_package = 'test_results'
+    client_name = 'TestResultsClient'
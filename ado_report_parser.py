@@ -0,0 +1,127 @@
+import codecs
+import re
+from html.parser import HTMLParser
+
+
+# label text in a build report (lower cased, without any trailing ':') -> summary field its count goes in
+COUNT_LABELS = {'total tests': 'total',
+                'total': 'total',
+                'passed': 'passed',
+                'failed': 'failed',
+                'skipped': 'skipped',
+                'not executed': 'skipped',
+                'notexecuted': 'skipped',
+                'others': 'other',
+                'other': 'other'}
+DURATION_LABELS = ('duration', 'run duration', 'elapsed time')
+# a heading containing one of these starts the list of failing tests
+FAILING_TESTS_HEADINGS = ('failed tests', 'failing tests', 'test failures')
+# the next heading ends the failing tests section
+SECTION_TAGS = ('h1', 'h2', 'h3', 'h4', 'h5', 'h6')
+# cells we take failing test names from
+NAME_TAGS = ('a', 'td', 'li')
+MAX_FAILING_TESTS = 50
+
+COUNT_RE = re.compile(r'^\d[\d,]*$')
+TIME_RE = re.compile(r'^\d+(:\d+)+(\.\d+)?$')
+
+
+class BuildReportSummaryParser(HTMLParser):
+    """Incremental parser pulling a test summary out of an ADO build report (BuildReportMetadata.content),
+    without keeping the html itself.
+
+    feed() it the report a chunk at a time as it downloads, then close() it and read summary():
+      - 'total', 'passed', 'failed', 'skipped', 'other': the number following each of those labels
+      - 'duration': the text following a duration label
+      - 'failing_tests': the names listed under a failed tests heading (up to MAX_FAILING_TESTS)
+    Anything not found in the report is None (or an empty list).
+    """
+
+    def __init__(self):
+        HTMLParser.__init__(self, convert_charrefs=True)
+        self.counts = dict((field, None) for field in set(COUNT_LABELS.values()))
+        self.duration = None
+        self.failing_tests = []
+
+        self._pending_label = None
+        self._in_failing_tests = False
+        self._name_tag_depth = 0
+        # HTMLParser can hand us a piece of text split across feed() calls, so only look at it once a tag ends it
+        self._text_parts = []
+
+    def handle_starttag(self, tag, attrs):
+        self._handle_text()
+        if tag in SECTION_TAGS:
+            self._in_failing_tests = False
+        if tag in NAME_TAGS:
+            self._name_tag_depth += 1
+
+    def handle_endtag(self, tag):
+        self._handle_text()
+        if tag in NAME_TAGS and self._name_tag_depth:
+            self._name_tag_depth -= 1
+
+    def handle_data(self, data):
+        self._text_parts.append(data)
+
+    def close(self):
+        HTMLParser.close(self)
+        self._handle_text()
+
+    def _handle_text(self):
+        text = ''.join(self._text_parts).strip()
+        self._text_parts = []
+        if not text:
+            return
+        label = text.rstrip(':').strip().lower()
+
+        if any(heading in label for heading in FAILING_TESTS_HEADINGS):
+            self._in_failing_tests = True
+            self._pending_label = None
+            return
+
+        if label in COUNT_LABELS or label in DURATION_LABELS:
+            self._pending_label = label
+            return
+
+        if self._pending_label in COUNT_LABELS:
+            if COUNT_RE.match(text):
+                field = COUNT_LABELS[self._pending_label]
+                if self.counts[field] is None:
+                    self.counts[field] = int(text.replace(',', ''))
+            self._pending_label = None
+            return
+
+        if self._pending_label in DURATION_LABELS:
+            if self.duration is None:
+                self.duration = text
+            self._pending_label = None
+            return
+
+        if self._in_failing_tests and self._name_tag_depth and not COUNT_RE.match(text) and not TIME_RE.match(text) \
+                and len(self.failing_tests) < MAX_FAILING_TESTS and text not in self.failing_tests:
+            self.failing_tests.append(text)
+
+    def summary(self):
+        our_summary = dict(self.counts)
+        our_summary['duration'] = self.duration
+        our_summary['failing_tests'] = list(self.failing_tests)
+        return our_summary
+
+
+def parse_build_report_stream(chunks, encoding='utf-8'):
+    """
+    :param chunks: iterable of bytes (or str) chunks of a build report's html, e.g. as it downloads
+    :return: summary dict, see BuildReportSummaryParser
+    """
+    parser = BuildReportSummaryParser()
+    # decode incrementally, so a multi byte character split across chunks is still decoded properly
+    decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+
+    for chunk in chunks:
+        parser.feed(decoder.decode(chunk) if isinstance(chunk, bytes) else chunk)
+
+    parser.feed(decoder.decode(b'', final=True))
+    parser.close()
+
+    return parser.summary()
@@ -0,0 +1,305 @@
+import logging
+import random
+import re
+import threading
+import time
+
+
+logger = logging.getLogger()
+
+# HTTP status codes worth trying again - throttled or a transient server side problem
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+# names of the (requests / urllib3) exceptions raised for network problems, which are also worth trying again
+RETRY_EXCEPTION_NAMES = ('ConnectionError', 'Timeout', 'ConnectTimeout', 'ReadTimeout')
+# client methods that only read. Anything else (update_definition, queue_build...) may have taken effect even though
+# it failed with a 5xx or timed out, so is only retried when throttled - ADO turns those away before acting on them.
+READ_ONLY_METHOD_PREFIXES = ('get_', 'query_', 'list_')
+
+# ADO allows 200 TSTUs (throughput units) per user per 5 minute sliding window. A typical GET costs a fraction of
+# a TSTU, so start at a rate that sits well inside that, and back off further as soon as ADO tells us it is delaying
+# our requests (X-RateLimit-Delay) or is close to the limit (X-RateLimit-Remaining).
+# https://docs.microsoft.com/en-us/azure/devops/integrate/concepts/rate-limits
+DEFAULT_REQUESTS_PER_SECOND = 10.0
+DEFAULT_BURST = 20
+DEFAULT_MIN_REQUESTS_PER_SECOND = 0.5
+DEFAULT_MAX_CONCURRENCY_PER_ENDPOINT = 4
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_BACKOFF_BASE_SECONDS = 1.0
+DEFAULT_BACKOFF_CAP_SECONDS = 60.0
+# once X-RateLimit-Remaining drops below this fraction of X-RateLimit-Limit, slow down
+LOW_REMAINING_FRACTION = 0.1
+
+
+class TokenBucket(object):
+    """Thread safe token bucket - acquire() blocks until a request is allowed to go.
+
+    The rate can be changed on the fly (see ADORequestScheduler.slow_down / speed_up), and pause_until stops
+    every request until a given time, e.g. for a Retry-After.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._tokens = float(capacity)
+        self._last_refill = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last_refill) * self.rate)
+                self._last_refill = now
+
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                elif self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                else:
+                    wait = (1 - self._tokens) / self.rate
+
+            time.sleep(wait)
+
+    def pause_until(self, until):
+        """
+        :param until: time.monotonic() value before which no more tokens are handed out
+        """
+        with self._lock:
+            self._paused_until = max(self._paused_until, until)
+
+
+class ADORequestScheduler(object):
+    """Central scheduler every ADO client call goes through (see ScheduledClient).
+
+    - a token bucket paces requests across all endpoints, slowing down (multiplicatively) when ADO says it is
+      delaying us or we are near the rate limit, and speeding back up (additively) while it does not
+    - each endpoint (e.g. 'BuildClient.get_definition') has its own cap on requests in flight
+    - throttled (429), 5xx and network failures are retried with jittered exponential backoff, or after the
+      Retry-After ADO gave us - writes only when throttled
+
+    azure.devops raises most failed responses (429s included) as an AzureDevOpsServiceError, which carries neither
+    the status code nor the response, so the status code and headers of each thread's latest response are kept
+    from the response hook (see ScheduledClient) to tell why a call failed.
+    """
+
+    def __init__(self, requests_per_second=DEFAULT_REQUESTS_PER_SECOND, burst=DEFAULT_BURST,
+                 max_concurrency_per_endpoint=DEFAULT_MAX_CONCURRENCY_PER_ENDPOINT, max_retries=DEFAULT_MAX_RETRIES,
+                 backoff_base_seconds=DEFAULT_BACKOFF_BASE_SECONDS, backoff_cap_seconds=DEFAULT_BACKOFF_CAP_SECONDS,
+                 min_requests_per_second=DEFAULT_MIN_REQUESTS_PER_SECOND):
+        self.max_requests_per_second = float(requests_per_second)
+        self.min_requests_per_second = float(min_requests_per_second)
+        self.bucket = TokenBucket(requests_per_second, burst)
+        self.max_concurrency_per_endpoint = max_concurrency_per_endpoint
+        self.max_retries = max_retries
+        self.backoff_base_seconds = backoff_base_seconds
+        self.backoff_cap_seconds = backoff_cap_seconds
+        self.stats = {'requests': 0, 'retries': 0, 'throttled': 0, 'failed': 0}
+
+        self._lock = threading.Lock()
+        self._endpoint_semaphores = {}
+        # the latest response each thread has had, from response_hook
+        self._local = threading.local()
+
+    def _endpoint_semaphore(self, endpoint):
+        with self._lock:
+            if endpoint not in self._endpoint_semaphores:
+                self._endpoint_semaphores[endpoint] = threading.BoundedSemaphore(self.max_concurrency_per_endpoint)
+            return self._endpoint_semaphores[endpoint]
+
+    def _count(self, stat):
+        with self._lock:
+            self.stats[stat] += 1
+
+    def call(self, endpoint, func, *args, **kwargs):
+        """
+        Make one ADO client call, paced and retried as needed
+
+        :param endpoint: name of the endpoint being called, e.g. 'BuildClient.get_definition'
+        :param func: the client method to call
+        :return: whatever func returns
+        """
+        return self.call_and_count(endpoint, func, args, kwargs, {})
+
+    def call_and_count(self, endpoint, func, args, kwargs, call_stats):
+        """
+        As call, also counting the retries the call takes
+
+        :param call_stats: dict, its 'retries' set to the number of retries so far as the call goes
+        :return: whatever func returns
+        """
+        read_only = is_read_only_endpoint(endpoint)
+        attempt = 0
+        while True:
+            with self._endpoint_semaphore(endpoint):
+                self.bucket.acquire()
+                self._count('requests')
+                self._local.response = None
+                try:
+                    result = func(*args, **kwargs)
+                except Exception as e:
+                    response = getattr(e, 'response', None)
+                    if response is None:
+                        response = self._local.response
+                    status_code = return_status_code(e, response)
+                    if not is_retryable(e, status_code, read_only) or attempt >= self.max_retries:
+                        self._count('failed')
+                        raise
+                    error = e
+                else:
+                    self.speed_up()
+                    return result
+
+            # retry outside the endpoint semaphore, so we don't hold up other callers while we wait
+            attempt += 1
+            call_stats['retries'] = attempt
+            self._count('retries')
+            retry_after = return_retry_after_seconds(response)
+            if status_code == 429:
+                self._count('throttled')
+                self.slow_down()
+            if retry_after is not None:
+                delay = retry_after
+                self.bucket.pause_until(time.monotonic() + retry_after)
+            else:
+                # "full jitter" backoff - spreads our workers' retries out rather than having them all retry at once
+                delay = random.uniform(0, min(self.backoff_cap_seconds, self.backoff_base_seconds * 2 ** attempt))
+
+            logger.warning('ADO call %s failed (%s), retry %s of %s in %.1f seconds'
+                           % (endpoint, status_code or type(error).__name__, attempt, self.max_retries, delay))
+            time.sleep(delay)
+
+    def slow_down(self):
+        with self._lock:
+            self.bucket.rate = max(self.min_requests_per_second, self.bucket.rate / 2)
+
+    def speed_up(self):
+        with self._lock:
+            if self.bucket.rate < self.max_requests_per_second:
+                self.bucket.rate = min(self.max_requests_per_second, self.bucket.rate + 0.1)
+
+    def observe_response_headers(self, headers):
+        """
+        React to the rate limiting headers on an ADO response (Retry-After, X-RateLimit-*)
+
+        :param headers: case insensitive dict of response headers
+        """
+        retry_after = return_retry_after_seconds_from_headers(headers)
+        if retry_after is not None:
+            self.bucket.pause_until(time.monotonic() + retry_after)
+
+        delay = _float_or_none(headers.get('X-RateLimit-Delay'))
+        remaining = _float_or_none(headers.get('X-RateLimit-Remaining'))
+        limit = _float_or_none(headers.get('X-RateLimit-Limit'))
+        if delay or (remaining is not None and limit and remaining < limit * LOW_REMAINING_FRACTION):
+            self.slow_down()
+
+    def response_hook(self, response, *args, **kwargs):
+        # requests 'response' hook signature - runs on the thread making the call
+        self._local.response = response
+        self.observe_response_headers(response.headers)
+        return response
+
+
+class ScheduledClient(object):
+    """Wraps an ADO client so every method call on it goes through an ADORequestScheduler, and is measured by an
+    ado_metrics.ADOCallMetrics if given one.
+    Everything else (attributes, config) is passed straight through to the wrapped client.
+    """
+
+    def __init__(self, client, scheduler, api_version=None, metrics=None):
+        """
+        :param api_version: API version of the client, as used by ado_utils.OurADOObj.get_client - for metrics
+        """
+        self._client = client
+        self._scheduler = scheduler
+        self._api_version = api_version
+        self._metrics = metrics
+        # wrappers (e.g. ado_replay's) give the name of the client they stand in for
+        self._client_name = getattr(client, 'client_name', type(client).__name__)
+        install_response_hook(client, scheduler.response_hook)
+        if metrics is not None:
+            install_response_hook(client, metrics.response_hook)
+
+    def __getattr__(self, name):
+        attribute = getattr(self._client, name)
+        if not callable(attribute) or name.startswith('_'):
+            return attribute
+
+        endpoint = '%s.%s' % (self._client_name, name)
+
+        def scheduled_call(*args, **kwargs):
+            if self._metrics is None:
+                return self._scheduler.call(endpoint, attribute, *args, **kwargs)
+            return self._metrics.measure(endpoint, self._api_version, lambda call_stats: (
+                self._scheduler.call_and_count(endpoint, attribute, args, kwargs, call_stats)))
+
+        return scheduled_call
+
+
+def install_response_hook(client, response_hook):
+    """
+    Have the client's msrest configuration pass every response to response_hook (e.g. so the scheduler sees every
+    response's headers), where the installed msrest supports response hooks
+    """
+    config = getattr(client, 'config', None)
+    hooks = getattr(config, 'hooks', None)
+    if isinstance(hooks, list) and response_hook not in hooks:
+        hooks.append(response_hook)
+
+
+def return_status_code(exception, response=None):
+    """
+    :param response: the response the exception was raised for, if known
+    :return: the HTTP status code an ADO client exception was raised for, or None if it wasn't an HTTP error
+    """
+    for candidate in (exception, response, getattr(exception, 'response', None),
+                      getattr(exception, 'inner_exception', None)):
+        status_code = getattr(candidate, 'status_code', None)
+        if isinstance(status_code, int):
+            return status_code
+
+    # azure.devops only puts it in the message - 'Operation returned a 429 status code.'
+    match = re.search(r'returned an? (\d{3}) status code', str(exception))
+    if match:
+        return int(match.group(1))
+
+    return None
+
+
+def is_read_only_endpoint(endpoint):
+    """
+    :param endpoint: e.g. 'BuildClient.get_definition'
+    """
+    return endpoint.rsplit('.', 1)[-1].startswith(READ_ONLY_METHOD_PREFIXES)
+
+
+def is_retryable(exception, status_code, read_only=True):
+    if not read_only:
+        return status_code == 429
+    if status_code is not None:
+        return status_code in RETRY_STATUS_CODES
+
+    for candidate in (exception, getattr(exception, 'inner_exception', None)):
+        if candidate is not None and any(cls.__name__ in RETRY_EXCEPTION_NAMES for cls in type(candidate).__mro__):
+            return True
+
+    return False
+
+
+def return_retry_after_seconds(response):
+    if response is None or getattr(response, 'headers', None) is None:
+        return None
+    return return_retry_after_seconds_from_headers(response.headers)
+
+
+def return_retry_after_seconds_from_headers(headers):
+    return _float_or_none(headers.get('Retry-After'))
+
+
+def _float_or_none(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
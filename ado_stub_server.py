@@ -0,0 +1,238 @@
+import argparse
+import json
+import logging
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from msrest import Deserializer
+
+from ado_replay import SyntheticADOBackend
+
+logger = logging.getLogger()
+
+DEFAULT_PORT = 8099
+DEFAULT_PIPELINES = 100
+
+# (route name, path pattern under the org url) for every REST endpoint ado_async calls for our reports
+STUB_ROUTES = (('projects', re.compile(r'^/_apis/projects$')),
+               ('definitions', re.compile(r'^/(?P<project>[^/]+)/_apis/build/definitions$')),
+               ('definition', re.compile(r'^/(?P<project>[^/]+)/_apis/build/definitions/(?P<id>\d+)$')),
+               ('builds', re.compile(r'^/(?P<project>[^/]+)/_apis/build/builds$')),
+               ('build_report', re.compile(r'^/(?P<project>[^/]+)/_apis/build/builds/(?P<id>\d+)/report$')),
+               ('test_runs', re.compile(r'^/(?P<project>[^/]+)/_apis/test/runs$')),
+               ('test_run_statistics', re.compile(r'^/(?P<project>[^/]+)/_apis/test/runs/(?P<id>\d+)/Statistics$')))
+
+
+class ADOStubServer(object):
+    """Local HTTP server answering the ADO REST endpoints ado_async calls, from a backend (see
+    ado_replay.SyntheticADOBackend) - point an AsyncADOSession's org url at .url to run against it.
+
+    Every request can be made to take latency_seconds, and a throttle_rate fraction of them are answered with a 429
+    and a Retry-After, so retrying and backing off can be tested (and measured) as well.
+    """
+
+    def __init__(self, backend, host='127.0.0.1', port=0, latency_seconds=0.0, throttle_rate=0.0,
+                 retry_after_seconds=0.05, seed=0):
+        """
+        :param port: port to listen on, any free one if 0
+        """
+        self.backend = backend
+        self.latency_seconds = latency_seconds
+        self.throttle_rate = throttle_rate
+        self.retry_after_seconds = retry_after_seconds
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.stats = {'requests': 0, 'throttled': 0, 'errors': 0}
+        # ADO sends the continuation token of every paged endpoint (in x-ms-continuationtoken) - the backend's v5_1
+        # clients hand it back to us, where its v6_0 ones drop it as azure.devops does
+        self._clients = dict((client_getter_name, backend.get_client(client_getter_name, 'v5_1'))
+                             for client_getter_name in ('get_core_client', 'get_build_client', 'get_test_client'))
+
+        stub_server = self
+
+        class StubRequestHandler(BaseHTTPRequestHandler):
+            # keep-alive, as ADO does
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                stub_server.handle_request(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer((host, port), StubRequestHandler)
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return 'http://%s:%s' % (host, port)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        logger.info('ADO stub server listening on %s' % self.url)
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def _count(self, stat):
+        with self._lock:
+            self.stats[stat] += 1
+
+    def handle_request(self, handler):
+        self._count('requests')
+        with self._lock:
+            throttled = self._random.random() < self.throttle_rate
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+        if throttled:
+            self._count('throttled')
+            self._send(handler, 429, b'{"message": "Request was blocked due to exceeding usage of resource"}',
+                       'application/json', {'Retry-After': str(self.retry_after_seconds)})
+            return
+
+        url = urlparse(handler.path)
+        query = dict((name, values[0]) for name, values in parse_qs(url.query).items())
+        for route_name, pattern in STUB_ROUTES:
+            match = pattern.match(url.path)
+            if match:
+                break
+        else:
+            self._count('errors')
+            self._send(handler, 404, json.dumps({'message': 'No stub for %s' % url.path}).encode('utf-8'),
+                       'application/json')
+            return
+
+        try:
+            body, content_type, headers = getattr(self, '_route_' + route_name)(match.groupdict(), query)
+        except Exception as e:
+            logger.exception('ADO stub server failed to answer %s' % handler.path)
+            self._count('errors')
+            self._send(handler, 500, json.dumps({'message': str(e)}).encode('utf-8'), 'application/json')
+            return
+        self._send(handler, 200, body, content_type, headers)
+
+    @staticmethod
+    def _send(handler, status, body, content_type, headers=None):
+        handler.send_response(status)
+        handler.send_header('Content-Type', content_type)
+        handler.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            handler.send_header(name, value)
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    @staticmethod
+    def _json(response):
+        """
+        :param response: a model, a list of models, or a paged response with .value and .continuation_token
+        :return: tuple of (body, content type, headers) as ADO would send them
+        """
+        headers = {}
+        if hasattr(response, 'value'):
+            if response.continuation_token:
+                headers['x-ms-continuationtoken'] = response.continuation_token
+            response = response.value
+        if isinstance(response, list):
+            body = {'count': len(response), 'value': [model.serialize(keep_readonly=True) for model in response]}
+        else:
+            body = response.serialize(keep_readonly=True)
+        return json.dumps(body).encode('utf-8'), 'application/json; charset=utf-8', headers
+
+    @staticmethod
+    def _top(query):
+        return int(query['$top']) if '$top' in query else None
+
+    def _route_projects(self, route, query):
+        return self._json(self._clients['get_core_client'].get_projects(
+            top=self._top(query), continuation_token=query.get('continuationToken')))
+
+    def _route_definitions(self, route, query):
+        return self._json(self._clients['get_build_client'].get_definitions(
+            route['project'], name=query.get('name'), path=query.get('path'), top=self._top(query),
+            continuation_token=query.get('continuationToken')))
+
+    def _route_definition(self, route, query):
+        return self._json(self._clients['get_build_client'].get_definition(
+            route['project'], int(route['id']), include_latest_builds=query.get('includeLatestBuilds') == 'true'))
+
+    def _route_builds(self, route, query):
+        min_time = Deserializer.deserialize_iso(query['minTime']) if 'minTime' in query else None
+        max_time = Deserializer.deserialize_iso(query['maxTime']) if 'maxTime' in query else None
+        definitions = [int(definition_id) for definition_id in query.get('definitions', '').split(',') if definition_id]
+        return self._json(self._clients['get_build_client'].get_builds(
+            route['project'], definitions=definitions, min_time=min_time, max_time=max_time, top=self._top(query),
+            continuation_token=query.get('continuationToken')))
+
+    def _route_build_report(self, route, query):
+        chunks = self._clients['get_build_client'].get_build_report_html_content(route['project'], int(route['id']))
+        return b''.join(chunks), 'text/html; charset=utf-8', {}
+
+    def _route_test_runs(self, route, query):
+        test_client = self._clients['get_test_client']
+        if 'buildUri' in query:
+            return self._json(test_client.get_test_runs(route['project'], build_uri=query['buildUri']))
+        return self._json(test_client.query_test_runs(
+            route['project'], Deserializer.deserialize_iso(query['minLastUpdatedDate']),
+            Deserializer.deserialize_iso(query['maxLastUpdatedDate']), build_ids=query.get('buildIds', '').split(','),
+            top=self._top(query), continuation_token=query.get('continuationToken')))
+
+    def _route_test_run_statistics(self, route, query):
+        return self._json(self._clients['get_test_client'].get_test_run_statistics(route['project'],
+                                                                                   int(route['id'])))
+
+
+def main():
+    """
+    Run a stub ADO org, with synthetic testrunner pipelines, until interrupted
+
+    :return: 0
+    """
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    parser = argparse.ArgumentParser(description='Serve a stub ADO org, with synthetic testrunner pipelines.')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT,
+                        help="Port to listen on (default %s)" % DEFAULT_PORT)
+    parser.add_argument('--pipelines', type=int, default=DEFAULT_PIPELINES,
+                        help="Number of synthetic pipelines (default %s)" % DEFAULT_PIPELINES)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help="Seconds each request takes")
+    parser.add_argument('--throttle-rate', type=float, default=0.0,
+                        help="Fraction (0 to 1) of requests to answer with a 429")
+
+    args = parser.parse_args()
+
+    stub_server = ADOStubServer(SyntheticADOBackend(args.pipelines), port=args.port, latency_seconds=args.latency,
+                                throttle_rate=args.throttle_rate)
+    stub_server.start()
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stub_server.stop()
+        logger.info('Requests: %(requests)s, throttled: %(throttled)s, errors: %(errors)s' % stub_server.stats)
+
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
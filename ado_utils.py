@@ -1,6 +1,17 @@
-from azure.devops.connection import Connection
+import ado_cache
+import ado_metrics
+import ado_report_parser
+import ado_scheduler
+import agent_fleet
+from collections import namedtuple
+from concurrent.futures import as_completed
+from datetime import timedelta
 import logging
+import os
+import re
 import sys
+import threading
+from results_sink import ResultsTable
 
 
 logger = logging.getLogger()
@@ -20,49 +31,433 @@ if logger.hasHandlers():
 logger.addHandler(handler)
 
 
+# query_test_runs only allows a date range of up to 7 days per query. Windows are padded by a day either side of the
+# builds' finish times, so group builds finishing within 5 days of each other into one query.
+TEST_RUN_QUERY_MAX_BUILD_SPREAD = timedelta(days=5)
+TEST_RUN_QUERY_WINDOW_PADDING = timedelta(days=1)
+# build ids per query_test_runs call (ADO allows at most 10) and test runs per page
+TEST_RUN_QUERY_BUILD_IDS_PER_QUERY = 10
+TEST_RUN_QUERY_PAGE_SIZE = 100
+# test results per get_test_results page (ADO's most without details), and test logs per get_test_result_logs page
+TEST_RESULTS_PAGE_SIZE = 1000
+TEST_RESULT_LOGS_PAGE_SIZE = 100
+# the released test client has no attachment endpoints
+ATTACHMENTS_API_VERSION = 'v6_0'
+
+# queue statuses a build definition can be set to, and the outcomes of setting them in bulk
+QUEUE_STATUSES = ('disabled', 'enabled', 'paused')
+QUEUE_STATUS_OUTCOMES = ('updated', 'unchanged', 'would_update', 'failed')
+
+# where our pipelines are, unless told otherwise
+DEFAULT_ORG_URL = 'https://mycompany.visualstudio.com'
+DEFAULT_PROJECT_NAME = 'My Default Project Name'
+DEFAULT_TOP_LEVEL_FOLDER_PATH = '\\Automation'
+PROJECTS_PAGE_SIZE = 100
+# definition ids per get_builds call when getting the builds of many definitions at once (they go in the url)
+BUILDS_QUERY_DEFINITIONS_PER_QUERY = 100
+
+# Attribute on an azure.devops Connection holding the clients factory for each API version we use
+API_VERSION_CLIENTS_ATTRS = {'released': 'clients',
+                             'v5_1': 'clients_v5_1',
+                             'v6_0': 'clients_v6_0'}
+
+
+def api_version_for(use_v6_api):
+    """
+    :param use_v6_api: bool - the use_v6_api flag taken by our ADO object methods
+    :return: API version key, as used by OurADOObj.get_client
+    """
+    return 'v6_0' if use_v6_api else 'released'
+
+
+def paging_api_version_for(use_v6_api):
+    """
+    The v6_0 clients return just the list from endpoints ADO pages with continuation tokens, dropping the token for
+    the next page (sent in the x-ms-continuationtoken header), so we page those endpoints with the v5_1 clients
+    instead - which return it, with the page's list in .value, as the released clients do.
+
+    :param use_v6_api: bool - the use_v6_api flag taken by our ADO object methods
+    :return: API version key, as used by OurADOObj.get_client
+    """
+    return 'v5_1' if use_v6_api else 'released'
+
+
+class ADOConnectionRegistry(object):
+    """Process-wide registry of ADO Connections, clients and projects, shared by all our ADO objects.
+
+    Connections are keyed by org url and credentials, clients additionally by API version and client type,
+    so every object talking to the same org borrows the same HTTP sessions (and keep-alive connections)
+    rather than opening its own.
+
+    Every client handed out makes its calls through our scheduler (ado_scheduler.ADORequestScheduler), which paces
+    and retries them - replace the scheduler before getting any clients to change its settings, or set it to None
+    to call ADO directly.
+
+    Set a transport (see ado_replay) before getting any clients to have it supply them instead, e.g. to record ADO's
+    responses as fixtures or replay them without ADO.
+
+    The scheduled clients also time and count every call by endpoint and API version, in metrics
+    (ado_metrics.ADOCallMetrics), for the run's summary.
+    """
+
+    def __init__(self, scheduler=None, transport=None):
+        self.scheduler = scheduler if scheduler is not None else ado_scheduler.ADORequestScheduler()
+        self.transport = transport
+        self.metrics = ado_metrics.ADOCallMetrics()
+        self._lock = threading.RLock()
+        self._connections = {}
+        self._clients = {}
+        self._projects = {}
+        # projects looked up on their own by name (see OurADOObj.list_projects), keyed by org, creds and name
+        self._single_projects = {}
+        # how many clients have been constructed vs handed out again from the registry
+        self.client_stats = {'built': 0, 'reused': 0}
+
+    @staticmethod
+    def creds_key(creds):
+        """
+        :param creds: msrest Authentication object (e.g. BasicAuthentication)
+        :return: hashable key identifying these credentials
+        """
+        if hasattr(creds, 'username') and hasattr(creds, 'password'):
+            return type(creds).__name__, creds.username, creds.password
+        return type(creds).__name__, id(creds)
+
+    def get_connection(self, org_url, creds):
+        """
+        :return: azure.devops Connection object shared by everyone using this org url and credentials
+        """
+        key = (org_url, self.creds_key(creds))
+        with self._lock:
+            if key not in self._connections:
+                # azure.devops (and the msrest it brings in) is only imported once we actually talk to ADO
+                from azure.devops.connection import Connection
+                self._connections[key] = Connection(org_url, creds)
+            return self._connections[key]
+
+    def get_client(self, org_url, creds, client_getter_name, api_version='released'):
+        """
+        :param client_getter_name: name of the Connection clients method, e.g. 'get_build_client'
+        :param api_version: one of API_VERSION_CLIENTS_ATTRS keys - 'released', 'v5_1' or 'v6_0'
+        :return: an already built ADO client where there is one, otherwise a newly built (and now shared) client
+        """
+        if api_version not in API_VERSION_CLIENTS_ATTRS:
+            raise BaseException('You must choose one of %s for the ADO client API version.'
+                                % ', '.join(API_VERSION_CLIENTS_ATTRS))
+
+        key = (org_url, self.creds_key(creds), api_version, client_getter_name)
+        with self._lock:
+            if key in self._clients:
+                self.client_stats['reused'] += 1
+            else:
+                if self.transport is not None:
+                    our_client = self.transport.get_client(self, org_url, creds, client_getter_name, api_version)
+                else:
+                    our_client = self.build_client(org_url, creds, client_getter_name, api_version)
+                if self.scheduler is not None:
+                    our_client = ado_scheduler.ScheduledClient(our_client, self.scheduler, api_version=api_version,
+                                                               metrics=self.metrics)
+                self._clients[key] = our_client
+                self.client_stats['built'] += 1
+            return self._clients[key]
+
+    def build_client(self, org_url, creds, client_getter_name, api_version):
+        """
+        :return: a newly built azure.devops client, on the shared Connection for this org url and credentials
+        """
+        connection = self.get_connection(org_url, creds)
+        clients = getattr(connection, API_VERSION_CLIENTS_ATTRS[api_version])
+        logger.info('Building %s ADO %s' % (api_version, client_getter_name[len('get_'):]))
+        return getattr(clients, client_getter_name)()
+
+    def get_project_index(self, org_url, creds, lookup_projects):
+        """
+        :param lookup_projects: callable returning every TeamProjectReference object in the org, only called on
+                                first use for the org
+        :return: dict of project name: TeamProjectReference object
+        """
+        key = (org_url, self.creds_key(creds))
+        with self._lock:
+            if key not in self._projects:
+                self._projects[key] = dict((project.name, project) for project in lookup_projects())
+            return self._projects[key]
+
+    def get_project(self, org_url, creds, project_name, lookup_project):
+        """
+        :param lookup_project: callable returning the project's TeamProject object, only called if neither it nor the
+                               org's project index (see get_project_index) has been got yet
+        :return: TeamProjectReference (or TeamProject) object
+        """
+        key = (org_url, self.creds_key(creds))
+        with self._lock:
+            if project_name in self._projects.get(key, {}):
+                return self._projects[key][project_name]
+            if key + (project_name,) not in self._single_projects:
+                self._single_projects[key + (project_name,)] = lookup_project()
+            return self._single_projects[key + (project_name,)]
+
+    def clear(self):
+        with self._lock:
+            self._connections.clear()
+            self._clients.clear()
+            self._projects.clear()
+            self._single_projects.clear()
+            self.client_stats = {'built': 0, 'reused': 0}
+            self.metrics = ado_metrics.ADOCallMetrics()
+
+
+connection_registry = ADOConnectionRegistry()
+
+# the little we use of each definition we list - kept instead of the whole BuildDefinitionReference object, with its
+# nested project, queue, authored_by and _links objects. A namedtuple, so no per object __dict__ either.
+DefinitionRef = namedtuple('DefinitionRef', ('id', 'name', 'path', 'queue_status'))
+
+
+def return_definition_ref(definition):
+    """
+    :param definition: BuildDefinitionReference, BuildDefinition or DefinitionRef object
+    :return: DefinitionRef
+    """
+    return DefinitionRef(definition.id, definition.name, definition.path, definition.queue_status)
+
+
+class BuildDefinitionFilter(object):
+    """Declarative filter over DefinitionRef records (or anything with their id, name and path), compiled once and
+    applied in a single pass.
+
+    Stages are applied in this order, each one only to definitions that passed the ones before it:
+      - 'path': the definition's folder path contains under_path
+      - one stage per must_include string: the definition name contains it (case insensitive)
+      - 'envt': the definition name contains '_<envt>_' (case insensitive), unless envt is None/'any'/'sf_all'
+      - 'regex': the definition name matches name_regex (re.search)
+    """
+
+    ALL_ENVTS = (None, 'any', 'sf_all')
+
+    def __init__(self, under_path, must_include=(), envt=None, name_regex=None):
+        self.under_path = under_path
+        self.must_include = tuple(must_include)
+        self.envt = envt
+
+        # compile once - (stage name, predicate on lower cased definition name)
+        self._name_stages = [(this_string, self._contains(this_string.lower())) for this_string in self.must_include]
+        if envt not in self.ALL_ENVTS:
+            self._name_stages.append(('envt', self._contains(('_' + envt + '_').lower())))
+        if name_regex:
+            compiled_regex = re.compile(name_regex)
+            self._name_stages.append(('regex', lambda name, lower_name: compiled_regex.search(name) is not None))
+
+    @staticmethod
+    def _contains(lower_substring):
+        return lambda name, lower_name: lower_substring in lower_name
+
+    def stage_names(self):
+        return ['path'] + [stage_name for stage_name, _ in self._name_stages]
+
+    def apply(self, build_def_refs):
+        """
+        :param build_def_refs: iterable of DefinitionRef records
+        :return: tuple of (list of matching DefinitionRef records, de-duplicated by id and in the order given,
+                 dict of stage name: count of definitions still in after that stage)
+        """
+        stage_counts = dict((stage_name, 0) for stage_name in self.stage_names())
+        seen_ids = set()
+        matches = []
+
+        for definition in build_def_refs:
+            # if it does not have a name and id then it is not a build (probably a folder); we don't want it
+            if not (definition.id and definition.name) or definition.id in seen_ids:
+                continue
+            if self.under_path not in definition.path:
+                continue
+            seen_ids.add(definition.id)
+            stage_counts['path'] += 1
+
+            lower_name = definition.name.lower()
+            for stage_name, predicate in self._name_stages:
+                if not predicate(definition.name, lower_name):
+                    break
+                stage_counts[stage_name] += 1
+            else:
+                matches.append(definition)
+
+        return matches, stage_counts
+
+
 class OurADOObj(object):
-    """Base Class for all our Azure Dev Ops API interactions under 'My Default Project Name' project
+    """Base Class for all our Azure Dev Ops API interactions under a project ('My Default Project Name' by default)
     """
 
-    def __init__(self,  creds):
-        self.org_url = 'https://mycompany.visualstudio.com'
-        self.project_name_str = 'My Default Project Name'
-        self.top_level_folder_path = '\\Automation'
+    def __init__(self,  creds, cache=None, org_url=DEFAULT_ORG_URL, project_name=DEFAULT_PROJECT_NAME,
+                 top_level_folder_path=DEFAULT_TOP_LEVEL_FOLDER_PATH):
+        """
+        :param cache: optional ado_cache.ADOResultsCache to serve (and store) what we fetch from ADO
+        :param org_url: url of the ADO organization the project is in
+        :param project_name: name of the ADO project we work under
+        :param top_level_folder_path: folder our pipelines are under in the project
+        """
+        self.org_url = org_url
+        self.project_name_str = project_name
+        self.top_level_folder_path = top_level_folder_path
         self.verbose_logging = False
         self.filtered_build_names_list = []
+        # False to look our project up on its own (by name), rather than listing every project in the org - quicker
+        # for short runs that only need our project
+        self.list_projects = True
+
+        self.creds = creds
+        self.cache = cache
+        # clients this object has already asked for, keyed by (client_getter_name, api_version)
+        self._clients = {}
+        self._clients_lock = threading.Lock()
+        # how many clients this object had to fetch from the registry vs served from its own cache
+        # (see connection_registry.client_stats for how many were actually constructed)
+        self.client_stats = {'fetched': 0, 'reused': 0}
+
+        # our project is only looked up when first used, so creating these is free until we call ADO
+        self._ado_project = None
+        self._ado_project_lock = threading.Lock()
+
+    @property
+    def connection(self):
+        """
+        :return: azure.devops Connection object - shared (with its clients) with our other ADO objects
+        """
+        return connection_registry.get_connection(self.org_url, self.creds)
+
+    @property
+    def ado_project(self):
+        """
+        :return: our project's TeamProjectReference object, looked up on first use - the org's projects are only
+                 listed once
+        """
+        if self._ado_project is None:
+            with self._ado_project_lock:
+                if self._ado_project is None:
+                    self._ado_project = self.return_ado_project_by_name()
+        return self._ado_project
+
+    def get_client(self, client_getter_name, api_version='released'):
+        """
+        :param client_getter_name: name of the Connection clients method, e.g. 'get_build_client'
+        :param api_version: 'released', 'v5_1' or 'v6_0'
+        :return: ADO client shared via the connection registry, cached on this object after first use
+        """
+        key = (client_getter_name, api_version)
+        with self._clients_lock:
+            if key in self._clients:
+                self.client_stats['reused'] += 1
+            else:
+                self._clients[key] = connection_registry.get_client(self.org_url, self.creds,
+                                                                    client_getter_name, api_version)
+                self.client_stats['fetched'] += 1
+            return self._clients[key]
+
+    def get_cached(self, kind, key, fetch, cache_if=None):
+        """
+        :param kind: one of the ado_cache kinds, e.g. ado_cache.BUILD_REPORT
+        :param key: id of the thing we want, within that kind
+        :param fetch: callable getting the thing from ADO, only called if it is not in our cache
+        :param cache_if: optional callable - only cache what fetch returns if this returns True for it
+        :return: the (cached or fetched) thing
+        """
+        if self.cache is None:
+            return fetch()
 
-        # Connect to ADO
-        self.connection = Connection(self.org_url, creds)
-        # Get our project (TeamProjectReference object)
-        self.ado_project = self.return_ado_project_by_name()
+        value = self.cache.get(kind, self.cache_key(key))
+        if value is None:
+            value = fetch()
+            if cache_if is None or cache_if(value):
+                self.cache.put(kind, self.cache_key(key), value)
+
+        return value
+
+    def cache_key(self, key):
+        """
+        :return: key for our cache - ids are only unique within an org, so they are qualified by our project's id
+        """
+        return '%s|%s' % (self.ado_project.id, key)
 
     def return_ado_project_by_name(self):
         """
         :return: TeamProjectReference object
         """
+        if self.list_projects:
+            project = self.return_ado_project_index().get(self.project_name_str)
+        else:
+            project = connection_registry.get_project(self.org_url, self.creds, self.project_name_str,
+                                                      self.get_single_project_by_name)
+        if project is None:
+            raise BaseException('Could not find the project %s in %s' % (self.project_name_str, self.org_url))
+
+        logger.info('Successfully found %s project:' % self.project_name_str)
+        if self.verbose_logging:
+            pretty_log_dict(project.__dict__)
+        return project
+
+    def return_ado_project_index(self):
+        """
+        :return: dict of project name: TeamProjectReference object for every project in our org - listed once
+                 per run (and kept in our cache between runs, if we have one)
+        """
+        def lookup_projects():
+            if self.cache is None:
+                return self.get_list_of_projects()
+            # keyed by org, as we don't have a project (id) yet
+            projects = self.cache.get(ado_cache.PROJECTS, self.org_url)
+            if projects is None:
+                projects = self.get_list_of_projects()
+                self.cache.put(ado_cache.PROJECTS, self.org_url, projects)
+            return projects
+
+        return connection_registry.get_project_index(self.org_url, self.creds, lookup_projects)
+
+    def get_single_project_by_name(self):
+        """
+        :return: our project's TeamProject object, got on its own rather than by listing the org's projects (kept in
+                 our cache between runs, if we have one)
+        """
+        core_client = self.get_client('get_core_client')
+        fetch_project = lambda: core_client.get_project(self.project_name_str)
+        if self.cache is None:
+            return fetch_project()
+
+        # keyed by org and project name, as we don't have a project (id) yet
+        key = '%s|%s' % (self.org_url, self.project_name_str)
+        project = self.cache.get(ado_cache.PROJECTS, key)
+        if project is None:
+            project = fetch_project()
+            self.cache.put(ado_cache.PROJECTS, key, project)
+        return project
+
+    def get_list_of_projects(self):
+        """
+        :return: list of TeamProjectReference objects for every project in our org, following continuation tokens
+        """
         # Get a client (the "core" client provides access to projects, teams, etc)
-        core_client = self.connection.clients.get_core_client()
-        # Get the first page of projects
-        get_projects_response = core_client.get_projects()
+        core_client = self.get_client('get_core_client')
 
-        for project in get_projects_response.value:
-            if project.name == self.project_name_str:
-                logger.info('Successfully found %s project:' % self.project_name_str)
-                if self.verbose_logging:
-                    pretty_log_dict(project.__dict__)
-                return project
+        projects = []
+        continuation_token = None
+        while True:
+            get_projects_response = core_client.get_projects(top=PROJECTS_PAGE_SIZE,
+                                                             continuation_token=continuation_token)
+            projects.extend(get_projects_response.value)
+            continuation_token = get_projects_response.continuation_token
+            if not continuation_token:
+                break
 
-        return False
+        logger.info('Found %s projects in %s' % (len(projects), self.org_url))
+        return projects
 
 
 class ADOTaskAgentObj(OurADOObj):
     """Sub Class for interacting with Task Agent objects in ADO 'My Default Project Name' project
     """
 
-    def __init__(self,  creds, v51_client_version=False):
-        OurADOObj.__init__(self, creds)
+    def __init__(self,  creds, v51_client_version=False, org_url=DEFAULT_ORG_URL, project_name=DEFAULT_PROJECT_NAME):
+        OurADOObj.__init__(self, creds, org_url=org_url, project_name=project_name)
         self.agent_names_list = []
-        self.project_name_str = 'My Default Project Name'
         self.agent_client = self.get_task_agent_client(use_v5_1_api=v51_client_version)
 
     def get_task_agent_client(self, use_v5_1_api=False):
@@ -78,14 +473,7 @@ class ADOTaskAgentObj(OurADOObj):
 
         To call this method the user's PAT token needs to have Agent rights set when the PAT is generated.
         """
-        if use_v5_1_api:
-            logger.info('Using v5.1 of ADO client API - this is not the released version')
-            our_client = self.connection.clients_v5_1.get_task_agent_client()
-        else:
-            logger.info('Using release version of ADO client API')
-            our_client = self.connection.clients.get_task_agent_client()
-
-        return our_client
+        return self.get_client('get_task_agent_client', 'v5_1' if use_v5_1_api else 'released')
 
     def get_agent_pools(self):
         # return a list of TaskAgentPool objects
@@ -98,17 +486,46 @@ class ADOTaskAgentObj(OurADOObj):
         our_pool = self.agent_client.get_agent_pool(pool_id)
         return our_pool
 
-    def get_agents_in_pool(self, pool_id):
+    def get_agents_in_pool(self, pool_id, include_assigned_request=False):
         # return a list of TaskAgent objects
         # 119 is Quality Control Azure
-        pool_agents = self.agent_client.get_agents(pool_id, include_last_completed_request=True)
+        pool_agents = self.agent_client.get_agents(pool_id, include_last_completed_request=True,
+                                                   include_assigned_request=include_assigned_request)
         return pool_agents
 
-    def get_task_agent_queue(self, queue_id, project_name):
+    def get_fleet_snapshot(self, executor, pool_ids=None):
+        """
+        Get the state of every agent in every pool (or just the given pools), listing the pools' agents in parallel
+
+        :param executor: ThreadPoolExecutor
+        :param pool_ids: only these pools, if given
+        :return: dict of (pool id, agent id): agent_fleet.AgentSnapshot
+        """
+        pools = self.get_agent_pools()
+        if pool_ids is not None:
+            pools = [pool for pool in pools if pool.id in pool_ids]
+        logger.info('Getting agents in %s pools' % len(pools))
+
+        # the assigned request tells us whether an agent is busy - capabilities, which we don't need, are left out
+        futures = [(pool, executor.submit(self.get_agents_in_pool, pool.id, include_assigned_request=True))
+                   for pool in pools]
+
+        fleet_snapshot = {}
+        for pool, future in futures:
+            for agent in future.result():
+                fleet_snapshot[(pool.id, agent.id)] = agent_fleet.return_agent_snapshot(pool, agent)
+
+        return fleet_snapshot
+
+    def get_task_agent_queue(self, queue_id, project_name=None):
+        """
+        :param project_name: project the queue is in, defaults to our project
+        :return: TaskAgentQueue object
+        """
         # get_agent_queue only exists in v5.1 of the MS python Client API library
         # /site-packages/azure/devops/v5_1/task_agent/task_agent_client.py
         # So you need to have called get_task_agent_client with use_v5_1_api=True
-        our_agent_queue = self.agent_client.get_agent_queue(1516, project=self.project_name_str)
+        our_agent_queue = self.agent_client.get_agent_queue(queue_id, project=project_name or self.project_name_str)
 
         return our_agent_queue
 
@@ -117,44 +534,152 @@ class ADOBuildObj(OurADOObj):
     """Sub Class for interacting with Build objects in ADO 'My Default Project Name' project
     """
 
-    def __init__(self,  creds, v6_api=False):
-        OurADOObj.__init__(self, creds)
+    def __init__(self,  creds, v6_api=False, definitions_under_path=None, cache=None, org_url=DEFAULT_ORG_URL,
+                 project_name=DEFAULT_PROJECT_NAME, top_level_folder_path=DEFAULT_TOP_LEVEL_FOLDER_PATH):
+        """
+        :param definitions_under_path: folder in ADO to list definitions under, defaults to top_level_folder_path.
+                                       Pass '\\' to list every definition in the project.
+        :param cache: optional ado_cache.ADOResultsCache
+        """
+        OurADOObj.__init__(self, creds, cache=cache, org_url=org_url, project_name=project_name,
+                           top_level_folder_path=top_level_folder_path)
         self.filtered_build_names_list = []
         self.using_v6_build_client = v6_api
-        self.build_def_refs_list_under_project = self.get_list_of_build_definition_references_under_project(v6_api)
+        # BuildDefinition objects fetched during this run, keyed by definition id, so each is only fetched once
+        self._definition_cache = {}
+        self._definition_cache_lock = threading.Lock()
+        if definitions_under_path is None:
+            definitions_under_path = self.top_level_folder_path
+        self.definitions_under_path = definitions_under_path
+        # the definitions under definitions_under_path are only listed when first needed - not at all for
+        # lookups of definitions we already know the ids of (see get_single_build_definition_by_id)
+        self._build_def_refs_list_under_project = None
+        self._build_def_refs_lock = threading.RLock()
+
+    @property
+    def build_def_refs_list_under_project(self):
+        """
+        :return: list of DefinitionRef records under definitions_under_path, listed on first use
+        """
+        if self._build_def_refs_list_under_project is None:
+            with self._build_def_refs_lock:
+                if self._build_def_refs_list_under_project is None:
+                    self.build_def_refs_list_under_project = self.get_list_of_build_definition_references_under_project(
+                        self.using_v6_build_client, path=self.definitions_under_path)
+        return self._build_def_refs_list_under_project
+
+    @build_def_refs_list_under_project.setter
+    def build_def_refs_list_under_project(self, build_def_refs):
+        with self._build_def_refs_lock:
+            self._build_def_refs_list_under_project = build_def_refs
+            self.index_build_definition_references()
+
+    @property
+    def build_def_refs_by_name(self):
+        return self._build_def_refs_index()[0]
+
+    @property
+    def build_def_refs_by_id(self):
+        return self._build_def_refs_index()[1]
+
+    @property
+    def build_def_refs_by_path(self):
+        return self._build_def_refs_index()[2]
+
+    def _build_def_refs_index(self):
+        # listing the definitions (if not done yet) indexes them
+        self.build_def_refs_list_under_project
+        return self._build_def_refs_by_name, self._build_def_refs_by_id, self._build_def_refs_by_path
+
+    def get_list_of_build_definition_references_under_project(self, use_v6_api=False, path=None, name=None):
+        """
+        :param path: only get definitions under this folder in ADO (filtered server side)
+        :param name: only get definitions with this name - may include '*' wildcards (filtered server side)
+        :return: list of DefinitionRef records, each made as soon as its page of definitions arrives
+        """
+        logger.info('Getting definitions under project: %s, path: %s' % (self.ado_project.name, path or '\\'))
+
+        def fetch_definition_refs():
+            return [return_definition_ref(definition)
+                    for definition in self.iter_build_definition_references(use_v6_api, path=path, name=name)]
+
+        definition_refs = self.get_cached(ado_cache.DEFINITION_REFS, '%s|%s' % (path, name), fetch_definition_refs)
+        # cached before we kept DefinitionRefs, these are whole BuildDefinitionReference objects
+        return [definition if isinstance(definition, DefinitionRef) else return_definition_ref(definition)
+                for definition in definition_refs]
 
-    def get_list_of_build_definition_references_under_project(self, use_v6_api=False):
+    def iter_build_definition_references(self, use_v6_api=False, path=None, name=None, page_size=None):
         """
-        :return: list of BuildDefinitionReference objects
+        Lazily yield the definitions under our project a page at a time, following continuation tokens
+        so nothing past the first page is dropped.
+
+        :param path: only get definitions under this folder in ADO (filtered server side)
+        :param name: only get definitions with this name - may include '*' wildcards (filtered server side)
+        :param page_size: definitions to ask for per page (top), server default if None
+        :return: generator of BuildDefinitionReference objects
         """
-        logger.info('Getting definitions under project: %s' % self.ado_project.name)
+        build_client = self.get_client('get_build_client', paging_api_version_for(use_v6_api))
 
-        if use_v6_api:
-            build_client = self.connection.clients_v6_0.get_build_client()
-            logger.info('Using v6.0 ADO build client')
-        else:
-            build_client = self.connection.clients.get_build_client()
-            logger.info('Using release version of ADO build client')
+        continuation_token = None
+        page_count = 0
+        while True:
+            definitions = build_client.get_definitions(self.ado_project.id, name=name, path=path, top=page_size,
+                                                       continuation_token=continuation_token)
+            page_count += 1
+            # a response with the page's list in .value plus the continuation token for the next page
+            continuation_token = definitions.continuation_token
 
-        definitions = build_client.get_definitions(self.ado_project.id)
+            if self.verbose_logging:
+                logger.info('Got page %s of definitions, %s definitions' % (page_count, len(definitions.value)))
 
-        if self.using_v6_build_client:
-            return definitions
-        else:
-            return definitions.value
+            for definition in definitions.value:
+                yield definition
+
+            if not continuation_token:
+                break
+
+    def index_build_definition_references(self):
+        """
+        Build name, id and path lookups over build_def_refs_list_under_project, so we don't have to scan the
+        whole list for every lookup. Done whenever build_def_refs_list_under_project is set.
+        """
+        build_def_refs_by_name = {}
+        build_def_refs_by_id = {}
+        # folder path: list of (listing position, DefinitionRef) in that folder
+        build_def_refs_by_path = {}
+
+        for position, definition in enumerate(self._build_def_refs_list_under_project):
+            # only index definitions that have valid ids and names (anything else is probably a folder)
+            if not (definition.id and definition.name):
+                continue
+            # first one wins, as it did when we scanned the list
+            build_def_refs_by_name.setdefault(definition.name, definition)
+            build_def_refs_by_id.setdefault(definition.id, definition)
+            build_def_refs_by_path.setdefault(definition.path, []).append((position, definition))
+
+        self._build_def_refs_by_name = build_def_refs_by_name
+        self._build_def_refs_by_id = build_def_refs_by_id
+        self._build_def_refs_by_path = build_def_refs_by_path
+
+    def return_build_def_refs_under_path(self, find_under_path):
+        """
+        :param find_under_path: folder in ADO under which to look, e.g. '\\Automation\\MyDelivery'
+        :return: list of DefinitionRef records for all the builds under specified path
+        """
+        # only the distinct folder paths need checking, then put the matches back into listing order
+        matches = [position_and_definition
+                   for path, definitions in self.build_def_refs_by_path.items() if find_under_path in path
+                   for position_and_definition in definitions]
+        matches.sort(key=lambda position_and_definition: position_and_definition[0])
+
+        return [definition for _, definition in matches]
 
     def return_build_names_list_for_builds_under_path(self, find_under_path):
         """
         return: list of strings - definition names of all the builds under specified path
         """
-        list_of_build_names = []
-
         logger.info('filtering list for builds under path %s' % find_under_path)
-        for definition in self.build_def_refs_list_under_project:
-            if find_under_path in definition.path:
-                # only get definitions that have valid ids and names
-                if definition.id and definition.name:
-                    list_of_build_names.append(definition.name)
+        list_of_build_names = [definition.name for definition in self.return_build_def_refs_under_path(find_under_path)]
 
         if self.verbose_logging:
             pretty_log_list(list_of_build_names)
@@ -179,18 +704,14 @@ class ADOBuildObj(OurADOObj):
         return filtered_list_of_build_ids
 
     def get_build_by_name_return_definition_reference(self, pipeline_name):
-        # Note: returns a BuildDefinitionReference not a BuildDefinition
+        # Note: returns a DefinitionRef not a BuildDefinition
         # get the ID and then use get_single_build_definition_by_id to get definition
-        for definition in self.build_def_refs_list_under_project:
-            if definition.name == pipeline_name:
-                return definition
-
-        return False
+        return self.build_def_refs_by_name.get(pipeline_name, False)
 
     def return_target_build_definition_references_dict(self):
         """
-        Return a dictionary of BuildDefinitionReference objects for each filtered pipeline
-        Dict like Key: Build names, value: BuildDefinitionReference object
+        Return a dictionary of DefinitionRef records for each filtered pipeline
+        Dict like Key: Build names, value: DefinitionRef
         """
         target_build_def_refs_dict = {}
         for each_build in self.filtered_build_names_list:
@@ -199,20 +720,18 @@ class ADOBuildObj(OurADOObj):
 
         return target_build_def_refs_dict
 
-    def return_key_build_definition_attributes_dict(self, log=True):
+    def return_key_build_definition_attributes_table(self, log=True):
         """
         :param log: whether to log to console
-        :return: a results dictionary of the form index: {dict of attributes we care about}
+        :return: results_sink.ResultsTable with a row of the attributes we care about per filtered build, in order
         """
-        results_dict = {}
-        for index, each_build in enumerate(self.filtered_build_names_list):
+        results_table = ResultsTable()
+        for each_build in self.filtered_build_names_list:
             this_defintion = self.get_build_by_name_return_definition_reference(each_build)
 
-            single_result = {'id': this_defintion.id,
-                             'name': this_defintion.name,
-                             'queue_status': this_defintion.queue_status}
-
-            results_dict[index] = single_result
+            results_table.append({'id': this_defintion.id,
+                                  'name': this_defintion.name,
+                                  'queue_status': this_defintion.queue_status})
 
             if log:
                 # log key details to console
@@ -220,7 +739,14 @@ class ADOBuildObj(OurADOObj):
                             + this_defintion.name + ", Queue_status:" + this_defintion.queue_status)
                 # ", Pool: " + definition.queue.name - not useful as we set Agent Pool in YAML.
 
-        return results_dict
+        return results_table
+
+    def return_key_build_definition_attributes_dict(self, log=True):
+        """
+        :param log: whether to log to console
+        :return: a results dictionary of the form index: {dict of attributes we care about}
+        """
+        return dict(enumerate(self.return_key_build_definition_attributes_table(log=log)))
 
     def return_filtered_not_sf_testrunner_build_definitions_list(self, envt, filter_under_path='\\Automation\\'):
         """
@@ -253,48 +779,73 @@ class ADOBuildObj(OurADOObj):
         """
 
         logger.info('-- Getting SF testrunner pipeline details')
-        self.filtered_build_names_list = self.return_build_names_list_for_builds_under_path(filter_under_path)
+        our_filter = BuildDefinitionFilter(filter_under_path, must_include=('SF_', 'CloudTests'), envt=envt)
+        self.filtered_build_names_list = self.apply_build_definition_filter(our_filter)
+
+        return self.filtered_build_names_list
+
+    def apply_build_definition_filter(self, our_filter):
+        """
+        Filter the definitions under our project with a BuildDefinitionFilter, logging how many are left after
+        each stage of it
+
+        :param our_filter: BuildDefinitionFilter object
+        :return: list of build names (strings) under our project filtered by our criteria
+        """
+        # only the definitions under our filter's path need to go through it
+        candidates = self.return_build_def_refs_under_path(our_filter.under_path)
+        matches, stage_counts = our_filter.apply(candidates)
+
         logger.info('---- There are %s pipelines found under %s folder path'
-                    % (len(self.filtered_build_names_list), filter_under_path))
+                    % (stage_counts['path'], our_filter.under_path))
+        for stage_name in our_filter.stage_names()[1:]:
+            logger.info('---- Filtered by %s, count now:- %s pipelines ' % (stage_name, stage_counts[stage_name]))
 
-        # filter by SF prefix
-        logger.info('-- Filtering SF testrunner pipeline details based on SF_ prefix included in name')
-        self.filtered_build_names_list = self.filter_builds_list(self.filtered_build_names_list, 'SF_',
-                                                                 verbose=False)
-        logger.info('---- Filtered by SF_, count now:- %s pipelines ' % len(self.filtered_build_names_list))
-
-        logger.info('-- Filtering SF testrunner pipeline details based on CloudTests included in name')
-        self.filtered_build_names_list = self.filter_builds_list(self.filtered_build_names_list, 'CloudTests',
-                                                                 verbose=False)
-        logger.info('---- Filtered by CloudTests, count now:- %s pipelines ' % len(self.filtered_build_names_list))
-
-        # filter by envt
-        if envt not in ('any', 'sf_all'):
-            logger.info('-- Filtering SF testrunner pipeline details based on envt: %s' % envt)
-            self.filtered_build_names_list =\
-                self.filter_builds_list(self.filtered_build_names_list, '_' + envt + '_', verbose=False)
-            logger.info('---- Filtered by envt %s, count now:- %s pipelines ' %
-                        ('_' + envt + '_', len(self.filtered_build_names_list)))
+        filtered_build_names_list = [definition.name for definition in matches]
+        if self.verbose_logging:
+            pretty_log_list(filtered_build_names_list)
 
-        return self.filtered_build_names_list
+        return filtered_build_names_list
 
-    def get_single_build_definition_by_id(self, our_definition_id):
+    def get_single_build_definition_by_id(self, our_definition_id, use_cache=True):
         """
         :param our_definition_id:
+        :param use_cache: return the definition already fetched during this run, if there is one
         :return: a single BuildDefinition object
         """
+        if use_cache:
+            with self._definition_cache_lock:
+                if our_definition_id in self._definition_cache:
+                    return self._definition_cache[our_definition_id]
+
         project = self.ado_project
         if self.verbose_logging:
             logger.info('Getting single definition: %s, under project: %s' % (our_definition_id, project.name))
 
-        build_client = self.connection.clients.get_build_client()
-        definition = build_client.get_definition(project.id, our_definition_id, include_latest_builds=True)
+        build_client = self.get_client('get_build_client')
+        fetch_definition = lambda: build_client.get_definition(project.id, our_definition_id,
+                                                               include_latest_builds=True)
+        if use_cache:
+            definition = self.get_cached(ado_cache.DEFINITION, our_definition_id, fetch_definition)
+        else:
+            definition = fetch_definition()
+            if self.cache is not None:
+                self.cache.put(ado_cache.DEFINITION, self.cache_key(our_definition_id), definition)
+
+        with self._definition_cache_lock:
+            self._definition_cache[our_definition_id] = definition
 
         return definition
 
     def set_single_build_definition_queue_status(self, defintion_id, set_to_status, build_def=False):
+        """
+        :param build_def: the BuildDefinition object, if we already have it (saves fetching it again)
+        :return: the updated BuildDefinition object
+        """
+        if set_to_status not in QUEUE_STATUSES:
+            raise BaseException('You must choose disabled, enabled or paused for the queue_status you want to set.')
 
-        build_client = self.connection.clients.get_build_client()
+        build_client = self.get_client('get_build_client')
 
         # get build definition we want to manipulate if we don't have it already
         if build_def:
@@ -307,21 +858,112 @@ class ADOBuildObj(OurADOObj):
         logger.info('Before any updates, the BuildDefinition id: %s has queue_status: %s'
                     % (single_def.id, single_def.queue_status))
 
-        if set_to_status in ('disabled', 'enabled', 'paused'):
-            single_def.queue_status = set_to_status
-        else:
-            raise BaseException('You must choose disabled, enabled or paused for the queue_status you want to set.')
+        single_def.queue_status = set_to_status
 
         # update that defn for the param we need to set
         logger.info(
             'About to update BuildDefinition id: %s to queue_status: %s' % (single_def.id, single_def.queue_status))
 
         # do the update defn call
-        build_client.update_definition(single_def, 'My Default Project Name', single_def.id)
+        try:
+            updated_def = build_client.update_definition(single_def, self.ado_project.id, single_def.id)
+        finally:
+            # whether or not it worked, our copy no longer matches ADO's
+            self.forget_definition(single_def.id)
         logger.info('The build with id %s (%s) has been updated succesfully to have queue status: %s'
                     % (single_def.id, single_def.name, single_def.queue_status))
 
-    def get_latest_build_report_by_build_id(self, build_definition_id):
+        return updated_def
+
+    def forget_definition(self, definition_id):
+        """
+        The definition has changed, so don't hand out a stale copy from our caches later in the run
+        """
+        with self._definition_cache_lock:
+            self._definition_cache.pop(definition_id, None)
+        if self.cache is not None:
+            self.cache.delete(ado_cache.DEFINITION, self.cache_key(definition_id))
+
+    def set_build_definitions_queue_status(self, definitions, set_to_status, executor, dry_run=False):
+        """
+        Set the queue status of many definitions at once, e.g. pausing a whole envt's testrunners for maintenance.
+        Definitions already in that status are skipped without going to ADO, using the queue_status on the
+        DefinitionRef records we already have, and the updates run concurrently on the executor. Definitions
+        given by id are each fetched on their own (on the executor) - never by listing the project's definitions.
+
+        :param definitions: BuildDefinitionFilter to select from the definitions under our project, or a list of
+                            definition ids, DefinitionRef records or BuildDefinition objects
+        :param set_to_status: one of QUEUE_STATUSES
+        :param executor: ThreadPoolExecutor - its max_workers bounds the updates in flight
+        :param dry_run: only report what would be updated
+        :return: list of outcome dicts, one per definition in the order given, with keys: 'id', 'name',
+                 'queue_status_before', 'queue_status_after' and 'outcome' - one of QUEUE_STATUS_OUTCOMES -
+                 plus 'error' (the exception message) if it failed
+        """
+        if set_to_status not in QUEUE_STATUSES:
+            raise BaseException('You must choose disabled, enabled or paused for the queue_status you want to set.')
+
+        if isinstance(definitions, BuildDefinitionFilter):
+            definitions, _ = definitions.apply(self.return_build_def_refs_under_path(definitions.under_path))
+
+        outcomes = []
+        futures = {}
+        for definition in definitions:
+            if isinstance(definition, int):
+                # its status is only known once fetched, which _set_definition_queue_status does
+                outcome = {'id': definition, 'name': None, 'queue_status_before': None}
+                outcomes.append(outcome)
+                futures[executor.submit(self._set_definition_queue_status, definition, set_to_status, definition,
+                                        dry_run)] = outcome
+                continue
+
+            outcome = {'id': definition.id, 'name': definition.name, 'queue_status_before': definition.queue_status}
+            outcomes.append(outcome)
+
+            if outcome['queue_status_before'] == set_to_status:
+                outcome.update({'queue_status_after': set_to_status, 'outcome': 'unchanged'})
+            elif dry_run:
+                outcome.update({'queue_status_after': outcome['queue_status_before'], 'outcome': 'would_update'})
+            else:
+                futures[executor.submit(self._set_definition_queue_status, outcome['id'], set_to_status,
+                                        definition)] = outcome
+
+        for future, outcome in futures.items():
+            try:
+                outcome.update(future.result())
+            except Exception as e:
+                logger.error('Failed to set queue_status of BuildDefinition id: %s to %s: %s'
+                             % (outcome['id'], set_to_status, e))
+                outcome.update({'queue_status_after': outcome['queue_status_before'], 'outcome': 'failed',
+                                'error': str(e)})
+
+        return outcomes
+
+    def _set_definition_queue_status(self, definition_id, set_to_status, definition, dry_run=False):
+        # a reference only has enough of the definition to check its status - updating needs the whole (latest)
+        # definition, which we may already have from this run
+        # (only a full BuildDefinition has a process)
+        build_def = definition if hasattr(definition, 'process') else None
+        if build_def is None:
+            with self._definition_cache_lock:
+                build_def = self._definition_cache.get(definition_id)
+        if build_def is None:
+            build_def = self.get_single_build_definition_by_id(definition_id, use_cache=False)
+
+        outcome = {'name': build_def.name, 'queue_status_before': build_def.queue_status,
+                   'queue_status_after': set_to_status}
+        if build_def.queue_status == set_to_status:
+            outcome['outcome'] = 'unchanged'
+            return outcome
+        if dry_run:
+            outcome.update({'queue_status_after': build_def.queue_status, 'outcome': 'would_update'})
+            return outcome
+
+        self.set_single_build_definition_queue_status(definition_id, set_to_status, build_def=build_def)
+        outcome['outcome'] = 'updated'
+        return outcome
+
+    def get_latest_build_report_by_build_id(self, build_definition):
         """
         Get a build 'report' as per
         # https://docs.microsoft.com/en-us/rest/api/azure/devops/build/report/get?view=azure-devops-rest-6.0
@@ -329,71 +971,270 @@ class ADOBuildObj(OurADOObj):
 
         This is useful as it includes the test results (report.content)
 
-        :param build_definition_id: a valid ADO BuildDefinition's id
+        :param build_definition: a valid ADO BuildDefinition's id, or the BuildDefinition object itself if we
+                                 already have it (saves fetching the definition again)
         :return: ADO BuildReportMetadata object
         """
+        if isinstance(build_definition, int):
+            # only goes back to ADO if we haven't already fetched this definition during this run
+            build_definition = self.get_single_build_definition_by_id(build_definition)
+
+        last_completed_build = build_definition.latest_completed_build
 
+        return self.get_build_report(last_completed_build.id)
+
+    def iter_completed_builds(self, definition_id, max_builds=None, min_finish_time=None, max_finish_time=None,
+                              page_size=100):
+        """
+        Lazily yield the completed builds of a definition, most recently finished first, a page at a time,
+        following continuation tokens.
+
+        :param definition_id: a valid ADO BuildDefinition's id
+        :param max_builds: stop after this many builds, all of them if None
+        :param min_finish_time: datetime - only builds finished after this
+        :param max_finish_time: datetime - only builds finished before this
+        :param page_size: builds to ask for per page (top)
+        :return: generator of Build objects
+        """
+        return self._iter_completed_builds([definition_id], 'finishTimeDescending', max_builds=max_builds,
+                                           min_finish_time=min_finish_time, max_finish_time=max_finish_time,
+                                           page_size=page_size)
+
+    def iter_completed_builds_for_definitions(self, definition_ids, min_finish_time=None, page_size=100):
+        """
+        Lazily yield the completed builds of many definitions, with one query per BUILDS_QUERY_DEFINITIONS_PER_QUERY
+        definitions rather than one per definition - e.g. to poll for the builds finished since we last looked.
+
+        :param definition_ids: list of valid ADO BuildDefinition ids
+        :param min_finish_time: datetime - only builds finished after this
+        :return: generator of Build objects, earliest finished first within each group of definitions
+        """
+        for start in range(0, len(definition_ids), BUILDS_QUERY_DEFINITIONS_PER_QUERY):
+            for build in self._iter_completed_builds(definition_ids[start:start + BUILDS_QUERY_DEFINITIONS_PER_QUERY],
+                                                     'finishTimeAscending', min_finish_time=min_finish_time,
+                                                     page_size=page_size):
+                yield build
+
+    def _iter_completed_builds(self, definition_ids, query_order, max_builds=None, min_finish_time=None,
+                               max_finish_time=None, page_size=100):
+        build_client = self.get_client('get_build_client', paging_api_version_for(self.using_v6_build_client))
+
+        builds_yielded = 0
+        continuation_token = None
+        while True:
+            if max_builds is not None:
+                page_size = min(page_size, max_builds - builds_yielded)
+            builds = build_client.get_builds(self.ado_project.id, definitions=definition_ids,
+                                             min_time=min_finish_time, max_time=max_finish_time,
+                                             status_filter='completed', query_order=query_order,
+                                             top=page_size, continuation_token=continuation_token)
+            # as with get_definitions, the page's list in .value plus the continuation token for the next page
+            continuation_token = builds.continuation_token
+
+            for build in builds.value:
+                yield build
+                builds_yielded += 1
+                if max_builds is not None and builds_yielded >= max_builds:
+                    return
+
+            if not continuation_token:
+                break
+
+    def get_build_report(self, build_id):
+        """
+        Get the build 'report' for a specific build (run) we already know the id of
+
+        :param build_id: a valid ADO Build's id (not the definition id)
+        :return: ADO BuildReportMetadata object
+        """
         project = self.ado_project
         if self.verbose_logging:
-            logger.info('Getting single definition: %s, under project: %s' % (build_definition_id, project.name))
+            logger.info('Getting build report for build: %s, under project: %s' % (build_id, project.name))
 
         # NOTE: reports requires clients_v6.0
-        build_client = self.connection.clients_v6_0.get_build_client()
-        definition = build_client.get_definition(project.id, build_definition_id, include_latest_builds=True)
-
-        last_completed_build = definition.latest_completed_build
+        build_client = self.get_client('get_build_client', 'v6_0')
 
         # https://docs.microsoft.com/en-us/rest/api/azure/devops/build/report/get?view=azure-devops-rest-6.0
         # /site-packages/azure/devops/v6_0/build/build_client.py
-        report = build_client.get_build_report(project.id, last_completed_build.id)
-
-        # not sure the below is useful - TODO: explore this
-        #report_html = build_client.get_build_report_html_content(project.id, last_completed_build.id)
+        # a completed build's report never changes, so it can come from our cache
+        report = self.get_cached(ado_cache.BUILD_REPORT, build_id,
+                                 lambda: build_client.get_build_report(project.id, build_id))
 
         return report
 
+    def get_build_report_summary(self, build_id):
+        """
+        Get the test summary from the build 'report' for a specific build (run), parsing the report as it downloads
+        rather than holding the whole (often massive) html in memory
+
+        :param build_id: a valid ADO Build's id (not the definition id)
+        :return: summary dict - see ado_report_parser.BuildReportSummaryParser
+        """
+        project = self.ado_project
+        if self.verbose_logging:
+            logger.info('Getting build report summary for build: %s, under project: %s' % (build_id, project.name))
+
+        # NOTE: reports requires clients_v6.0
+        build_client = self.get_client('get_build_client', 'v6_0')
+
+        def fetch_summary():
+            if hasattr(build_client, 'get_build_report_html_content'):
+                # a generator of the report html, a chunk at a time, as it downloads
+                report_chunks = build_client.get_build_report_html_content(project.id, build_id)
+            else:
+                report_chunks = [build_client.get_build_report(project.id, build_id).content or '']
+            return ado_report_parser.parse_build_report_stream(report_chunks)
+
+        # a completed build's report never changes, so its summary can come from our cache
+        return self.get_cached(ado_cache.BUILD_REPORT_SUMMARY, build_id, fetch_summary)
+
 
 class ADOTestResultsObj(OurADOObj):
     """Sub Class for interacting with Test Results objects in ADO 'My Default Project Name' project
     """
 
-    def __init__(self,  creds, v6_api=False):
-        OurADOObj.__init__(self, creds)
+    def __init__(self,  creds, v6_api=False, org_url=DEFAULT_ORG_URL, project_name=DEFAULT_PROJECT_NAME):
+        OurADOObj.__init__(self, creds, org_url=org_url, project_name=project_name)
         self.filtered_build_names_list = []
         self.using_v6_build_client = v6_api
         # self.build_def_refs_list_under_project = self.get_list_of_build_definition_references_under_project(v6_api)
 
-    def get_test_result_log(self, run_id, use_v6_api=False):
+    def get_test_result_log(self, run_id, result_id, attach_type='generalAttachment'):
         """
-        :return: list of GetTestResultLogs objects
+        :return: list of TestLog objects
         """
-        logger.info('Getting results under project: %s' % self.ado_project.name)
+        return list(self.iter_test_result_logs(run_id, result_id, attach_type=attach_type))
 
-        if use_v6_api:
-            test_result_client = self.connection.clients_v6_0.get_test_results_client()
-            logger.info('Using v6.0 ADO results client')
-        else:
-            test_result_client = self.connection.clients.get_test_results_client()
-            logger.info('Using release version of ADO results client')
+    def iter_test_result_logs(self, run_id, result_id, attach_type='generalAttachment'):
+        """
+        Always uses the v5_1 test results client - the released one has no get_test_result_logs, and the v6_0 one
+        drops the continuation token (see paging_api_version_for)
 
-        #our_result = test_result_client.get_test_result_logs(self.ado_project.id, run_id)
+        :return: generator of TestLog objects for a test result, following continuation tokens
+        """
+        if self.verbose_logging:
+            logger.info('Getting result logs under project: %s for run_id: %s, result_id: %s'
+                        % (self.ado_project.name, run_id, result_id))
 
-        run_id = 1603112
-        result_id = 100066
-        attach_type = 'generalAttachment'
+        test_result_client = self.get_client('get_test_results_client', 'v5_1')
 
-        #def get_test_result_logs(self, project, run_id, result_id, type, directory_path=None, file_name_prefix=None, fetch_meta_data=None, top=None, continuation_token=None):
-        our_result = test_result_client.get_test_result_logs(self.ado_project.id, run_id, result_id, attach_type)
+        # def get_test_result_logs(self, project, run_id, result_id, type, directory_path=None, file_name_prefix=None,
+        #                          fetch_meta_data=None, top=None, continuation_token=None):
+        continuation_token = None
+        while True:
+            test_logs = test_result_client.get_test_result_logs(self.ado_project.id, run_id, result_id, attach_type,
+                                                                top=TEST_RESULT_LOGS_PAGE_SIZE,
+                                                                continuation_token=continuation_token)
+            # as with get_definitions, the page's list in .value plus the continuation token for the next page
+            continuation_token = test_logs.continuation_token
 
-        return our_result
+            for test_log in test_logs.value:
+                yield test_log
+
+            if not continuation_token:
+                break
+
+    def iter_test_results(self, run_id, use_v6_api=False):
+        """
+        https://docs.microsoft.com/en-us/rest/api/azure/devops/test/results/list?view=azure-devops-rest-6.0
+
+        :return: generator of TestCaseResult objects for a test run, a page (top) at a time
+        """
+        test_client = self.get_client('get_test_client', api_version_for(use_v6_api))
+
+        # get_test_results pages with skip rather than a continuation token
+        skip = 0
+        while True:
+            test_results = test_client.get_test_results(self.ado_project.id, run_id, skip=skip,
+                                                        top=TEST_RESULTS_PAGE_SIZE)
+            for test_result in test_results:
+                yield test_result
+
+            if len(test_results) < TEST_RESULTS_PAGE_SIZE:
+                break
+            skip += len(test_results)
+
+    def get_test_result_attachments(self, run_id, result_id):
+        """
+        Always uses the ATTACHMENTS_API_VERSION test client, as do the other attachment methods below
+
+        :param result_id: id of the test result within the run, or None for the attachments of the run itself
+        :return: list of TestAttachment objects
+        """
+        test_client = self.get_client('get_test_client', ATTACHMENTS_API_VERSION)
+        if result_id is None:
+            return test_client.get_test_run_attachments(self.ado_project.id, run_id)
+        return test_client.get_test_result_attachments(self.ado_project.id, run_id, result_id)
+
+    def download_test_result_attachment(self, run_id, result_id, attachment, store):
+        """
+        Stream one attachment's content straight into the store, a chunk at a time
+
+        :param result_id: id of the test result the attachment is on, or None for an attachment of the run itself
+        :param attachment: TestAttachment object
+        :param store: attachment_store.ContentAddressedStore
+        :return: dict of attachment_store.ATTACHMENT_COLUMNS for the manifest
+        """
+        test_client = self.get_client('get_test_client', ATTACHMENTS_API_VERSION)
+        if result_id is None:
+            chunks = test_client.get_test_run_attachment_content(self.ado_project.id, run_id, attachment.id)
+        else:
+            chunks = test_client.get_test_result_attachment_content(self.ado_project.id, run_id, result_id,
+                                                                    attachment.id)
+        sha256, size, stored_path = store.save_stream(chunks)
+
+        return {'attachment_key': return_attachment_key(run_id, result_id, attachment.id),
+                'test_run_id': run_id,
+                'test_result_id': result_id,
+                'attachment_id': attachment.id,
+                'file_name': attachment.file_name,
+                'attachment_type': attachment.attachment_type,
+                'size': size,
+                'sha256': sha256,
+                'stored_path': os.path.relpath(stored_path, store.root_path)}
+
+    def download_test_run_attachments(self, run_ids, store, manifest_sink, executor):
+        """
+        Download every attachment of the given test runs and of all their test results, concurrently on the
+        executor. Attachments already in the manifest (e.g. from an earlier, interrupted download) are skipped.
+
+        :param run_ids: list of test run ids
+        :param store: attachment_store.ContentAddressedStore the content goes in
+        :param manifest_sink: results_sink.ResultsCsvSink with attachment_store.ATTACHMENT_COLUMNS and
+                              id_column 'attachment_key', written to from this thread only
+        :param executor: ThreadPoolExecutor
+        :return: number of attachments downloaded
+        """
+        # listing a result's attachments is a call per result, so fan those out too
+        listing_futures = []
+        for run_id in run_ids:
+            result_ids = [None] + [test_result.id for test_result in self.iter_test_results(run_id)]
+            logger.info('Listing attachments for test run: %s and its %s results' % (run_id, len(result_ids) - 1))
+            for result_id in result_ids:
+                listing_futures.append((run_id, result_id, executor.submit(
+                    self.get_test_result_attachments, run_id, result_id)))
+
+        download_futures = []
+        for run_id, result_id, future in listing_futures:
+            for attachment in future.result():
+                if manifest_sink.is_written(return_attachment_key(run_id, result_id, attachment.id)):
+                    continue
+                download_futures.append(executor.submit(self.download_test_result_attachment, run_id, result_id,
+                                                        attachment, store))
+
+        logger.info('Downloading %s attachments' % len(download_futures))
+        for future in as_completed(download_futures):
+            manifest_sink.append(future.result())
+
+        return len(download_futures)
 
 
 class ADOTestClientObj(OurADOObj):
     """Sub Class for interacting with Test Results objects in ADO 'My Default Project Name' project
     """
 
-    def __init__(self,  creds, v6_api=False):
-        OurADOObj.__init__(self, creds)
+    def __init__(self,  creds, v6_api=False, cache=None, org_url=DEFAULT_ORG_URL, project_name=DEFAULT_PROJECT_NAME):
+        OurADOObj.__init__(self, creds, cache=cache, org_url=org_url, project_name=project_name)
         self.filtered_build_names_list = []
         self.using_v6_build_client = v6_api
         # self.build_def_refs_list_under_project = self.get_list_of_build_definition_references_under_project(v6_api)
@@ -407,21 +1248,21 @@ class ADOTestClientObj(OurADOObj):
         :param use_v6_api:
         :return:
         """
-        logger.info('Getting test runs stats under project: %s using build_uri filter: %s'
-                    % (self.ado_project.name, our_build_uri))
+        if self.verbose_logging:
+            logger.info('Getting test runs stats under project: %s using build_uri filter: %s'
+                        % (self.ado_project.name, our_build_uri))
 
-        if use_v6_api:
-            test_result_client = self.connection.clients_v6_0.get_test_client()
-            logger.info('Using v6.0 ADO test client')
-        else:
-            test_result_client = self.connection.clients.get_test_client()
-            logger.info('Using release version of ADO test client')
+        test_result_client = self.get_client('get_test_client', api_version_for(use_v6_api))
 
         # https://docs.microsoft.com/en-us/rest/api/azure/devops/test/runs/list?view=azure-devops-rest-5.0
         # get_test_runs(self, project, build_uri=None, owner=None, tmi_run_id=None, plan_id=None,
         # include_run_details=None, automated=None, skip=None, top=None)
-        auto_test_runs =\
-            test_result_client.get_test_runs(self.ado_project.id, build_uri=our_build_uri, include_run_details=True)
+        # only cache once there are runs - they may not have been published yet
+        auto_test_runs = self.get_cached(
+            ado_cache.TEST_RUNS, our_build_uri,
+            lambda: test_result_client.get_test_runs(self.ado_project.id, build_uri=our_build_uri,
+                                                     include_run_details=True),
+            cache_if=lambda test_runs: len(test_runs) > 0)
 
         #auto_test_runs = test_result_client.get_test_runs(self.ado_project.id, automated=True, include_run_details=True)
         # our_result = test_result_client.query_test_runs(self.ado_project.id, None, None, build_def_ids='527') # build_ids='135297')
@@ -429,26 +1270,123 @@ class ADOTestClientObj(OurADOObj):
 
         return auto_test_runs
 
+    def get_test_runs_for_builds(self, builds, use_v6_api=False):
+        """
+        Get the test runs for many builds at once, using a handful of date windowed, paged query_test_runs calls
+        rather than one get_test_runs call per build.
+
+        https://docs.microsoft.com/en-us/rest/api/azure/devops/test/runs/query?view=azure-devops-rest-6.0
+
+        :param builds: list of Build objects, e.g. the latest_completed_build of each of our definitions
+        :param use_v6_api:
+        :return: dict of build id (int): list of TestRun objects for that build, in run id order
+        """
+        test_runs_by_build_id = dict((int(build.id), []) for build in builds)
+
+        builds_to_query = []
+        for build in builds:
+            cached_test_runs = self.cache.get(ado_cache.TEST_RUNS, self.cache_key(build.uri)) \
+                if self.cache is not None else None
+            if cached_test_runs is None:
+                builds_to_query.append(build)
+            else:
+                test_runs_by_build_id[int(build.id)] = cached_test_runs
+
+        logger.info('Querying test runs under project: %s for %s builds (%s already cached)'
+                    % (self.ado_project.name, len(builds_to_query), len(builds) - len(builds_to_query)))
+
+        test_result_client = self.get_client('get_test_client', paging_api_version_for(use_v6_api))
+
+        for min_date, max_date, window_builds in return_build_date_windows(builds_to_query):
+            for chunk_start in range(0, len(window_builds), TEST_RUN_QUERY_BUILD_IDS_PER_QUERY):
+                build_ids = [build.id for build in
+                             window_builds[chunk_start:chunk_start + TEST_RUN_QUERY_BUILD_IDS_PER_QUERY]]
+                for test_run in self.iter_query_test_runs(test_result_client, min_date, max_date, build_ids):
+                    build_id = int(test_run.build.id)
+                    if build_id in test_runs_by_build_id:
+                        test_runs_by_build_id[build_id].append(test_run)
+
+        for build in builds_to_query:
+            test_runs = sorted(test_runs_by_build_id[int(build.id)], key=lambda test_run: test_run.id)
+            if test_runs:
+                if self.cache is not None:
+                    self.cache.put(ado_cache.TEST_RUNS, self.cache_key(build.uri), test_runs)
+            else:
+                # nothing in its date window (or no finish time to window on) - ask for this build's runs directly
+                test_runs = self.get_test_runs(build.uri, use_v6_api=use_v6_api)
+            test_runs_by_build_id[int(build.id)] = test_runs
+
+        return test_runs_by_build_id
+
+    def iter_query_test_runs(self, test_result_client, min_last_updated_date, max_last_updated_date, build_ids):
+        """
+        :param test_result_client: test client of the API version paging_api_version_for picks
+        :param build_ids: up to TEST_RUN_QUERY_BUILD_IDS_PER_QUERY build ids
+        :return: generator of TestRun objects for these build ids, updated within the dates, following
+                 continuation tokens
+        """
+        continuation_token = None
+        while True:
+            test_runs = test_result_client.query_test_runs(self.ado_project.id, min_last_updated_date,
+                                                           max_last_updated_date, build_ids=build_ids,
+                                                           top=TEST_RUN_QUERY_PAGE_SIZE,
+                                                           continuation_token=continuation_token)
+            # as with get_definitions, the page's list in .value plus the continuation token for the next page
+            continuation_token = test_runs.continuation_token
+
+            for test_run in test_runs.value:
+                yield test_run
+
+            if not continuation_token:
+                break
+
     def get_test_run_statistics(self, run_id, use_v6_api=False):
         """
         https://docs.microsoft.com/en-us/rest/api/azure/devops/test/runs/get%20test%20run%20statistics?view=azure-devops-rest-5.0
 
         :return: GetTestRunStatistics object
         """
-        logger.info('Getting run stats under project: %s for run_id: %s' % (self.ado_project.name, run_id) )
+        if self.verbose_logging:
+            logger.info('Getting run stats under project: %s for run_id: %s' % (self.ado_project.name, run_id))
 
-        if use_v6_api:
-            test_result_client = self.connection.clients_v6_0.get_test_client()
-            logger.info('Using v6.0 ADO test client')
-        else:
-            test_result_client = self.connection.clients.get_test_client()
-            logger.info('Using release version of ADO test client')
+        test_result_client = self.get_client('get_test_client', api_version_for(use_v6_api))
 
-        our_result = test_result_client.get_test_run_statistics(self.ado_project.id, run_id)
+        our_result = self.get_cached(ado_cache.TEST_RUN_STATS, run_id,
+                                     lambda: test_result_client.get_test_run_statistics(self.ado_project.id, run_id))
 
         return our_result
 
 
+def return_build_date_windows(builds):
+    """
+    Group builds into date windows narrow enough for a single query_test_runs call
+
+    :param builds: list of Build objects
+    :return: list of (min date, max date, list of Build objects) - builds with no finish or queue time are left out
+    """
+    dated_builds = [(build.finish_time or build.queue_time, build) for build in builds
+                    if build.finish_time or build.queue_time]
+    dated_builds.sort(key=lambda date_and_build: date_and_build[0])
+
+    windows = []
+    for build_date, build in dated_builds:
+        if windows and build_date - windows[-1][0] <= TEST_RUN_QUERY_MAX_BUILD_SPREAD:
+            windows[-1][1] = build_date
+            windows[-1][2].append(build)
+        else:
+            windows.append([build_date, build_date, [build]])
+
+    return [(first_date - TEST_RUN_QUERY_WINDOW_PADDING, last_date + TEST_RUN_QUERY_WINDOW_PADDING, window_builds)
+            for first_date, last_date, window_builds in windows]
+
+
+def return_attachment_key(run_id, result_id, attachment_id):
+    """
+    :return: string identifying an attachment, unique across test runs - result_id is None for a run's own attachment
+    """
+    return '%s/%s/%s' % (run_id, '' if result_id is None else result_id, attachment_id)
+
+
 def pretty_log_dict(our_dict):
     for k, v in our_dict.items():
         logger.info("%s: %s" % (k, v))
@@ -0,0 +1,82 @@
+import json
+import os
+from collections import namedtuple
+
+
+# the little we keep of each agent between polls, rather than the whole TaskAgent object
+AgentSnapshot = namedtuple('AgentSnapshot', ('pool_name', 'agent_name', 'status', 'enabled', 'busy',
+                                             'last_completed_request_finish_time'))
+
+# kinds of change diff_fleet_snapshots reports
+AGENT_CHANGES = ('added', 'removed', 'online', 'offline', 'enabled', 'disabled', 'busy', 'idle')
+
+
+def return_agent_snapshot(pool, agent):
+    """
+    :param pool: TaskAgentPool object the agent is in
+    :param agent: TaskAgent object, got with include_assigned_request (and include_last_completed_request)
+    :return: AgentSnapshot
+    """
+    last_completed_request = getattr(agent, 'last_completed_request', None)
+    finish_time = last_completed_request.finish_time if last_completed_request is not None else None
+
+    return AgentSnapshot(pool_name=pool.name,
+                         agent_name=agent.name,
+                         status=agent.status,
+                         enabled=bool(agent.enabled),
+                         busy=getattr(agent, 'assigned_request', None) is not None,
+                         last_completed_request_finish_time=finish_time.isoformat() if finish_time else None)
+
+
+def diff_fleet_snapshots(old_snapshot, new_snapshot):
+    """
+    :param old_snapshot: dict of (pool id, agent id): AgentSnapshot from the previous poll
+    :param new_snapshot: dict of (pool id, agent id): AgentSnapshot from this poll
+    :return: list of change dicts, with keys 'pool_id', 'agent_id', 'pool_name', 'agent_name' and 'change' - one of
+             AGENT_CHANGES - sorted by pool and agent id. Agents that have not changed are left out.
+    """
+    changes = []
+    for key in sorted(set(old_snapshot) | set(new_snapshot)):
+        old_agent = old_snapshot.get(key)
+        new_agent = new_snapshot.get(key)
+
+        if old_agent is None:
+            agent_changes = ['added']
+        elif new_agent is None:
+            agent_changes = ['removed']
+        else:
+            agent_changes = []
+            if old_agent.status != new_agent.status:
+                agent_changes.append('online' if new_agent.status == 'online' else 'offline')
+            if old_agent.enabled != new_agent.enabled:
+                agent_changes.append('enabled' if new_agent.enabled else 'disabled')
+            if old_agent.busy != new_agent.busy:
+                agent_changes.append('busy' if new_agent.busy else 'idle')
+
+        agent = new_agent or old_agent
+        for change in agent_changes:
+            changes.append({'pool_id': key[0], 'agent_id': key[1], 'pool_name': agent.pool_name,
+                            'agent_name': agent.agent_name, 'change': change})
+
+    return changes
+
+
+def read_fleet_snapshot(filename):
+    """
+    :return: dict of (pool id, agent id): AgentSnapshot saved by write_fleet_snapshot, empty if there is no file
+    """
+    if not os.path.exists(filename):
+        return {}
+
+    with open(filename) as snapshot_file:
+        rows = json.load(snapshot_file)['agents']
+    return dict(((row[0], row[1]), AgentSnapshot(*row[2:])) for row in rows)
+
+
+def write_fleet_snapshot(filename, fleet_snapshot):
+    # one small row per agent; written to a new file and swapped in, so a crash can't leave half a snapshot
+    rows = [list(key) + list(agent) for key, agent in sorted(fleet_snapshot.items())]
+    temp_filename = filename + '.tmp'
+    with open(temp_filename, 'w') as snapshot_file:
+        json.dump({'agents': rows}, snapshot_file)
+    os.replace(temp_filename, filename)
@@ -0,0 +1,109 @@
+import argparse
+import json
+import logging
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from msrest.authentication import BasicAuthentication
+
+import ado_scheduler
+import agent_fleet
+from ado_utils import ADOTaskAgentObj, connection_registry
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+handler = logging.StreamHandler(sys.stdout)
+handler.setLevel(logging.INFO)
+formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+handler.setFormatter(formatter)
+
+if logger.hasHandlers():
+    logger.handlers.clear()
+
+logger.addHandler(handler)
+
+DEFAULT_WORKERS = 8
+DEFAULT_SNAPSHOT_FILE = 'agent_fleet_snapshot.json'
+
+
+def poll_fleet(our_agent_client, executor, snapshot_file, pool_ids=None, changes_file=None):
+    """
+    Take a snapshot of the agent fleet, report what changed since the last one (saved in snapshot_file) and save it
+    in its place
+
+    :return: list of change dicts, see agent_fleet.diff_fleet_snapshots - empty on the first poll
+    """
+    old_snapshot = agent_fleet.read_fleet_snapshot(snapshot_file)
+    new_snapshot = our_agent_client.get_fleet_snapshot(executor, pool_ids=pool_ids)
+
+    if not old_snapshot:
+        # nothing to compare against yet - just say what there is
+        changes = []
+        logger.info('First fleet snapshot: %s agents, %s online, %s busy'
+                    % (len(new_snapshot), sum(agent.status == 'online' for agent in new_snapshot.values()),
+                       sum(agent.busy for agent in new_snapshot.values())))
+    else:
+        changes = agent_fleet.diff_fleet_snapshots(old_snapshot, new_snapshot)
+        for change in changes:
+            logger.info('Pool %(pool_name)s (%(pool_id)s), agent %(agent_name)s (%(agent_id)s): %(change)s' % change)
+        logger.info('%s changes across %s agents' % (len(changes), len(new_snapshot)))
+
+    if changes and changes_file:
+        polled_at = datetime.now(timezone.utc).isoformat()
+        with open(changes_file, 'a') as our_changes_file:
+            for change in changes:
+                our_changes_file.write(json.dumps(dict(change, polled_at=polled_at)) + '\n')
+
+    agent_fleet.write_fleet_snapshot(snapshot_file, new_snapshot)
+
+    return changes
+
+
+def main():
+    """
+    Poll the agent pools and report only what changed since the last poll - agents coming online or going offline,
+    being enabled or disabled, and becoming busy or idle. The last snapshot is kept in --snapshot-file, so this can
+    be run once a minute (e.g. from a scheduler) or left running with --interval.
+
+    :return: 1 or 0
+    """
+    parser = argparse.ArgumentParser(description='Report changes to the state of our ADO build agents.')
+    parser.add_argument('--pat', '-p', required=True,
+                        help="PAT token generated within ADO for user running script - needs Agent Pools (read)")
+    parser.add_argument('--snapshot-file', default=DEFAULT_SNAPSHOT_FILE,
+                        help="File to keep the last fleet snapshot in (default %s)" % DEFAULT_SNAPSHOT_FILE)
+    parser.add_argument('--changes-file', default=None,
+                        help="Also append each change to this file, as a line of json")
+    parser.add_argument('--pool-id', type=int, nargs='+', default=None,
+                        help="Only poll these agent pools - otherwise every pool")
+    parser.add_argument('--interval', type=float, default=0,
+                        help="Keep polling, this many seconds apart - otherwise poll once")
+    parser.add_argument('--workers', '-w', type=int, default=DEFAULT_WORKERS,
+                        help="Number of pools to get the agents of concurrently (default %s)" % DEFAULT_WORKERS)
+
+    args = parser.parse_args()
+
+    if args.workers < 1:
+        parser.error('--workers must be 1 or more')
+    if args.interval < 0:
+        parser.error('--interval must be 0 or more')
+
+    connection_registry.scheduler = ado_scheduler.ADORequestScheduler()
+    our_agent_client = ADOTaskAgentObj(creds=BasicAuthentication('PAT', args.pat))
+
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        while True:
+            poll_started = time.monotonic()
+            poll_fleet(our_agent_client, executor, args.snapshot_file, pool_ids=args.pool_id,
+                       changes_file=args.changes_file)
+            if not args.interval:
+                break
+            time.sleep(max(0, args.interval - (time.monotonic() - poll_started)))
+
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,67 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+
+
+logger = logging.getLogger()
+
+# one row per attachment downloaded, in the store's manifest csv
+ATTACHMENT_COLUMNS = ('attachment_key', 'test_run_id', 'test_result_id', 'attachment_id', 'file_name',
+                      'attachment_type', 'size', 'sha256', 'stored_path')
+
+
+class ContentAddressedStore(object):
+    """Stores downloaded files under the sha256 hash of their content:
+        <root_path>/objects/<first 2 hex chars>/<sha256>
+
+    So the same log attached to every rerun of a test is only kept once. Content is streamed to a temporary file
+    (hashing it on the way) and only moved into place once complete, so a file in the store is never partial and
+    nothing is held in memory but the chunk being written. Safe to save to from several threads at once.
+    """
+
+    def __init__(self, root_path):
+        self.root_path = root_path
+        self.objects_path = os.path.join(root_path, 'objects')
+        self.temp_path = os.path.join(root_path, 'tmp')
+        os.makedirs(self.objects_path, exist_ok=True)
+        os.makedirs(self.temp_path, exist_ok=True)
+        self.stats = {'stored': 0, 'duplicates': 0, 'bytes_stored': 0}
+        self._lock = threading.Lock()
+
+    def path_for(self, sha256):
+        return os.path.join(self.objects_path, sha256[:2], sha256)
+
+    def save_stream(self, chunks):
+        """
+        :param chunks: iterable of bytes chunks, e.g. an ADO client's streamed download
+        :return: tuple of (sha256 hex digest, size in bytes, path of the stored file)
+        """
+        content_hash = hashlib.sha256()
+        size = 0
+        file_handle, temp_file_path = tempfile.mkstemp(dir=self.temp_path)
+        try:
+            with os.fdopen(file_handle, 'wb') as temp_file:
+                for chunk in chunks:
+                    content_hash.update(chunk)
+                    temp_file.write(chunk)
+                    size += len(chunk)
+
+            sha256 = content_hash.hexdigest()
+            stored_path = self.path_for(sha256)
+            with self._lock:
+                if os.path.exists(stored_path):
+                    self.stats['duplicates'] += 1
+                    os.remove(temp_file_path)
+                else:
+                    os.makedirs(os.path.dirname(stored_path), exist_ok=True)
+                    os.replace(temp_file_path, stored_path)
+                    self.stats['stored'] += 1
+                    self.stats['bytes_stored'] += size
+        except BaseException:
+            if os.path.exists(temp_file_path):
+                os.remove(temp_file_path)
+            raise
+
+        return sha256, size, stored_path
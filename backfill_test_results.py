@@ -0,0 +1,165 @@
+import json
+import logging
+import os
+from concurrent.futures import as_completed
+
+from results_sink import TEST_RUN_STAT_COLUMNS, flush_parquet_sinks_if_due
+
+
+logger = logging.getLogger()
+
+BACKFILL_COLUMNS = ('id', 'name', 'build_id', 'build_number', 'finish_time', 'result',
+                    'test_run_id') + TEST_RUN_STAT_COLUMNS
+
+
+class BackfillCheckpoint(object):
+    """Records which build definitions a backfill has finished, in a small json file, so an interrupted backfill
+    can carry on from where it got to rather than starting over.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.completed_definition_ids = set()
+
+        if os.path.exists(filename):
+            with open(filename) as checkpoint_file:
+                self.completed_definition_ids = set(json.load(checkpoint_file)['completed_definition_ids'])
+            logger.info('Backfill checkpoint %s has %s definitions already done'
+                        % (filename, len(self.completed_definition_ids)))
+
+    def is_done(self, definition_id):
+        return definition_id in self.completed_definition_ids
+
+    def mark_done(self, definition_ids):
+        self.completed_definition_ids.update(definition_ids)
+
+        # write a new file and swap it in, so a crash part way through writing can't lose the checkpoint
+        temp_filename = self.filename + '.tmp'
+        with open(temp_filename, 'w') as checkpoint_file:
+            json.dump({'completed_definition_ids': sorted(self.completed_definition_ids)}, checkpoint_file)
+        os.replace(temp_filename, self.filename)
+
+    def remove(self):
+        """
+        Forget every definition, once a backfill is complete, so the next backfill starts afresh
+        """
+        self.completed_definition_ids = set()
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+
+
+def backfill_definition(our_client, our_test_client, build_def_ref, max_builds, min_finish_time, skip_build_ids):
+    """
+    Get the test runs and their statistics for the past completed builds of one definition.
+    Safe to run concurrently for different definitions as it only returns what it gathers.
+
+    :param our_client: ADOBuildObj
+    :param our_test_client: ADOTestClientObj
+    :param build_def_ref: DefinitionRef record for the pipeline
+    :param max_builds: how many of the most recent builds to get, all of them (since min_finish_time) if None
+    :param min_finish_time: datetime - only builds finished after this, if given
+    :param skip_build_ids: build ids (strings) we already have results for
+    :return: list of result row dicts (BACKFILL_COLUMNS) - one per test run, or one for a build with no test runs
+    """
+    builds = [build for build in our_client.iter_completed_builds(build_def_ref.id, max_builds=max_builds,
+                                                                  min_finish_time=min_finish_time)
+              if str(build.id) not in skip_build_ids]
+    logger.info('Backfilling %s builds for definition id: %s, name: %s' % (len(builds), build_def_ref.id,
+                                                                         build_def_ref.name))
+
+    # the test runs for all the builds, in a few batched queries
+    test_runs_by_build_id = our_test_client.get_test_runs_for_builds(builds, use_v6_api=True)
+
+    rows = []
+    for build in builds:
+        build_row = {'id': build_def_ref.id,
+                     'name': build_def_ref.name,
+                     'build_id': build.id,
+                     'build_number': build.build_number,
+                     'finish_time': build.finish_time.isoformat() if build.finish_time else None,
+                     'result': build.result}
+
+        test_runs = test_runs_by_build_id[int(build.id)]
+        if not test_runs:
+            rows.append(build_row)
+            continue
+
+        for test_run in test_runs:
+            row = dict(build_row)
+            row['test_run_id'] = test_run.id
+            one_result = our_test_client.get_test_run_statistics(test_run.id, use_v6_api=True)
+            for this_stat in one_result.run_statistics:
+                row['test_run_stat' + this_stat.outcome] = this_stat.count
+            rows.append(row)
+
+    return rows
+
+
+def run_backfill(executor, our_client, our_test_client, build_def_refs_by_envt, csv_sinks_by_envt,
+                 parquet_sinks_by_envt, checkpoint, max_builds=None, min_finish_time=None):
+    """
+    Backfill the past builds' test results of every definition, fetching definitions in parallel on the executor.
+    Each definition is only fetched once, even if it is in more than one envt, and is checkpointed once its rows
+    have been written out - to the csv straight away, and to parquet when the rows built up are flushed.
+
+    :param build_def_refs_by_envt: dict of envt: list of DefinitionRef records
+    :param csv_sinks_by_envt: dict of envt: ResultsCsvSink (with BACKFILL_COLUMNS and id_column 'build_id')
+    :param parquet_sinks_by_envt: dict of envt: ResultsParquetSink, for the envts being exported to parquet
+    :param checkpoint: BackfillCheckpoint
+    :return: number of definitions backfilled
+    """
+    envts_by_definition_id = {}
+    build_def_refs_by_id = {}
+    for envt, build_def_refs in build_def_refs_by_envt.items():
+        for build_def_ref in build_def_refs:
+            if not checkpoint.is_done(build_def_ref.id):
+                envts_by_definition_id.setdefault(build_def_ref.id, []).append(envt)
+                build_def_refs_by_id.setdefault(build_def_ref.id, build_def_ref)
+
+    logger.info('Backfilling %s definitions (%s already done)'
+                % (len(build_def_refs_by_id), len(checkpoint.completed_definition_ids)))
+
+    # build ids (strings) already in each envt's csv and, if it has one, its parquet dataset - e.g. from an
+    # interrupted backfill, whose last rows may have reached the csv but not parquet
+    sunk_build_ids_by_envt = {}
+    for envt, csv_sink in csv_sinks_by_envt.items():
+        sunk_build_ids_by_envt[envt] = csv_sink.resumed_ids
+        if envt in parquet_sinks_by_envt:
+            sunk_build_ids_by_envt[envt] = sunk_build_ids_by_envt[envt] & frozenset(
+                str(build_id) for build_id in parquet_sinks_by_envt[envt].exported_build_ids)
+
+    futures = {}
+    for definition_id, build_def_ref in build_def_refs_by_id.items():
+        # builds already in every sink the definition goes to
+        skip_build_ids = frozenset.intersection(*[sunk_build_ids_by_envt[envt]
+                                                  for envt in envts_by_definition_id[definition_id]])
+        futures[executor.submit(backfill_definition, our_client, our_test_client, build_def_ref, max_builds,
+                                min_finish_time, skip_build_ids)] = definition_id
+
+    # definitions whose rows are written out, apart from (possibly) to parquet
+    unflushed_definition_ids = []
+    for done_count, future in enumerate(as_completed(futures), 1):
+        definition_id = futures[future]
+        for row in future.result():
+            for envt in envts_by_definition_id[definition_id]:
+                # each sink skips the builds it already has
+                if row['build_id'] is None or str(row['build_id']) not in csv_sinks_by_envt[envt].resumed_ids:
+                    csv_sinks_by_envt[envt].append(row)
+                if envt in parquet_sinks_by_envt:
+                    parquet_sinks_by_envt[envt].add_build_row(definition_id, row['build_id'], row['finish_time'], row)
+        unflushed_definition_ids.append(definition_id)
+
+        if done_count == len(futures):
+            for parquet_sink in parquet_sinks_by_envt.values():
+                parquet_sink.flush()
+            flushed = True
+        else:
+            flushed = flush_parquet_sinks_if_due(parquet_sinks_by_envt.values())
+        # the csv rows are written (and flushed) as they go, so without parquet the definition is done now
+        if flushed or not parquet_sinks_by_envt:
+            checkpoint.mark_done(unflushed_definition_ids)
+            unflushed_definition_ids = []
+
+        logger.info('---- Backfilled %s of %s definitions' % (done_count, len(futures)))
+
+    return len(futures)
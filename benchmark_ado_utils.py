@@ -0,0 +1,173 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import ado_replay
+from ado_utils import connection_registry
+
+logger = logging.getLogger()
+
+DEFAULT_SIZES = (10, 100, 1000)
+DEFAULT_WORKERS = 8
+# the synthetic pipelines are in both of these envts, half each
+BENCHMARK_ENVTS = ('staging', 'uatcopy1')
+# the scheduler's own pacing would otherwise be what we measure
+BENCHMARK_REQUESTS_PER_SECOND = 100000
+
+
+def run_sync_benchmark(backend, latency_seconds, throttle_rate, workers, label):
+    """
+    Run get_pipeline_builds_test_results end to end (csv files and all, in a temporary folder) against a replayed
+    ADO backend
+
+    :param backend: ado_replay.SyntheticADOBackend or ado_replay.FixtureStore
+    :return: benchmark result dict
+    """
+    import get_pipeline_builds_test_results
+
+    connection_registry.clear()
+    transport = ado_replay.ReplayTransport(backend, latency_seconds=latency_seconds, throttle_rate=throttle_rate)
+    connection_registry.transport = transport
+
+    argv = ['--pat', 'benchmark', '--envt'] + list(BENCHMARK_ENVTS) + \
+           ['--workers', str(workers), '--max-requests-per-second', str(BENCHMARK_REQUESTS_PER_SECOND)]
+    working_dir = os.getcwd()
+    try:
+        with tempfile.TemporaryDirectory() as output_dir:
+            os.chdir(output_dir)
+            result = _measure(lambda: get_pipeline_builds_test_results.main(argv))
+    finally:
+        os.chdir(working_dir)
+        connection_registry.transport = None
+        connection_registry.clear()
+
+    result.update(mode='sync', pipelines=label, requests=connection_registry.scheduler.stats['requests'],
+                  retries=connection_registry.scheduler.stats['retries'], throttled=transport.stats['throttled'])
+    return result
+
+
+def run_async_benchmark(backend, latency_seconds, throttle_rate, max_connections, label):
+    """
+    Get the latest test run statistics of every synthetic pipeline with ado_async, against a local
+    ado_stub_server serving the backend
+
+    :return: benchmark result dict
+    """
+    from msrest.authentication import BasicAuthentication
+
+    import ado_async
+    from ado_stub_server import ADOStubServer
+
+    async def gather_all(org_url):
+        async with ado_async.AsyncADOSession(org_url, BasicAuthentication('PAT', 'benchmark'),
+                                             max_connections=max_connections,
+                                             backoff_base_seconds=latency_seconds or 0.01) as session:
+            build_obj = ado_async.AsyncADOBuildObj(session)
+            test_obj = ado_async.AsyncADOTestClientObj(session)
+            definitions = await build_obj.get_list_of_build_definition_references_under_project(
+                path='\\Automation\\MyDelivery')
+            await ado_async.gather_latest_test_run_statistics(build_obj, test_obj,
+                                                              [definition.id for definition in definitions])
+            return session.stats
+
+    with ADOStubServer(backend, latency_seconds=latency_seconds, throttle_rate=throttle_rate) as stub_server:
+        session_stats = {}
+        result = _measure(lambda: session_stats.update(asyncio.run(gather_all(stub_server.url))))
+
+    result.update(mode='async', pipelines=label, requests=session_stats['requests'],
+                  retries=session_stats['retries'], throttled=stub_server.stats['throttled'])
+    return result
+
+
+def _measure(func):
+    tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        func()
+        wall_seconds = time.perf_counter() - started
+        _, peak_bytes = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {'wall_seconds': round(wall_seconds, 3), 'peak_memory_mb': round(peak_bytes / 1024 / 1024, 2)}
+
+
+def log_results(results):
+    logger.warning('%-6s %10s %12s %10s %8s %10s %16s'
+                   % ('mode', 'pipelines', 'wall (s)', 'requests', 'retries', 'throttled', 'peak memory (MB)'))
+    for result in results:
+        logger.warning('%(mode)-6s %(pipelines)10s %(wall_seconds)12.3f %(requests)10s %(retries)8s %(throttled)10s'
+                       ' %(peak_memory_mb)16.2f' % result)
+
+
+def main():
+    """
+    Benchmark our ADO code without ADO - against synthetic projects of 10, 100 and 1000 testrunner pipelines (or
+    fixtures recorded from a real run with get_pipeline_builds_test_results --record-fixtures), reporting the wall
+    time, ADO request count and peak (python) memory of each run. Latency and throttling (429s) can be added to
+    every request to see how we cope with a slow or busy ADO.
+
+    :return: 0
+    """
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    parser = argparse.ArgumentParser(description='Benchmark our ADO code against synthetic or recorded ADO responses.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES),
+                        help="Numbers of synthetic pipelines to benchmark with (default %s)"
+                             % ' '.join(str(size) for size in DEFAULT_SIZES))
+    parser.add_argument('--fixtures-dir', default=None,
+                        help="Replay the fixtures recorded under this folder instead of synthetic pipelines - the"
+                             " recorded run must have been for --envt %s" % ' '.join(BENCHMARK_ENVTS))
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help="Seconds each ADO request takes")
+    parser.add_argument('--throttle-rate', type=float, default=0.0,
+                        help="Fraction (0 to 1) of ADO requests to answer with a 429")
+    parser.add_argument('--workers', '-w', type=int, default=DEFAULT_WORKERS,
+                        help="Number of pipelines to fetch results for concurrently (default %s)" % DEFAULT_WORKERS)
+    parser.add_argument('--async', dest='run_async', action='store_true',
+                        help="Also benchmark ado_async against a local stub server (needs aiohttp)")
+    parser.add_argument('--output', '-o', default=None,
+                        help="Also write the results to this json file")
+    parser.add_argument('--verbose', action='store_true',
+                        help="Log everything the benchmarked code logs, rather than just warnings")
+
+    args = parser.parse_args()
+
+    if args.workers < 1:
+        parser.error('--workers must be 1 or more')
+    if not 0 <= args.throttle_rate < 1:
+        parser.error('--throttle-rate must be from 0 to less than 1')
+    if args.fixtures_dir and args.run_async:
+        parser.error('--async can only be used with synthetic pipelines, not --fixtures-dir')
+
+    # get_pipeline_builds_test_results sets up its own logging when imported, so set our level after it
+    import get_pipeline_builds_test_results
+    logger.setLevel(logging.INFO if args.verbose else logging.WARNING)
+
+    if args.fixtures_dir:
+        backends = [('fixtures', ado_replay.FixtureStore(args.fixtures_dir))]
+    else:
+        backends = [(size, ado_replay.SyntheticADOBackend(size)) for size in args.sizes]
+
+    results = []
+    for label, backend in backends:
+        results.append(run_sync_benchmark(backend, args.latency, args.throttle_rate, args.workers, label))
+        if args.run_async:
+            results.append(run_async_benchmark(backend, args.latency, args.throttle_rate, args.workers * 8, label))
+
+    log_results(results)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
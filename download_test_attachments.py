@@ -0,0 +1,83 @@
+import argparse
+import logging
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from msrest.authentication import BasicAuthentication
+
+import ado_scheduler
+from ado_utils import ADOTestResultsObj, connection_registry
+from attachment_store import ATTACHMENT_COLUMNS, ContentAddressedStore
+from results_sink import ResultsCsvSink
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+handler = logging.StreamHandler(sys.stdout)
+handler.setLevel(logging.INFO)
+formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+handler.setFormatter(formatter)
+
+if logger.hasHandlers():
+    logger.handlers.clear()
+
+logger.addHandler(handler)
+
+DEFAULT_WORKERS = 8
+MANIFEST_FILENAME = 'manifest.csv'
+
+
+def main():
+    """
+    Download every attachment of the given test runs, and of all their test results, into a content addressed
+    store under --output-dir - identical attachments (e.g. the same log from reruns) are only stored once.
+    manifest.csv in the same folder lists every attachment and where its content is stored. Re-running with the
+    same --output-dir skips attachments already in the manifest.
+
+    :return: 1 or 0
+    """
+    parser = argparse.ArgumentParser(description='Download the attachments of ADO test runs and their results.')
+    parser.add_argument('--pat', '-p', required=True,
+                        help="PAT token generated within ADO for user running script")
+    parser.add_argument('--run-id', '-r', type=int, nargs='+', required=True,
+                        help="One or more test run ids to download the attachments of")
+    parser.add_argument('--output-dir', '-o', required=True,
+                        help="Folder to store the attachments and their manifest in")
+    parser.add_argument('--workers', '-w', type=int, default=DEFAULT_WORKERS,
+                        help="Number of attachments to download concurrently (default %s)" % DEFAULT_WORKERS)
+    parser.add_argument('--max-requests-per-second', type=float,
+                        default=ado_scheduler.DEFAULT_REQUESTS_PER_SECOND,
+                        help="Most requests per second to make to ADO - slows down from this if ADO throttles us")
+
+    args = parser.parse_args()
+
+    if args.workers < 1:
+        parser.error('--workers must be 1 or more')
+    if args.max_requests_per_second <= 0:
+        parser.error('--max-requests-per-second must be more than 0')
+
+    connection_registry.scheduler = ado_scheduler.ADORequestScheduler(requests_per_second=args.max_requests_per_second)
+    our_res_client = ADOTestResultsObj(creds=BasicAuthentication('PAT', args.pat), v6_api=True)
+
+    store = ContentAddressedStore(args.output_dir)
+    manifest_sink = ResultsCsvSink(os.path.join(args.output_dir, MANIFEST_FILENAME), fieldnames=ATTACHMENT_COLUMNS,
+                                   resume=True, id_column='attachment_key')
+    try:
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            our_res_client.download_test_run_attachments(list(dict.fromkeys(args.run_id)), store, manifest_sink,
+                                                         executor)
+    finally:
+        manifest_sink.close()
+
+    logger.info('------------------------------------------------------')
+    logger.info('Attachments stored: %(stored)s (%(bytes_stored)s bytes), duplicates not stored again: %(duplicates)s'
+                % store.stats)
+    logger.info('ADO requests: %(requests)s, retries: %(retries)s, throttled: %(throttled)s, failed: %(failed)s'
+                % connection_registry.scheduler.stats)
+    logger.info('Script complete.')
+
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
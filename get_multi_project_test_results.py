@@ -0,0 +1,153 @@
+import argparse
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from msrest.authentication import BasicAuthentication
+
+import ado_cache
+import ado_scheduler
+from ado_utils import ADOBuildObj, ADOTestClientObj, DEFAULT_ORG_URL, DEFAULT_PROJECT_NAME, connection_registry
+from get_pipeline_builds_test_results import DEFAULT_BATCH_SIZE, DEFAULT_WORKERS, ENVTS, \
+    get_pipeline_batch_results, return_filtered_build_names_list
+from results_sink import RESULT_COLUMNS, ResultsCsvSink, ResultsTable
+
+logger = logging.getLogger()
+
+DEFAULT_PROJECT_WORKERS = 4
+DEFAULT_OUTPUT_FILENAME = 'auto_testrunners_report_all_projects.csv'
+CONSOLIDATED_COLUMNS = ('org_url', 'project', 'envt') + RESULT_COLUMNS
+
+
+def get_project_results(target, creds, envts, executor, batch_size, cache=None):
+    """
+    Get the results for every testrunner pipeline of the given envts in one project - as the per project script
+    (get_pipeline_builds_test_results) does, each pipeline only being fetched once however many envts it is in.
+    Safe to run concurrently for different projects, as each gets its own ADO objects.
+
+    :param target: tuple of (org url, project name)
+    :param creds: msrest BasicAuthentication for the target's org
+    :param envts: list of envts, see ENVTS
+    :param executor: ThreadPoolExecutor the project's pipelines are fetched on - shared between projects
+    :param batch_size: number of pipelines to fetch at once
+    :param cache: optional ado_cache.ADOResultsCache
+    :return: results_sink.ResultsTable of CONSOLIDATED_COLUMNS rows, by envt then in each envt's pipeline order
+    """
+    org_url, project_name = target
+    logger.info('*------------------------------ org: %s, project: %s ------------------------------*'
+                % (org_url, project_name))
+    our_client = ADOBuildObj(creds=creds, v6_api=True, cache=cache, org_url=org_url, project_name=project_name)
+    our_test_client = ADOTestClientObj(creds=creds, v6_api=True, cache=cache, org_url=org_url,
+                                       project_name=project_name)
+
+    rows = ResultsTable(CONSOLIDATED_COLUMNS)
+    target_builds_by_id = {}
+    for envt in envts:
+        return_filtered_build_names_list(our_client, envt)
+        target_build_def_refs = our_client.return_target_build_definition_references_dict()
+
+        for build in target_build_def_refs.values():
+            rows.append({'org_url': org_url, 'project': project_name, 'envt': envt,
+                         'id': build.id, 'name': build.name, 'queue_status': build.queue_status})
+            target_builds_by_id.setdefault(build.id, build)
+
+    target_builds = list(target_builds_by_id.values())
+    pipeline_results_by_id = {}
+    for batch_start in range(0, len(target_builds), batch_size):
+        pipeline_results_by_id.update(get_pipeline_batch_results(
+            executor, our_client, our_test_client, target_builds[batch_start:batch_start + batch_size]))
+
+    for index, definition_id in enumerate(rows.column('id')):
+        rows.update(index, pipeline_results_by_id[definition_id])
+    logger.info('---- %s pipelines, %s rows for org: %s, project: %s'
+                % (len(target_builds), len(rows), org_url, project_name))
+
+    return rows
+
+
+def main():
+    """
+    Get the same testrunner results as get_pipeline_builds_test_results, across several projects (and orgs) at
+    once, into one consolidated csv with the org, project and envt of each row.
+
+    :return: 1 or 0
+    """
+    parser = argparse.ArgumentParser(description='Get specific test run data from ADO for the last completed build'
+                                                 ' of testrunner pipelines, across projects and orgs.')
+    parser.add_argument('--pat', '-p', required=True,
+                        help="PAT token generated within ADO for user running script, used for every org not given"
+                             " its own with --org-pat")
+    parser.add_argument('--org-pat', nargs=2, action='append', default=[], metavar=('ORG_URL', 'PAT'),
+                        help="PAT token to use for one org - can be given more than once")
+    parser.add_argument('--target', '-t', nargs=2, action='append', default=None, metavar=('ORG_URL', 'PROJECT'),
+                        help="An org url and project name to report on - can be given more than once"
+                             " (default %s %s)" % (DEFAULT_ORG_URL, DEFAULT_PROJECT_NAME))
+    parser.add_argument('--envt', '-e', choices=ENVTS + ('all',), nargs='+', required=True,
+                        help="One or more environments to report on, or 'all' for every one of them")
+    parser.add_argument('--output', '-o', default=DEFAULT_OUTPUT_FILENAME,
+                        help="csv file to write the consolidated results to (default %s)" % DEFAULT_OUTPUT_FILENAME)
+    parser.add_argument('--project-workers', type=int, default=DEFAULT_PROJECT_WORKERS,
+                        help="Number of projects to work on concurrently (default %s)" % DEFAULT_PROJECT_WORKERS)
+    parser.add_argument('--workers', '-w', type=int, default=DEFAULT_WORKERS,
+                        help="Number of pipelines to fetch results for concurrently, across all projects"
+                             " (default %s)" % DEFAULT_WORKERS)
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help="Number of pipelines per project to fetch at once (default %s)" % DEFAULT_BATCH_SIZE)
+    parser.add_argument('--max-requests-per-second', type=float,
+                        default=ado_scheduler.DEFAULT_REQUESTS_PER_SECOND,
+                        help="Most requests per second to make to ADO - slows down from this if ADO throttles us")
+    parser.add_argument('--cache-file', default=None,
+                        help="SQLite file to cache ADO objects in between runs. No caching if not given.")
+
+    args = parser.parse_args()
+
+    if args.project_workers < 1 or args.workers < 1:
+        parser.error('--project-workers and --workers must be 1 or more')
+    if args.batch_size < 1:
+        parser.error('--batch-size must be 1 or more')
+    if args.max_requests_per_second <= 0:
+        parser.error('--max-requests-per-second must be more than 0')
+
+    envts = list(ENVTS) if 'all' in args.envt else list(dict.fromkeys(args.envt))
+    # de-duplicate, keeping the order given
+    targets = list(dict.fromkeys(tuple(target) for target in args.target or [(DEFAULT_ORG_URL, DEFAULT_PROJECT_NAME)]))
+    pats_by_org_url = dict(args.org_pat)
+
+    our_cache = ado_cache.ADOResultsCache(args.cache_file) if args.cache_file else None
+    # one scheduler for every org, so together our projects stay inside the rate limit
+    connection_registry.scheduler = ado_scheduler.ADORequestScheduler(requests_per_second=args.max_requests_per_second)
+
+    # projects run on their own pool, so they can't starve the shared pipeline pool they submit to
+    with ThreadPoolExecutor(max_workers=args.workers) as executor, \
+            ThreadPoolExecutor(max_workers=args.project_workers) as project_executor:
+        futures = [(target, project_executor.submit(
+            get_project_results, target, BasicAuthentication('PAT', pats_by_org_url.get(target[0], args.pat)),
+            envts, executor, args.batch_size, our_cache)) for target in targets]
+
+        sink = ResultsCsvSink(args.output, fieldnames=CONSOLIDATED_COLUMNS)
+        failed_targets = []
+        # written in the order the targets were given, as each one completes
+        for target, future in futures:
+            try:
+                rows = future.result()
+            except KeyboardInterrupt:
+                raise
+            except BaseException as e:
+                logger.error('Failed to get results for org: %s, project: %s: %s' % (target[0], target[1], e))
+                failed_targets.append(target)
+                continue
+            for row in rows:
+                sink.append(row)
+        sink.close()
+
+    logger.info('---- CSV file written out: %s (%s rows from %s projects)'
+                % (sink.filename, sink.rows_written, len(targets) - len(failed_targets)))
+    logger.info('ADO requests: %(requests)s, retries: %(retries)s, throttled: %(throttled)s, failed: %(failed)s'
+                % connection_registry.scheduler.stats)
+    if our_cache is not None:
+        our_cache.close()
+    logger.info('Script complete.')
+
+    return 1 if failed_targets else 0
+
+
+if __name__ == "__main__":
+    exit(main())
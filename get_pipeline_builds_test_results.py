@@ -1,11 +1,20 @@
 import argparse
 import logging
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 from types import SimpleNamespace
-from msrest.authentication import BasicAuthentication
 
+import ado_cache
+import ado_replay
+import ado_scheduler
 import general_utils
-from ado_utils import ADOBuildObj, ADOTestClientObj, ADOTestResultsObj
+import watch_test_results
+from backfill_test_results import BACKFILL_COLUMNS, BackfillCheckpoint, run_backfill
+from ado_utils import ADOBuildObj, ADOTestClientObj, ADOTestResultsObj, DEFAULT_ORG_URL, DEFAULT_PROJECT_NAME, \
+    connection_registry
+from results_sink import ResultsCsvSink, ResultsParquetSink, flush_parquet_sinks_if_due
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -21,172 +30,782 @@ if logger.hasHandlers():
 
 logger.addHandler(handler)
 
+DEFAULT_WORKERS = 8
+DEFAULT_BATCH_SIZE = 50
 
-def main():
-    """
-    Get specific test run data from ADO for the last completed build associated with testrunner build pipelines,
-     by specified environment.
+BUILD_REPORT_COUNT_FIELDS = ('total', 'passed', 'failed', 'skipped', 'other')
 
-    :return: 1 or 0
-    """
-    logger = logging.getLogger(__name__)
+ENVTS = ('sf_all', 'uatcopy1', 'staging', 'projone', 'projtwo')
+# envts whose testrunners are all the pipelines under their own folder,
+# rather than the SF_ CloudTests pipelines under MyDelivery
+NOT_SF_ENVT_PATHS = {'projone': '\\Automation\\projone\\Active_Testrunners',
+                     'projtwo': '\\Automation\\projtwo\\Active_Testrunners'}
 
-    parser = argparse.ArgumentParser(description='Get specific test run data from ADO for the last completed build'
-                                                 ' associated with testrunner build pipelines,'
-                                                 ' by specified environment.')
-    parser.add_argument('--pat', '-p', required=True, default=False,
-                        help="PAT token generated within ADO for user running script")
-    parser.add_argument('--envt', '-e', choices=('sf_all', 'uatcopy1', 'staging', 'projone', 'projtwo'),
-                        required=True)
+DEFAULT_CHECKPOINT_FILE = 'auto_testrunners_backfill_checkpoint.json'
+DEFAULT_WATCH_STATE_FILE = 'auto_testrunners_watch_state.json'
+DEFINITION_IDS_OUTPUT_FILENAME = 'auto_testrunners_report_definitions.csv'
 
-    args = parser.parse_args()
 
-    personal_access_token = args.pat
-    logger.info('A PAT variable has been passed in as expected.')
+def return_filtered_build_names_list(our_client, envt):
+    """
+    :param our_client: ADOBuildObj
+    :param envt: one of ENVTS
+    :return: list of build names (strings) of the testrunner pipelines for this envt
+    """
+    if envt in NOT_SF_ENVT_PATHS:
+        return our_client.return_filtered_not_sf_testrunner_build_definitions_list(
+            envt, filter_under_path=NOT_SF_ENVT_PATHS[envt])
 
-    # instantiate instance of our ADO object, which connects to ADO, gets our project & build definitions under project
-    our_client = ADOBuildObj(creds=BasicAuthentication('PAT', personal_access_token), v6_api=True)
-
-    # a results object for us to store results we get back from ADO and want to keep
-    our_results = SimpleNamespace()
-
-    # get filtered_build_names_list (a list of pipeline names as strings)
-    if args.envt == 'projone':
-        our_results.filtered_build_names_list =\
-            our_client.return_filtered_not_sf_testrunner_build_definitions_list(
-                args.envt, filter_under_path='\\Automation\\projone\\Active_Testrunners')
-    elif args.envt == 'projtwo':
-        our_results.filtered_build_names_list =\
-            our_client.return_filtered_not_sf_testrunner_build_definitions_list(
-                args.envt, filter_under_path='\\Automation\\projtwo\\Active_Testrunners')
-    else:
-        our_results.filtered_build_names_list =\
-            our_client.return_filtered_testrunner_build_definitions_list(args.envt,
-                                                                         filter_under_path='\\Automation\\MyDelivery')
+    return our_client.return_filtered_testrunner_build_definitions_list(envt,
+                                                                        filter_under_path='\\Automation\\MyDelivery')
 
-    # get target_BuildDefinitionReferences as a dict ('Name':BuildDefinitionReference)
-    our_results.target_build_def_refs = our_client.return_target_build_definition_references_dict()
 
-    # Start storing a results dict that we can use to write to csv later & and also log key build attributes to console
-    our_results.results_to_log_dict = our_client.return_key_build_definition_attributes_dict(log=True)
+def return_build_report_summary_as_dict(report_summary):
+    """
+    :param report_summary: summary dict from ado_report_parser.parse_build_report_stream
+    :return: dict of build_report_* columns for our results
+    """
+    report_as_dict = dict(('build_report_' + field, report_summary[field]) for field in BUILD_REPORT_COUNT_FIELDS)
+    report_as_dict['build_report_duration'] = report_summary['duration']
+    report_as_dict['build_report_failing_tests'] = '; '.join(report_summary['failing_tests'])
 
-    index = 0
-    this_build_as_dict = {}
-    this_report_as_dict = {}
-    # this_test_run_as_dict = {}
-    this_test_run_stats_as_dict = {}
+    return report_as_dict
 
-    logger.info('*-------------------------------------------------------------------------------------------------*')
-    logger.info('Using above list of build definition ids to get last completed build and test run stats for each...')
-    logger.info('*-------------------------------------------------------------------------------------------------*')
 
-    for key, build in our_results.target_build_def_refs.items():
-        # get last_completed_build (run) id for each build definition in our 'target' list
-        this_def = our_client.get_single_build_definition_by_id(build.id)
-        this_build_as_dict['last_comp_build_id'] = this_def.latest_completed_build.id
-        this_build_as_dict['last_comp_build_uri'] = this_def.latest_completed_build.uri
+def get_single_pipeline_build_results(our_client, build):
+    """
+    Run the first part of the chain of ADO calls for one pipeline: definition -> build report.
+    Safe to run concurrently for different pipelines as it only returns what it gathers.
+
+    :param our_client: ADOBuildObj
+    :param build: DefinitionRef for the pipeline
+    :return: tuple of (dict of results for this pipeline, to be merged into the results dict,
+             the pipeline's latest completed Build object)
+    """
+    this_pipeline_results = {}
+
+    # get last_completed_build (run) id for this build definition
+    this_def = our_client.get_single_build_definition_by_id(build.id)
+    finish_time = this_def.latest_completed_build.finish_time
+    this_build_as_dict = {'last_comp_build_id': this_def.latest_completed_build.id,
+                          'last_comp_build_uri': this_def.latest_completed_build.uri,
+                          'last_comp_build_finish_time': finish_time.isoformat() if finish_time else None}
+    # the per pipeline detail is only logged (and its messages only built) when asked for
+    if our_client.verbose_logging:
         logger.info('---- 1) Gathering last completed build data')
         logger.info('For Build Definition id: %s, name: %s, the last completed buildId is:%s ,'
                     ' last completed build uri is: %s' %
                     (build.id, build.name,  this_build_as_dict['last_comp_build_id'],
                      this_build_as_dict['last_comp_build_uri']))
-        our_results.results_to_log_dict[index].update(this_build_as_dict)
+    this_pipeline_results.update(this_build_as_dict)
 
-        # -----------------------------------------------------------------------------
-        # get the report from the last_completed_build - this includes a test results narrative as 'content'
+    # -----------------------------------------------------------------------------
+    # get the report from the last_completed_build - this includes a test results narrative, which we parse
+    # for its test summary as it downloads, rather than keeping the (massive) html
+    if our_client.verbose_logging:
         logger.info('---- 2) Gathering last build report data')
-        this_build_report = our_client.get_latest_build_report_by_build_id(build.id)
+    this_report_summary = our_client.get_build_report_summary(this_def.latest_completed_build.id)
 
-        # Add the content of the test results to our results dict for the relevant build id
-        this_report_as_dict['build_report_html'] = this_build_report.content
-        this_report_as_dict['build_report_build_id'] = this_build_report.build_id  # build run id, not the definition id
-        our_results.results_to_log_dict[index].update(this_report_as_dict)
+    # Add the summary of the test results to our results dict for the relevant build id
+    this_report_as_dict = return_build_report_summary_as_dict(this_report_summary)
+    this_report_as_dict['build_report_build_id'] = this_def.latest_completed_build.id  # build run id, not definition id
+    this_pipeline_results.update(this_report_as_dict)
+    if our_client.verbose_logging:
         logger.info('Build report retrieved for id: %s' % this_report_as_dict['build_report_build_id'])
-        # -----------------------------------------------------------------------------
+    # -----------------------------------------------------------------------------
 
-        logger.info('---- 3) Gathering test run data related to last completed build')
-        our_test_client = ADOTestClientObj(creds=BasicAuthentication('PAT', personal_access_token), v6_api=True)
-        test_runs_for_this_build_uri =\
-            our_test_client.get_test_runs(this_build_as_dict['last_comp_build_uri'], use_v6_api=True)
-        # there should always only be one, I think...
-        try:
-            test_run_obj_for_this_build_uri = test_runs_for_this_build_uri[0]
-            # unless there are none...
-        except IndexError as e:
-            logger.error('No test runs seem to exist for this build.')
-            test_run_obj_for_this_build_uri = False
-
-        if test_run_obj_for_this_build_uri:
-            # Add the key items we want to a dict
-            this_test_run_as_dict = general_utils.add_build_run_details_to_dict(test_run_obj_for_this_build_uri)
-            # add the above dict (i.e. test results data for this run) to our results dict
-            our_results.results_to_log_dict[index].update(this_test_run_as_dict)
+    return this_pipeline_results, this_def.latest_completed_build
+
+
+def get_single_pipeline_test_run_results(our_test_client, build, test_runs_for_this_build_uri):
+    """
+    Run the rest of the chain of ADO calls for one pipeline, once we have the test runs for its latest completed
+    build: test runs -> test run statistics.
+    Safe to run concurrently for different pipelines as it only returns what it gathers.
+
+    :param our_test_client: ADOTestClientObj
+    :param build: DefinitionRef for the pipeline
+    :param test_runs_for_this_build_uri: list of TestRun objects for the pipeline's latest completed build
+    :return: dict of results for this pipeline, to be merged into the results dict
+    """
+    this_pipeline_results = {}
+
+    if our_test_client.verbose_logging:
+        logger.info('---- 3) Gathering test run data related to last completed build of definition id: %s' % build.id)
+    # there should always only be one, I think...
+    try:
+        test_run_obj_for_this_build_uri = test_runs_for_this_build_uri[0]
+        # unless there are none...
+    except IndexError as e:
+        logger.error('No test runs seem to exist for build definition id: %s.' % build.id)
+        test_run_obj_for_this_build_uri = False
+
+    if test_run_obj_for_this_build_uri:
+        # Add the key items we want to a dict
+        this_test_run_as_dict = general_utils.add_build_run_details_to_dict(test_run_obj_for_this_build_uri)
+        # add the above dict (i.e. test results data for this run) to our results dict
+        this_pipeline_results.update(this_test_run_as_dict)
+        if our_test_client.verbose_logging:
             logger.info(this_test_run_as_dict)
-        else:
-            this_test_run_as_dict = False
+    else:
+        this_test_run_as_dict = False
 
-        if this_test_run_as_dict:
-            # ----------- get test run statistics - may be overkill, but seems a bit more user friendly that stats above
+    if this_test_run_as_dict:
+        # ----------- get test run statistics - may be overkill, but seems a bit more user friendly that stats above
+        if our_test_client.verbose_logging:
             logger.info('---- 4) About to get the test run statistics for: %s' % this_test_run_as_dict['test_run_id'])
-            one_result = our_test_client.get_test_run_statistics(this_test_run_as_dict['test_run_id'], use_v6_api=True)
+        one_result = our_test_client.get_test_run_statistics(this_test_run_as_dict['test_run_id'], use_v6_api=True)
 
+        if our_test_client.verbose_logging:
             logger.info('Results statistics for run id: %s' % this_test_run_as_dict['test_run_id'])
-            stats = one_result.run_statistics
-            for this_stat in stats:
+        this_test_run_stats_as_dict = {}
+        for this_stat in one_result.run_statistics:
+            if our_test_client.verbose_logging:
                 logger.info('For result %s the count is %s' % (this_stat.outcome, this_stat.count))
-                stat_key = 'test_run_stat' + this_stat.outcome
-                this_test_run_stats_as_dict[stat_key] = this_stat.count
+            stat_key = 'test_run_stat' + this_stat.outcome
+            this_test_run_stats_as_dict[stat_key] = this_stat.count
 
-            # add the test results data for this run to our results dict
-            our_results.results_to_log_dict[index].update(this_test_run_stats_as_dict)
+        # add the test results data for this run to our results dict
+        this_pipeline_results.update(this_test_run_stats_as_dict)
 
-            # the below could be useful to get attachments in future?
-            # our_res_client = ADOTestResultsObj(creds=BasicAuthentication('PAT', personal_access_token), v6_api=True)
-            # one_result = our_res_client.get_test_result_log(one_run_id, use_v6_api=True)
+        # the below could be useful to get attachments in future?
+        # our_res_client = ADOTestResultsObj(creds=BasicAuthentication('PAT', personal_access_token), v6_api=True)
+        # one_result = our_res_client.get_test_result_log(one_run_id, one_result_id)
 
-        else:
-            logger.info('---- No test runs - ** Skipping task 4) ** to get test run statistics for latest run  ----')
+    elif our_test_client.verbose_logging:
+        logger.info('---- No test runs for build definition id: %s - ** Skipping task 4) ** to get test run statistics'
+                    ' for latest run  ----' % build.id)
 
+    if our_test_client.verbose_logging:
         logger.info('------------------------------------------------------')
-        index += 1
-
-        # Add the variables associated with each BuildDefinition pipeline and their settings to our results
-        # vars_dict = general_utils.reformat_single_definition_vars_dict_for_results(this_def.variables,
-        #                                                                            verbose=False)
-        # our_results.results_to_log_dict[index].update(vars_dict)
-
-        # # get scheduled build trigger details
-        # if this_def.triggers:
-        #     triggers_dict =\
-        #         general_utils.reformat_single_definition_relevant_triggers_for_results(this_def.triggers,
-        #                                                                                verbose=False)
-        #     our_results.results_to_log_dict[index].update(triggers_dict)
-        # else:
-        #     if our_client.verbose_logging:
-        #         logger.info('No scheduled trigger for this build.')
-        #
-
-    # TODO : the content of the reports we've got need parsed to be useful - each is a massive report...
-    # For now, just log one build report html as an example
-    logger.info('--------------------------------------------------------')
-    logger.info('below used build_report.content to get BuildReportMetadata.content')
-    logger.info('WIP - just logging one example result report below here - its a verbose html string for now..')
-    logger.info('build_report_html for build defintition id: %s, last_succesful_build id '
-                '(build_report_build_id): %s is : %s' %
-                (our_results.results_to_log_dict[0]['id'],
-                 our_results.results_to_log_dict[0]['build_report_build_id'],
-                 our_results.results_to_log_dict[0]['build_report_html']))
-
-    # Write out to csv file
-    filename = 'auto_testrunners_report_%s.csv' % args.envt
-    general_utils.write_out_report_csv_from_dict(filename, our_results.results_to_log_dict, limit_fieldset=True)
-    logger.info('---- CSV file written out: %s' % filename)
 
-    # Close script and log outcomes
+    # Add the variables associated with each BuildDefinition pipeline and their settings to our results
+    # vars_dict = general_utils.reformat_single_definition_vars_dict_for_results(this_def.variables,
+    #                                                                            verbose=False)
+    # this_pipeline_results.update(vars_dict)
+
+    # # get scheduled build trigger details
+    # if this_def.triggers:
+    #     triggers_dict =\
+    #         general_utils.reformat_single_definition_relevant_triggers_for_results(this_def.triggers,
+    #                                                                                verbose=False)
+    #     this_pipeline_results.update(triggers_dict)
+    # else:
+    #     if our_client.verbose_logging:
+    #         logger.info('No scheduled trigger for this build.')
+    #
+
+    return this_pipeline_results
+
+
+def get_pipeline_batch_results(executor, our_client, our_test_client, builds):
+    """
+    Get the results for a batch of pipelines. Each pipeline's chain of calls is independent of the others, so they
+    are fanned out over the executor's bounded pool of workers, apart from the test runs, which are got for the
+    whole batch at once.
+
+    :param executor: ThreadPoolExecutor
+    :param our_client: ADOBuildObj
+    :param our_test_client: ADOTestClientObj
+    :param builds: list of DefinitionRef records for the pipelines
+    :return: dict of definition id: dict of results for that pipeline
+    """
+    futures = dict((build.id, executor.submit(get_single_pipeline_build_results, our_client, build))
+                   for build in builds)
+    pipeline_results_by_id = {}
+    latest_completed_builds_by_id = {}
+    for build_id, future in futures.items():
+        pipeline_results_by_id[build_id], latest_completed_builds_by_id[build_id] = future.result()
+
+    # get the test runs for every pipeline's latest completed build in a few batched queries
+    logger.info('---- 3) Gathering test run data related to last completed builds')
+    test_runs_by_build_id = our_test_client.get_test_runs_for_builds(
+        list(latest_completed_builds_by_id.values()), use_v6_api=True)
+
+    futures = {}
+    for build in builds:
+        test_runs = test_runs_by_build_id[int(latest_completed_builds_by_id[build.id].id)]
+        futures[build.id] = executor.submit(get_single_pipeline_test_run_results, our_test_client, build, test_runs)
+    for build_id, future in futures.items():
+        pipeline_results_by_id[build_id].update(future.result())
+
+    return pipeline_results_by_id
+
+
+def get_pipeline_batch_results_isolating_failures(executor, our_client, our_test_client, builds):
+    """
+    As get_pipeline_batch_results, but if the batch fails its pipelines are got one at a time, so only the ones that
+    fail themselves are lost
+
+    :return: tuple of (dict of definition id: dict of results for that pipeline,
+             dict of definition id: exception for the pipelines that failed)
+    """
+    try:
+        return get_pipeline_batch_results(executor, our_client, our_test_client, builds), {}
+    except KeyboardInterrupt:
+        raise
+    except BaseException as e:
+        if len(builds) == 1:
+            return {}, {builds[0].id: e}
+        logger.error('---- The batch of pipelines failed (%s) - getting them one at a time' % e)
+
+    pipeline_results_by_id = {}
+    errors_by_id = {}
+    for build in builds:
+        build_results_by_id, build_errors_by_id = get_pipeline_batch_results_isolating_failures(
+            executor, our_client, our_test_client, [build])
+        pipeline_results_by_id.update(build_results_by_id)
+        errors_by_id.update(build_errors_by_id)
+
+    return pipeline_results_by_id, errors_by_id
+
+
+def report_definition_ids(args, our_client, our_test_client):
+    """
+    Get the results of just the pipelines with the given definition ids into auto_testrunners_report_definitions.csv
+    - fetching each definition directly, without listing (or filtering) the definitions under the project at all.
+
+    :param args: our parsed command line args
+    :return: the ResultsCsvSink written to
+    """
+    sink = ResultsCsvSink(DEFINITION_IDS_OUTPUT_FILENAME, resume=args.resume)
+    # de-duplicate, keeping the order given
+    definition_ids = [definition_id for definition_id in dict.fromkeys(args.definition_id)
+                      if not sink.is_written(definition_id)]
+    logger.info('Getting the results of %s pipelines by definition id' % len(definition_ids))
+
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        # BuildDefinition objects - kept for the rest of the run, so they are only fetched the once
+        definitions = list(executor.map(our_client.get_single_build_definition_by_id, definition_ids))
+
+        for batch_start in range(0, len(definitions), args.batch_size):
+            batch_definitions = definitions[batch_start:batch_start + args.batch_size]
+            pipeline_results_by_id = get_pipeline_batch_results(executor, our_client, our_test_client,
+                                                                batch_definitions)
+            for position, definition in enumerate(batch_definitions, batch_start):
+                row = {'id': definition.id, 'name': definition.name, 'queue_status': definition.queue_status}
+                row.update(pipeline_results_by_id[definition.id])
+                sink.add(position, row)
+
+    sink.close()
+    logger.info('---- CSV file written out: %s (%s pipelines added this run)' % (sink.filename, sink.rows_written))
+
+    return sink
+
+
+def get_new_build_results(executor, our_client, our_test_client, build_def_refs_by_id, builds):
+    """
+    Get the results of builds we already have (e.g. newly completed ones), rather than of each pipeline's latest
+    completed build: build report -> test runs -> test run statistics, fanned out over the executor apart from
+    the test runs, which are got for all the builds at once.
+
+    :param build_def_refs_by_id: dict of definition id: DefinitionRef, for every build's definition
+    :param builds: list of Build objects
+    :return: list of results rows (dicts of RESULT_COLUMNS), one per build, in the order of builds
+    """
+    report_futures = [executor.submit(our_client.get_build_report_summary, build.id) for build in builds]
+    test_runs_by_build_id = our_test_client.get_test_runs_for_builds(builds, use_v6_api=True)
+
+    rows = []
+    test_run_futures = []
+    for build, report_future in zip(builds, report_futures):
+        build_def_ref = build_def_refs_by_id[build.definition.id]
+        row = {'id': build_def_ref.id,
+               'name': build_def_ref.name,
+               'queue_status': build_def_ref.queue_status,
+               'last_comp_build_id': build.id,
+               'last_comp_build_uri': build.uri,
+               'last_comp_build_finish_time': build.finish_time.isoformat() if build.finish_time else None,
+               'build_report_build_id': build.id}
+        row.update(return_build_report_summary_as_dict(report_future.result()))
+        rows.append(row)
+        test_run_futures.append(executor.submit(get_single_pipeline_test_run_results, our_test_client, build_def_ref,
+                                                test_runs_by_build_id[int(build.id)]))
+
+    for row, future in zip(rows, test_run_futures):
+        row.update(future.result())
+
+    return rows
+
+
+def watch_envts(args, our_client, our_test_client, results_by_envt):
+    """
+    Keep polling for the builds of each envt's pipelines completed since the last poll, writing a row for each new
+    build to auto_testrunners_watch_<envt>.csv (and the parquet dataset, if asked for) as soon as it is gathered.
+    The pipelines are only listed and filtered once, at the start - restart the watch to pick up new ones.
+    Each poll costs a query per few definitions, plus the calls for each new build, however many pipelines
+    there are.
+
+    :param args: our parsed command line args
+    :param results_by_envt: dict of envt: results object with target_build_def_refs, as built in main
+    """
+    state = watch_test_results.WatchState(args.watch_state_file)
+
+    envts_by_definition_id = {}
+    build_def_refs_by_id = {}
+    csv_sinks_by_envt = {}
+    parquet_sinks_by_envt = {}
+    for envt, our_results in results_by_envt.items():
+        if not our_results.target_build_def_refs:
+            logger.info('---- No testrunner pipelines found for envt: %s - not watching it' % envt)
+            continue
+
+        for build_def_ref in our_results.target_build_def_refs.values():
+            envts_by_definition_id.setdefault(build_def_ref.id, []).append(envt)
+            build_def_refs_by_id.setdefault(build_def_ref.id, build_def_ref)
+        if args.parquet_dir:
+            parquet_sinks_by_envt[envt] = ResultsParquetSink(args.parquet_dir, envt)
+        # always resumed, one row per build, so a restarted watch never writes a build twice
+        csv_sinks_by_envt[envt] = ResultsCsvSink('auto_testrunners_watch_%s.csv' % envt, resume=True,
+                                                 id_column='last_comp_build_id')
+
+    definition_ids = list(build_def_refs_by_id)
+    logger.info('Watching %s pipelines for builds completed since %s, every %s seconds'
+                % (len(definition_ids), state.high_water_mark.isoformat(), args.watch_interval))
+
+    polls = 0
+    # build id: polls its batch has failed in so far
+    failed_polls_by_build_id = {}
+    # builds done with but not yet marked seen, as their parquet rows are still held - not got again meanwhile
+    unflushed_builds = []
+
+    def mark_done(builds):
+        # only marked seen once their rows are out, so a crash gets them again
+        unflushed_builds.extend(builds)
+        if flush_parquet_sinks_if_due(parquet_sinks_by_envt.values()) or \
+                not any(parquet_sink.rows_pending for parquet_sink in parquet_sinks_by_envt.values()):
+            state.mark_seen(unflushed_builds)
+            del unflushed_builds[:]
+
+    try:
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            while True:
+                poll_started = time.monotonic()
+                try:
+                    new_builds = watch_test_results.poll_new_builds(our_client, definition_ids, state)
+                except KeyboardInterrupt:
+                    raise
+                except BaseException as e:
+                    logger.error('Failed to poll for new builds, trying again next poll: %s' % e)
+                    new_builds = []
+                unflushed_build_ids = set(build.id for build in unflushed_builds)
+                new_builds = [build for build in new_builds if build.id not in unflushed_build_ids]
+
+                for batch_start in range(0, len(new_builds), args.batch_size):
+                    batch_builds = new_builds[batch_start:batch_start + args.batch_size]
+                    try:
+                        rows = get_new_build_results(executor, our_client, our_test_client, build_def_refs_by_id,
+                                                     batch_builds)
+                    except KeyboardInterrupt:
+                        raise
+                    except BaseException as e:
+                        failed_polls = max(failed_polls_by_build_id.get(build.id, 0) for build in batch_builds) + 1
+                        if failed_polls < watch_test_results.WATCH_MAX_FAILED_POLLS:
+                            for build in batch_builds:
+                                failed_polls_by_build_id[build.id] = failed_polls
+                            # the later batches wait too, so the high water mark doesn't pass this one's builds
+                            logger.error('Failed to get the results of builds %s, trying again next poll: %s'
+                                         % (', '.join(str(build.id) for build in batch_builds), e))
+                            break
+                        logger.error('Failed to get the results of builds %s in %s polls, skipping them: %s'
+                                     % (', '.join(str(build.id) for build in batch_builds), failed_polls, e))
+                        mark_done(batch_builds)
+                        continue
+                    for build in batch_builds:
+                        failed_polls_by_build_id.pop(build.id, None)
+
+                    for row in rows:
+                        for envt in envts_by_definition_id[row['id']]:
+                            if not csv_sinks_by_envt[envt].is_written(row['last_comp_build_id']):
+                                csv_sinks_by_envt[envt].append(row)
+                            # even if in the csv, as a crash may have lost it before its parquet rows were written
+                            # - the parquet sink skips builds it already has
+                            if envt in parquet_sinks_by_envt:
+                                parquet_sinks_by_envt[envt].add(row)
+                    mark_done(batch_builds)
+
+                polls += 1
+                logger.info('---- Poll %s: %s new builds, high water mark now %s'
+                            % (polls, len(new_builds), state.high_water_mark.isoformat()))
+                if args.watch_polls and polls >= args.watch_polls:
+                    break
+                time.sleep(max(0, args.watch_interval - (time.monotonic() - poll_started)))
+    except KeyboardInterrupt:
+        logger.info('Watch interrupted after %s polls' % polls)
+    finally:
+        for parquet_sink in parquet_sinks_by_envt.values():
+            parquet_sink.close()
+        if unflushed_builds:
+            state.mark_seen(unflushed_builds)
+        for envt, sink in csv_sinks_by_envt.items():
+            sink.close()
+            logger.info('---- CSV file written out: %s (%s builds added this run)' % (sink.filename, sink.rows_written))
+
+
+def backfill_envts(args, our_client, our_test_client, results_by_envt):
+    """
+    Backfill the test results of past builds (not just the latest completed one) of each envt's pipelines,
+    into one auto_testrunners_backfill_<envt>.csv per envt (and the parquet dataset, if asked for).
+    Finished pipelines are recorded in the checkpoint file, so an interrupted backfill carries on where it stopped,
+    and the checkpoint file is removed once every pipeline is done.
+
+    :param args: our parsed command line args
+    :param results_by_envt: dict of envt: results object with target_build_def_refs, as built in main
+    """
+    min_finish_time = None
+    if args.backfill_since:
+        min_finish_time = datetime.strptime(args.backfill_since, '%Y-%m-%d').replace(tzinfo=timezone.utc)
+
+    checkpoint = BackfillCheckpoint(args.checkpoint_file)
+    build_def_refs_by_envt = {}
+    csv_sinks_by_envt = {}
+    parquet_sinks_by_envt = {}
+    for envt, our_results in results_by_envt.items():
+        if not our_results.target_build_def_refs:
+            logger.info('---- No testrunner pipelines found for envt: %s - no CSV file written' % envt)
+            continue
+
+        build_def_refs_by_envt[envt] = list(our_results.target_build_def_refs.values())
+        if args.parquet_dir:
+            parquet_sinks_by_envt[envt] = ResultsParquetSink(args.parquet_dir, envt)
+        # always resumed, so builds already backfilled are kept (and not fetched again) alongside the checkpoint
+        csv_sinks_by_envt[envt] = ResultsCsvSink('auto_testrunners_backfill_%s.csv' % envt,
+                                                 fieldnames=BACKFILL_COLUMNS, resume=True, id_column='build_id')
+
+    logger.info('Backfilling test results for up to %s builds per pipeline, finished since %s'
+                % (args.backfill_builds or 'all', args.backfill_since or 'ever'))
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        run_backfill(executor, our_client, our_test_client, build_def_refs_by_envt, csv_sinks_by_envt,
+                     parquet_sinks_by_envt, checkpoint, max_builds=args.backfill_builds,
+                     min_finish_time=min_finish_time)
+    # every pipeline is done, so the next backfill (perhaps of other builds) must not skip them
+    checkpoint.remove()
+
+    for envt, parquet_sink in parquet_sinks_by_envt.items():
+        parquet_sink.close()
+        logger.info('---- Parquet rows added under %s for envt %s: %s'
+                    % (args.parquet_dir, envt, parquet_sink.rows_written))
+
+    for envt, sink in csv_sinks_by_envt.items():
+        sink.close()
+        logger.info('---- CSV file written out: %s (%s rows added this run)' % (sink.filename, sink.rows_written))
+
+
+def export_metrics(args):
+    """
+    Write the ADO call metrics gathered this run to the files asked for with --metrics-file and --prometheus-file
+    """
+    if args.metrics_file:
+        connection_registry.metrics.write_json_summary(args.metrics_file)
+        logger.info('ADO call metrics written to: %s' % args.metrics_file)
+    if args.prometheus_file:
+        connection_registry.metrics.write_prometheus_text(args.prometheus_file)
+        logger.info('ADO call metrics written in Prometheus text format to: %s' % args.prometheus_file)
+
+
+def log_run_stats(our_client, our_test_client, our_cache):
     logger.info('------------------------------------------------------')
+    logger.info('ADO clients built: %(built)s, shared between objects: %(reused)s' % connection_registry.client_stats)
+    logger.info('ADO client cache hits, build client: %s, test client: %s'
+                % (our_client.client_stats['reused'], our_test_client.client_stats['reused']))
+    logger.info('ADO requests: %(requests)s, retries: %(retries)s, throttled: %(throttled)s, failed: %(failed)s'
+                % connection_registry.scheduler.stats)
+    connection_registry.metrics.log_summary()
+    if our_cache is not None:
+        logger.info('Cache hits: %(hits)s, misses: %(misses)s, evicted: %(evicted)s' % our_cache.stats)
+        our_cache.close()
+
+
+def log_failed_envts(errors_by_envt):
+    """
+    :param errors_by_envt: dict of envt: the exception it failed with
+    :return: 1 if any envt failed, otherwise 0 - for main to return
+    """
+    for envt, e in errors_by_envt.items():
+        logger.error('envt: %s failed - its csv is missing or has pipelines without results: %s' % (envt, e))
+
+    return 1 if errors_by_envt else 0
+
+
+def main(argv=None):
+    """
+    Get specific test run data from ADO for the last completed build associated with testrunner build pipelines,
+     by specified environment(s). One csv is written per environment, but the definitions are only listed once
+     and pipelines shared between environments are only fetched once. An environment that fails doesn't stop the
+     others - their csvs are still written, and the run returns 1 at the end.
+
+    :param argv: list of command line arguments, sys.argv[1:] if None
+    :return: 1 if any environment failed, otherwise 0
+    """
+    logger = logging.getLogger(__name__)
+
+    parser = argparse.ArgumentParser(description='Get specific test run data from ADO for the last completed build'
+                                                 ' associated with testrunner build pipelines,'
+                                                 ' by specified environment.')
+    parser.add_argument('--pat', '-p', required=True, default=False,
+                        help="PAT token generated within ADO for user running script")
+    parser.add_argument('--envt', '-e', choices=ENVTS + ('all',), nargs='+', default=None,
+                        help="One or more environments to report on, or 'all' for every one of them")
+    parser.add_argument('--definition-id', '-d', type=int, nargs='+', default=None,
+                        help="Report on just the pipelines with these build definition ids, rather than an envt's,"
+                             " into %s - quicker, as neither the org's projects nor the project's definitions are"
+                             " listed" %
+                             DEFINITION_IDS_OUTPUT_FILENAME)
+    parser.add_argument('--org-url', default=DEFAULT_ORG_URL,
+                        help="Url of the ADO organization to report on (default %s)" % DEFAULT_ORG_URL)
+    parser.add_argument('--project', default=DEFAULT_PROJECT_NAME,
+                        help="Name of the ADO project to report on (default %s)" % DEFAULT_PROJECT_NAME)
+    parser.add_argument('--workers', '-w', type=int, default=DEFAULT_WORKERS,
+                        help="Number of pipelines to fetch results for concurrently (default %s)" % DEFAULT_WORKERS)
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help="Number of pipelines to fetch before writing their rows out (default %s)"
+                             % DEFAULT_BATCH_SIZE)
+    parser.add_argument('--resume', action='store_true',
+                        help="Append to existing csv files, skipping pipelines already in them, rather than starting"
+                             " them again - e.g. after a run was interrupted")
+    parser.add_argument('--parquet-dir', default=None,
+                        help="Also append each build's test run statistics to a Parquet dataset under this folder,"
+                             " partitioned by envt and build date, for trends over time (needs pyarrow)")
+    parser.add_argument('--max-requests-per-second', type=float,
+                        default=ado_scheduler.DEFAULT_REQUESTS_PER_SECOND,
+                        help="Most requests per second to make to ADO - slows down from this if ADO throttles us")
+    parser.add_argument('--cache-file', default=None,
+                        help="SQLite file to cache ADO definitions, build reports and test run stats in between runs,"
+                             " so only builds completed since the last run are fetched. No caching if not given.")
+    parser.add_argument('--cache-max-entries', type=int, default=ado_cache.DEFAULT_MAX_ENTRIES,
+                        help="Entries to keep in the cache file before evicting the least recently used ones")
+    parser.add_argument('--backfill-builds', type=int, default=None,
+                        help="Backfill the test results of (up to) this many of each pipeline's most recent completed"
+                             " builds, rather than just the latest one, into auto_testrunners_backfill_<envt>.csv")
+    parser.add_argument('--backfill-since', default=None,
+                        help="Backfill the test results of each pipeline's builds completed since this date"
+                             " (YYYY-MM-DD, UTC) - can be combined with --backfill-builds")
+    parser.add_argument('--checkpoint-file', default=DEFAULT_CHECKPOINT_FILE,
+                        help="File recording which pipelines a backfill has finished, so it can be resumed -"
+                             " removed once a backfill completes (default %s)" % DEFAULT_CHECKPOINT_FILE)
+    parser.add_argument('--watch', action='store_true',
+                        help="Keep running, polling for newly completed builds of the pipelines and adding a row"
+                             " for each one to auto_testrunners_watch_<envt>.csv as it completes")
+    parser.add_argument('--watch-interval', type=float, default=watch_test_results.DEFAULT_WATCH_INTERVAL_SECONDS,
+                        help="Seconds between polls with --watch (default %s)"
+                             % watch_test_results.DEFAULT_WATCH_INTERVAL_SECONDS)
+    parser.add_argument('--watch-polls', type=int, default=None,
+                        help="Stop watching after this many polls - otherwise watch until interrupted")
+    parser.add_argument('--watch-state-file', default=DEFAULT_WATCH_STATE_FILE,
+                        help="File keeping the latest build finish time seen by --watch, so a restarted watch"
+                             " carries on from it (default %s)" % DEFAULT_WATCH_STATE_FILE)
+    parser.add_argument('--metrics-file', default=None,
+                        help="Write a json summary of every ADO call made - counts, time taken, bytes received and"
+                             " retries, by endpoint and API version - to this file at the end of the run")
+    parser.add_argument('--prometheus-file', default=None,
+                        help="Also write the ADO call metrics to this file in the Prometheus text format"
+                             " (e.g. for the node_exporter textfile collector)")
+    parser.add_argument('--verbose', '-v', action='store_true',
+                        help="Log the detail of every pipeline's ADO calls as they are made")
+    parser.add_argument('--record-fixtures', default=None,
+                        help="Save every ADO response this run gets as a fixture under this folder, to replay the"
+                             " run without ADO later (see ado_replay and benchmark_ado_utils)")
+
+    args = parser.parse_args(argv)
+
+    if not args.envt and not args.definition_id:
+        parser.error('one of --envt or --definition-id is required')
+    if args.envt and args.definition_id:
+        parser.error('--envt and --definition-id cannot be used together')
+    if args.definition_id and (args.watch or args.backfill_builds or args.backfill_since or args.parquet_dir):
+        parser.error('--definition-id cannot be used with --watch, --backfill-builds, --backfill-since or'
+                     ' --parquet-dir')
+    if args.workers < 1:
+        parser.error('--workers must be 1 or more')
+    if args.batch_size < 1:
+        parser.error('--batch-size must be 1 or more')
+    if args.max_requests_per_second <= 0:
+        parser.error('--max-requests-per-second must be more than 0')
+    if args.backfill_builds is not None and args.backfill_builds < 1:
+        parser.error('--backfill-builds must be 1 or more')
+    if args.watch and (args.backfill_builds or args.backfill_since):
+        parser.error('--watch cannot be used with --backfill-builds or --backfill-since')
+    if args.watch_interval < 0:
+        parser.error('--watch-interval must be 0 or more')
+    if args.watch_polls is not None and args.watch_polls < 1:
+        parser.error('--watch-polls must be 1 or more')
+    if args.backfill_since:
+        try:
+            datetime.strptime(args.backfill_since, '%Y-%m-%d')
+        except ValueError:
+            parser.error('--backfill-since must be a date in the form YYYY-MM-DD')
+
+    if args.definition_id:
+        envts = []
+    elif 'all' in args.envt:
+        envts = list(ENVTS)
+    else:
+        # de-duplicate, keeping the order given
+        envts = list(dict.fromkeys(args.envt))
+
+    personal_access_token = args.pat
+    logger.info('A PAT variable has been passed in as expected.')
+
+    if args.cache_file:
+        our_cache = ado_cache.ADOResultsCache(args.cache_file, max_entries=args.cache_max_entries)
+        our_cache.evict_expired()
+        logger.info('Using cache file: %s' % args.cache_file)
+    else:
+        our_cache = None
+
+    # every ADO call goes through this, so our workers don't get us throttled
+    connection_registry.scheduler = ado_scheduler.ADORequestScheduler(requests_per_second=args.max_requests_per_second)
+    if args.record_fixtures:
+        connection_registry.transport = ado_replay.RecordingTransport(ado_replay.FixtureStore(args.record_fixtures))
+        logger.info('Recording ADO responses as fixtures under: %s' % args.record_fixtures)
+
+    # only imported now the arguments are good, as it takes a while
+    from msrest.authentication import BasicAuthentication
+
+    our_creds = BasicAuthentication('PAT', personal_access_token)
+    # our project and definitions are only looked up (and listed) on first use
+    our_client = ADOBuildObj(creds=our_creds, v6_api=True, cache=our_cache, org_url=args.org_url,
+                             project_name=args.project)
+    # shares our_client's connection, clients and project via the connection registry
+    our_test_client = ADOTestClientObj(creds=our_creds, v6_api=True, cache=our_cache, org_url=args.org_url,
+                                       project_name=args.project)
+    our_client.verbose_logging = our_test_client.verbose_logging = args.verbose
+    # a run of just some definitions only needs our project, so the org's projects aren't listed
+    our_client.list_projects = our_test_client.list_projects = not args.definition_id
+
+    if args.definition_id:
+        report_definition_ids(args, our_client, our_test_client)
+        export_metrics(args)
+        log_run_stats(our_client, our_test_client, our_cache)
+        logger.info('Script complete.')
+        return 0
+
+    # a results object per envt for us to store results we get back from ADO and want to keep
+    results_by_envt = {}
+    # envt: the exception it failed with - the other envts carry on without it
+    errors_by_envt = {}
+    for envt in envts:
+        logger.info('*--------------------------------------- envt: %s ---------------------------------------*' % envt)
+        our_results = SimpleNamespace()
+        try:
+            # get filtered_build_names_list (a list of pipeline names as strings)
+            our_results.filtered_build_names_list = return_filtered_build_names_list(our_client, envt)
+
+            # get target_BuildDefinitionReferences as a dict ('Name':DefinitionRef)
+            our_results.target_build_def_refs = our_client.return_target_build_definition_references_dict()
+
+            # Start storing a results table (a row per pipeline) to write to csv later & and also log key build
+            # attributes
+            our_results.results_table = our_client.return_key_build_definition_attributes_table(log=True)
+        except KeyboardInterrupt:
+            raise
+        except BaseException as e:
+            logger.error('---- Failed to get the testrunner pipelines for envt: %s - carrying on without it: %s'
+                         % (envt, e))
+            errors_by_envt[envt] = e
+            continue
+
+        results_by_envt[envt] = our_results
+
+    if args.backfill_builds or args.backfill_since:
+        backfill_envts(args, our_client, our_test_client, results_by_envt)
+        export_metrics(args)
+        log_run_stats(our_client, our_test_client, our_cache)
+        logger.info('Backfill complete.')
+        return log_failed_envts(errors_by_envt)
+
+    if args.watch:
+        watch_envts(args, our_client, our_test_client, results_by_envt)
+        export_metrics(args)
+        log_run_stats(our_client, our_test_client, our_cache)
+        logger.info('Watch complete.')
+        return log_failed_envts(errors_by_envt)
+
+    # one csv per envt, each written to as soon as the rows for it are ready
+    sinks_by_envt = {}
+    parquet_sinks_by_envt = {}
+    # build definition id: list of (envt, position in that envt's csv, index of its row in that envt's results table)
+    # the pipeline's results go to
+    row_destinations_by_id = {}
+    # pipelines can be in more than one envt (e.g. sf_all and staging) - we only need to fetch each one once
+    target_builds_by_id = {}
+    for envt, our_results in results_by_envt.items():
+        if not our_results.results_table:
+            logger.info('---- No testrunner pipelines found for envt: %s - no CSV file written' % envt)
+            continue
+
+        filename = 'auto_testrunners_report_%s.csv' % envt
+        if args.parquet_dir:
+            parquet_sinks_by_envt[envt] = ResultsParquetSink(args.parquet_dir, envt)
+        sinks_by_envt[envt] = ResultsCsvSink(filename, resume=args.resume)
+
+        position = 0
+        for index, build in enumerate(our_results.target_build_def_refs.values()):
+            if sinks_by_envt[envt].is_written(build.id):
+                continue
+            row_destinations_by_id.setdefault(build.id, []).append((envt, position, index))
+            target_builds_by_id.setdefault(build.id, build)
+            position += 1
+
+    logger.info('*-------------------------------------------------------------------------------------------------*')
+    logger.info('Using above list of build definition ids to get last completed build and test run stats for each...')
+    logger.info('*-------------------------------------------------------------------------------------------------*')
+
+    # work through the pipelines a batch at a time, writing out each batch's rows as soon as it completes
+    target_builds = list(target_builds_by_id.values())
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        for batch_start in range(0, len(target_builds), args.batch_size):
+            batch_builds = target_builds[batch_start:batch_start + args.batch_size]
+            logger.info('---- Pipelines %s to %s of %s'
+                        % (batch_start + 1, batch_start + len(batch_builds), len(target_builds)))
+            pipeline_results_by_id, pipeline_errors_by_id = get_pipeline_batch_results_isolating_failures(
+                executor, our_client, our_test_client, batch_builds)
+
+            # a failed pipeline's row only has what the listing gave us, and its envts fail at the end
+            for build_id, e in pipeline_errors_by_id.items():
+                logger.error('---- Failed to get the results of pipeline id: %s - carrying on without them: %s'
+                             % (build_id, e))
+                pipeline_results_by_id[build_id] = {}
+                for envt, _, _ in row_destinations_by_id[build_id]:
+                    errors_by_envt.setdefault(envt, e)
+
+            for build_id, pipeline_results in pipeline_results_by_id.items():
+                for envt, position, index in row_destinations_by_id[build_id]:
+                    results_table = results_by_envt[envt].results_table
+                    results_table.update(index, pipeline_results)
+                    results_row = results_table[index]
+                    sinks_by_envt[envt].add(position, results_row)
+                    if envt in parquet_sinks_by_envt:
+                        parquet_sinks_by_envt[envt].add(results_row)
+
+            flush_parquet_sinks_if_due(parquet_sinks_by_envt.values())
+
+    for envt, parquet_sink in parquet_sinks_by_envt.items():
+        parquet_sink.close()
+        logger.info('---- Parquet rows added under %s for envt %s: %s'
+                    % (args.parquet_dir, envt, parquet_sink.rows_written))
+
+    for envt, sink in sinks_by_envt.items():
+        sink.close()
+        logger.info('---- CSV file written out: %s (%s pipelines added this run)' % (sink.filename, sink.rows_written))
+
+        # log one build report summary as an example
+        example_row = results_by_envt[envt].results_table[0]
+        if 'build_report_build_id' in example_row:
+            logger.info('build report summary for build defintition id: %s, last completed build id '
+                        '(build_report_build_id): %s is: total %s, passed %s, failed %s, skipped %s, other %s,'
+                        ' duration %s' %
+                        tuple(example_row.get(key) for key in
+                              ('id', 'build_report_build_id', 'build_report_total', 'build_report_passed',
+                               'build_report_failed', 'build_report_skipped', 'build_report_other',
+                               'build_report_duration')))
+
+    # Close script and log outcomes
+    export_metrics(args)
+    log_run_stats(our_client, our_test_client, our_cache)
     logger.info('Script complete.')
 
-    return 0
+    return log_failed_envts(errors_by_envt)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,325 @@
+import csv
+from datetime import datetime
+import logging
+import os
+import time
+
+
+logger = logging.getLogger()
+
+# outcomes ADO reports test run statistics for (TestOutcome) - each gets a test_run_stat<outcome> column
+TEST_RUN_OUTCOMES = ('Unspecified', 'None', 'Passed', 'Failed', 'Inconclusive', 'Timeout', 'Aborted', 'Blocked',
+                     'NotExecuted', 'Warning', 'Error', 'NotApplicable', 'Paused', 'InProgress', 'NotImpacted')
+TEST_RUN_STAT_COLUMNS = tuple('test_run_stat' + outcome for outcome in TEST_RUN_OUTCOMES)
+
+RESULT_COLUMNS = ('id', 'name', 'queue_status', 'last_comp_build_id', 'last_comp_build_uri',
+                  'last_comp_build_finish_time', 'build_report_build_id', 'build_report_total', 'build_report_passed',
+                  'build_report_failed', 'build_report_skipped', 'build_report_other', 'build_report_duration',
+                  'build_report_failing_tests', 'test_run_id') + TEST_RUN_STAT_COLUMNS
+
+# parquet rows are held back until this many have built up, or the oldest has waited this long, so each write adds
+# a file to each partition written to, rather than a few small files per batch (or poll of a watch)
+PARQUET_FLUSH_ROWS = 5000
+PARQUET_FLUSH_SECONDS = 15 * 60
+
+
+class ResultsTable(object):
+    """Result rows held a column at a time - a list per column, rather than a dict per row - so the rows of a
+    project with thousands of pipelines take a fraction of the memory, and a column can be read on its own.
+
+    Rows go in and come out as dicts of column: value. A row with columns the table doesn't have yet adds them
+    (empty in the rows before), as ResultsCsvSink adds them to the file.
+    """
+
+    def __init__(self, columns=RESULT_COLUMNS):
+        self.columns = tuple(columns)
+        self._column_positions = dict((column, position) for position, column in enumerate(self.columns))
+        self._column_values = [[] for _ in self.columns]
+        self._rows = 0
+
+    def __len__(self):
+        return self._rows
+
+    def append(self, row):
+        """
+        :param row: dict of column: value
+        :return: the index of the new row
+        """
+        self._add_new_columns(row)
+        for column, values in zip(self.columns, self._column_values):
+            values.append(row.get(column))
+        self._rows += 1
+        return self._rows - 1
+
+    def update(self, index, row):
+        """
+        :param row: dict of column: value to set in the row at index
+        """
+        self._add_new_columns(row)
+        for column, value in row.items():
+            self._column_values[self._column_positions[column]][index] = value
+
+    def _add_new_columns(self, row):
+        new_columns = [column for column in row if column not in self._column_positions]
+        for column in new_columns:
+            self._column_positions[column] = len(self._column_values)
+            self._column_values.append([None] * self._rows)
+        if new_columns:
+            self.columns += tuple(new_columns)
+
+    def column(self, column):
+        """
+        :return: list of the column's value in every row - None where a row has no value
+        """
+        return self._column_values[self._column_positions[column]]
+
+    def __getitem__(self, index):
+        """
+        :return: the row at index as a dict of column: value, leaving out the columns with no value
+        """
+        if not -self._rows <= index < self._rows:
+            raise IndexError('row index %s out of range' % index)
+        return dict((column, values[index]) for column, values in zip(self.columns, self._column_values)
+                    if values[index] is not None)
+
+    def __iter__(self):
+        for index in range(self._rows):
+            yield self[index]
+
+
+class ResultsCsvSink(object):
+    """Writes result rows to a csv file as they arrive, rather than all at the end, so a crash part way through
+    a run keeps what has been gathered so far.
+
+    The columns are set up front (RESULT_COLUMNS by default), so a row can be written before we know what
+    every other row holds. A row with columns the file doesn't have yet (e.g. those general_utils'
+    add_build_run_details_to_dict adds) adds them after the others, rewriting what is written so far under the
+    wider header. Rows are written in the order of the position they are added with, holding back any that arrive
+    early, so the file comes out the same whatever order the rows finish in.
+
+    With resume=True an existing file starting with the same columns is appended to, and resumed_ids holds the
+    ids (definition ids, by default) already in it so they can be skipped. written_ids also holds those written since.
+    """
+
+    def __init__(self, filename, fieldnames=RESULT_COLUMNS, resume=False, id_column='id'):
+        self.filename = filename
+        self.fieldnames = list(fieldnames)
+        self.id_column = id_column
+        self.written_ids = set()
+        self.rows_written = 0
+        self._next_position = 0
+        self._early_rows = {}
+
+        if resume and os.path.exists(filename) and os.path.getsize(filename):
+            with open(filename, newline='') as existing_file:
+                reader = csv.DictReader(existing_file)
+                if reader.fieldnames[:len(self.fieldnames)] != self.fieldnames:
+                    raise BaseException('Cannot resume %s - its columns are not the ones we write now.' % filename)
+                # including any columns added after ours
+                self.fieldnames = list(reader.fieldnames)
+                for row in reader:
+                    self.written_ids.add(row[id_column])
+            self.resumed_ids = frozenset(self.written_ids)
+            logger.info('Resuming %s, which already has %s %ss' % (filename, len(self.written_ids), id_column))
+            self._file = open(filename, 'a', newline='')
+            self._writer = csv.DictWriter(self._file, self.fieldnames)
+        else:
+            self.resumed_ids = frozenset()
+            self._file = open(filename, 'w', newline='')
+            self._writer = csv.DictWriter(self._file, self.fieldnames)
+            self._writer.writeheader()
+            self._file.flush()
+
+    def is_written(self, definition_id):
+        return str(definition_id) in self.written_ids
+
+    def append(self, row):
+        """
+        Write a row straight away, for rows with no particular order - don't mix with add()
+        """
+        self._write_row(row)
+
+    def add(self, position, row):
+        """
+        :param position: 0 based position of this row among the rows to write, each used once
+        :param row: dict of column: value
+        """
+        self._early_rows[position] = row
+        while self._next_position in self._early_rows:
+            self._write_row(self._early_rows.pop(self._next_position))
+            self._next_position += 1
+
+    def _write_row(self, row):
+        new_columns = [column for column in row if column not in self.fieldnames]
+        if new_columns:
+            self._add_columns(new_columns)
+
+        self._writer.writerow(row)
+        # flushed every row, so what we have survives a crash
+        self._file.flush()
+        self.written_ids.add(str(row[self.id_column]))
+        self.rows_written += 1
+
+    def _add_columns(self, new_columns):
+        """
+        Add columns after the file's others - the rows written so far are rewritten (with the new columns empty)
+        to a new file under the wider header, which is then swapped in, so a crash can't lose them
+        """
+        logger.info('Adding columns %s to %s' % (', '.join(new_columns), self.filename))
+        self._file.close()
+
+        temp_filename = self.filename + '.tmp'
+        with open(self.filename, newline='') as existing_file, open(temp_filename, 'w', newline='') as new_file:
+            reader = csv.reader(existing_file)
+            writer = csv.writer(new_file)
+            next(reader)
+            writer.writerow(self.fieldnames + new_columns)
+            for existing_row in reader:
+                writer.writerow(existing_row + [''] * len(new_columns))
+        os.replace(temp_filename, self.filename)
+
+        self.fieldnames.extend(new_columns)
+        self._file = open(self.filename, 'a', newline='')
+        self._writer = csv.DictWriter(self._file, self.fieldnames)
+
+    def close(self):
+        if self._early_rows:
+            logger.warning('%s rows were never written to %s as rows before them were missing'
+                           % (len(self._early_rows), self.filename))
+        self._file.close()
+
+
+class ResultsParquetSink(object):
+    """Appends per build test run statistics to a columnar (Parquet) dataset, partitioned by envt and build date:
+        <root_path>/envt=<envt>/date=<YYYY-MM-DD>/<file>.parquet
+
+    So trends over weeks can be queried reading only the columns (and partitions) needed, rather than re-parsing
+    every csv artifact. A build already in the envt's partitions is not added again, so re-running over the same
+    latest builds does not duplicate rows.
+
+    Rows are held until flushed - call flush() when flush_due, and close() at the end - so the dataset gets a few
+    large files rather than many small ones.
+
+    Needs pyarrow (pip install pyarrow), which is only imported when one of these is made.
+    """
+
+    def __init__(self, root_path, envt, flush_rows=PARQUET_FLUSH_ROWS, flush_seconds=PARQUET_FLUSH_SECONDS):
+        """
+        :param flush_rows: flush_due once this many rows are held
+        :param flush_seconds: flush_due once the oldest row held has waited this long
+        """
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise BaseException('pyarrow is needed to export results to parquet - pip install pyarrow')
+        self._pyarrow = pyarrow
+        self._parquet = pyarrow.parquet
+
+        self.root_path = root_path
+        self.envt = envt
+        self.rows_written = 0
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self._rows = []
+        # time.monotonic() the oldest row held was added
+        self._oldest_row_time = None
+
+        self.schema = pyarrow.schema([('definition_id', pyarrow.int64()),
+                                      ('build_id', pyarrow.int64()),
+                                      ('finish_time', pyarrow.string()),
+                                      ('test_run_id', pyarrow.int64())] +
+                                     [(column, pyarrow.int64()) for column in TEST_RUN_STAT_COLUMNS] +
+                                     [('envt', pyarrow.string()),
+                                      ('date', pyarrow.string())])
+        self.exported_build_ids = self._read_exported_build_ids()
+
+    def _read_exported_build_ids(self):
+        envt_path = os.path.join(self.root_path, 'envt=%s' % self.envt)
+        if not os.path.isdir(envt_path):
+            return set()
+
+        # only the build_id column needs reading
+        build_ids = self._parquet.read_table(envt_path, columns=['build_id']).column('build_id').to_pylist()
+        logger.info('%s builds already exported for envt %s under %s' % (len(build_ids), self.envt, self.root_path))
+        return set(build_ids)
+
+    def add(self, row):
+        """
+        :param row: results row dict for one pipeline - as written to the csv
+        """
+        self.add_build_row(row['id'], row.get('last_comp_build_id'), row.get('last_comp_build_finish_time'), row)
+
+    def add_build_row(self, definition_id, build_id, finish_time, stats_row):
+        """
+        :param definition_id: build definition id
+        :param build_id: id of the build (run of the definition)
+        :param finish_time: iso format string of when the build finished
+        :param stats_row: dict holding the test_run_id and test_run_stat<outcome> counts for the build
+        """
+        build_id = _int_or_none(build_id)
+        # only builds exported by earlier runs are skipped, so a build can have a row for each of its test runs
+        if build_id is None or build_id in self.exported_build_ids:
+            return
+
+        parquet_row = {'definition_id': _int_or_none(definition_id),
+                       'build_id': build_id,
+                       'finish_time': finish_time,
+                       'test_run_id': _int_or_none(stats_row.get('test_run_id')),
+                       'envt': self.envt,
+                       'date': finish_time[:10] if finish_time else datetime.utcnow().strftime('%Y-%m-%d')}
+        for column in TEST_RUN_STAT_COLUMNS:
+            parquet_row[column] = _int_or_none(stats_row.get(column))
+
+        if not self._rows:
+            self._oldest_row_time = time.monotonic()
+        self._rows.append(parquet_row)
+
+    @property
+    def rows_pending(self):
+        return len(self._rows)
+
+    @property
+    def flush_due(self):
+        return len(self._rows) >= self.flush_rows or \
+            (bool(self._rows) and time.monotonic() - self._oldest_row_time >= self.flush_seconds)
+
+    def flush(self):
+        """
+        Write the rows added since the last flush as new files in the dataset
+        """
+        if not self._rows:
+            return
+
+        columns = dict((name, [row[name] for row in self._rows]) for name in self.schema.names)
+        table = self._pyarrow.Table.from_pydict(columns, schema=self.schema)
+        # each write adds new uniquely named files to the partitions, leaving what is already there alone
+        self._parquet.write_to_dataset(table, self.root_path, partition_cols=['envt', 'date'])
+        self.rows_written += len(self._rows)
+        self._rows = []
+
+    def close(self):
+        self.flush()
+
+
+def flush_parquet_sinks_if_due(parquet_sinks):
+    """
+    Flush all the sinks once any of them is flush_due - all together, so there are times none of them hold rows,
+    e.g. for a watch or backfill to record what is written out at
+
+    :param parquet_sinks: iterable of ResultsParquetSink
+    :return: True if they were flushed
+    """
+    parquet_sinks = list(parquet_sinks)
+    if not any(parquet_sink.flush_due for parquet_sink in parquet_sinks):
+        return False
+
+    for parquet_sink in parquet_sinks:
+        parquet_sink.flush()
+    return True
+
+
+def _int_or_none(value):
+    if value is None or value == '':
+        return None
+    return int(value)
@@ -0,0 +1,98 @@
+import argparse
+import logging
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from msrest.authentication import BasicAuthentication
+
+import ado_scheduler
+from ado_utils import ADOBuildObj, BuildDefinitionFilter, QUEUE_STATUSES, QUEUE_STATUS_OUTCOMES, connection_registry
+from results_sink import ResultsCsvSink
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+handler = logging.StreamHandler(sys.stdout)
+handler.setLevel(logging.INFO)
+formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+handler.setFormatter(formatter)
+
+if logger.hasHandlers():
+    logger.handlers.clear()
+
+logger.addHandler(handler)
+
+DEFAULT_WORKERS = 8
+QUEUE_STATUS_REPORT_COLUMNS = ('id', 'name', 'queue_status_before', 'queue_status_after', 'outcome', 'error')
+
+
+def main():
+    """
+    Set the queue status (enabled, paused or disabled) of many build definitions at once - either the ones given by
+    id, or every one under a folder whose name matches our filter - e.g. to pause an envt's testrunners before
+    maintenance and enable them again after.
+
+    :return: 1 if any definition failed to update, otherwise 0
+    """
+    parser = argparse.ArgumentParser(description='Set the queue status of many ADO build definitions at once.')
+    parser.add_argument('--pat', '-p', required=True,
+                        help="PAT token generated within ADO for user running script")
+    parser.add_argument('--status', '-s', choices=QUEUE_STATUSES, required=True,
+                        help="Queue status to set the definitions to")
+    parser.add_argument('--definition-id', '-d', type=int, nargs='+', default=None,
+                        help="Ids of the definitions to set - otherwise every definition matching the filter below")
+    parser.add_argument('--under-path', default='\\Automation\\MyDelivery',
+                        help="Folder to set the definitions under (default \\Automation\\MyDelivery)")
+    parser.add_argument('--must-include', nargs='*', default=['SF_', 'CloudTests'],
+                        help="Strings a definition's name must all contain (default SF_ CloudTests)")
+    parser.add_argument('--envt', '-e', default=None,
+                        help="Only definitions for this envt, i.e. whose name contains _<envt>_")
+    parser.add_argument('--name-regex', default=None,
+                        help="Only definitions whose name matches this regular expression")
+    parser.add_argument('--workers', '-w', type=int, default=DEFAULT_WORKERS,
+                        help="Number of definitions to update concurrently (default %s)" % DEFAULT_WORKERS)
+    parser.add_argument('--dry-run', action='store_true',
+                        help="Only report which definitions would be updated")
+    parser.add_argument('--report-file', default=None,
+                        help="Also write the outcome for each definition to this csv file")
+
+    args = parser.parse_args()
+
+    if args.workers < 1:
+        parser.error('--workers must be 1 or more')
+
+    connection_registry.scheduler = ado_scheduler.ADORequestScheduler()
+    our_client = ADOBuildObj(creds=BasicAuthentication('PAT', args.pat), definitions_under_path=args.under_path)
+
+    if args.definition_id:
+        definitions = list(dict.fromkeys(args.definition_id))
+    else:
+        definitions = BuildDefinitionFilter(args.under_path, must_include=args.must_include, envt=args.envt,
+                                            name_regex=args.name_regex)
+
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        outcomes = our_client.set_build_definitions_queue_status(definitions, args.status, executor,
+                                                                 dry_run=args.dry_run)
+
+    for outcome in outcomes:
+        logger.info('BuildDefinition id: %(id)s (%(name)s) %(queue_status_before)s -> %(queue_status_after)s:'
+                    ' %(outcome)s' % outcome)
+
+    if args.report_file:
+        report_sink = ResultsCsvSink(args.report_file, fieldnames=QUEUE_STATUS_REPORT_COLUMNS)
+        for outcome in outcomes:
+            report_sink.append(outcome)
+        report_sink.close()
+        logger.info('Report written out: %s' % args.report_file)
+
+    outcome_counts = dict((outcome_name, 0) for outcome_name in QUEUE_STATUS_OUTCOMES)
+    for outcome in outcomes:
+        outcome_counts[outcome['outcome']] += 1
+    logger.info('------------------------------------------------------')
+    logger.info('Definitions updated: %(updated)s, already %(status)s: %(unchanged)s,'
+                ' would update: %(would_update)s, failed: %(failed)s' % dict(outcome_counts, status=args.status))
+
+    return 1 if outcome_counts['failed'] else 0
+
+
+if __name__ == "__main__":
+    exit(main())
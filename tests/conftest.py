@@ -0,0 +1,47 @@
+import os
+import sys
+import types
+
+import pytest
+
+# our modules import each other by their bare names, as the scripts are run from the repo root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    import general_utils  # noqa: F401
+except ImportError:
+    # general_utils isn't in this repo - stand in for what get_pipeline_builds_test_results uses of it
+    general_utils = types.ModuleType('general_utils')
+    general_utils.add_build_run_details_to_dict = lambda test_run: {'test_run_id': test_run.id,
+                                                                    'test_run_name': test_run.name}
+    sys.modules['general_utils'] = general_utils
+
+import ado_replay  # noqa: E402
+import ado_scheduler  # noqa: E402
+from ado_utils import connection_registry  # noqa: E402
+
+SYNTHETIC_PIPELINES = 30
+# the scheduler's own pacing would otherwise be most of what the tests wait on
+TEST_REQUESTS_PER_SECOND = 100000
+
+
+@pytest.fixture
+def synthetic_ado():
+    """
+    Answer every ADO client call from a SyntheticADOBackend of SYNTHETIC_PIPELINES pipelines, rather than ADO
+
+    :return: ado_replay.ReplayTransport - set its throttle_rate before making any calls to have some throttled
+    """
+    scheduler = connection_registry.scheduler
+    connection_registry.clear()
+    connection_registry.scheduler = ado_scheduler.ADORequestScheduler(requests_per_second=TEST_REQUESTS_PER_SECOND,
+                                                                      backoff_base_seconds=0.01)
+    transport = ado_replay.ReplayTransport(ado_replay.SyntheticADOBackend(SYNTHETIC_PIPELINES),
+                                           retry_after_seconds=0.01)
+    connection_registry.transport = transport
+    try:
+        yield transport
+    finally:
+        connection_registry.transport = None
+        connection_registry.scheduler = scheduler
+        connection_registry.clear()
@@ -0,0 +1,39 @@
+import asyncio
+from datetime import timedelta
+
+import pytest
+from msrest.authentication import BasicAuthentication
+
+import ado_async
+import ado_replay
+from ado_stub_server import ADOStubServer
+from conftest import SYNTHETIC_PIPELINES
+
+pytest.importorskip('aiohttp')
+
+
+@pytest.fixture
+def stub_server():
+    with ADOStubServer(ado_replay.SyntheticADOBackend(SYNTHETIC_PIPELINES)) as stub_server:
+        yield stub_server
+
+
+def test_test_runs_are_queried_10_build_ids_at_a_time(stub_server):
+    # made outside of any event loop - the aiohttp session is only opened within asyncio.run
+    session = ado_async.AsyncADOSession(stub_server.url, BasicAuthentication('PAT', 'synthetic'),
+                                        backoff_base_seconds=0.001)
+    build_ids = [definition_id * 100 for definition_id in range(1, SYNTHETIC_PIPELINES + 1)]
+
+    async def query_test_runs():
+        async with session:
+            test_obj = ado_async.AsyncADOTestClientObj(session)
+            return await test_obj.query_test_runs(ado_replay.SYNTHETIC_LATEST_FINISH_TIME - timedelta(days=7),
+                                                  ado_replay.SYNTHETIC_LATEST_FINISH_TIME, build_ids)
+
+    test_runs = asyncio.run(query_test_runs())
+
+    assert [test_run.id for test_run in test_runs] == [build_id * 10 for build_id in build_ids]
+    # the project lookup, then a query per 10 build ids
+    assert session.stats == {'requests': 1 + (SYNTHETIC_PIPELINES + 9) // 10, 'retries': 0, 'throttled': 0,
+                             'failed': 0}
+    assert stub_server.stats['errors'] == 0
@@ -0,0 +1,85 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from msrest.authentication import BasicAuthentication
+
+import ado_replay
+import ado_utils
+from ado_utils import ADOBuildObj, ADOTestClientObj, ADOTestResultsObj, connection_registry
+from attachment_store import ATTACHMENT_COLUMNS, ContentAddressedStore
+from conftest import SYNTHETIC_PIPELINES
+from results_sink import ResultsCsvSink
+
+
+def return_build_obj():
+    return ADOBuildObj(creds=BasicAuthentication('PAT', 'synthetic'), v6_api=True)
+
+
+def test_definitions_are_listed_past_the_first_page(synthetic_ado):
+    our_client = return_build_obj()
+
+    definitions = list(our_client.iter_build_definition_references(use_v6_api=True, page_size=7))
+
+    assert [definition.id for definition in definitions] == list(range(1, SYNTHETIC_PIPELINES + 1))
+    assert synthetic_ado.stats['calls'] == 1 + (SYNTHETIC_PIPELINES + 6) // 7  # the project lookup, then each page
+
+
+def test_test_runs_are_queried_past_the_first_page(synthetic_ado, monkeypatch):
+    monkeypatch.setattr(ado_utils, 'TEST_RUN_QUERY_PAGE_SIZE', 3)
+    our_client = return_build_obj()
+    our_test_client = ADOTestClientObj(creds=BasicAuthentication('PAT', 'synthetic'), v6_api=True)
+    builds = [our_client.get_single_build_definition_by_id(definition_id).latest_completed_build
+              for definition_id in range(1, SYNTHETIC_PIPELINES + 1)]
+
+    test_runs_by_build_id = our_test_client.get_test_runs_for_builds(builds, use_v6_api=True)
+
+    assert dict((build_id, [test_run.id for test_run in test_runs])
+                for build_id, test_runs in test_runs_by_build_id.items()) == \
+        dict((build.id, [build.id * 10]) for build in builds)
+    endpoint_calls = dict((endpoint['endpoint'], endpoint['calls'])
+                          for endpoint in connection_registry.metrics.summary()['endpoints'])
+    # every build's run came from the paged queries, none from the get_test_runs fallback
+    assert 'TestClient.get_test_runs' not in endpoint_calls
+    assert endpoint_calls['TestClient.query_test_runs'] > SYNTHETIC_PIPELINES / 3
+
+
+def test_completed_builds_are_listed_past_the_first_page(synthetic_ado):
+    our_client = return_build_obj()
+
+    builds = list(our_client.iter_completed_builds(3, page_size=2))
+
+    assert [build.id for build in builds] == ado_replay.SyntheticADOBackend.build_ids_for_definition(3)
+
+
+def test_queue_status_of_definitions_by_id_does_not_list_the_project(synthetic_ado):
+    our_client = return_build_obj()
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        outcomes = our_client.set_build_definitions_queue_status([3, 5], 'enabled', executor)
+        outcomes += our_client.set_build_definitions_queue_status([4], 'paused', executor, dry_run=True)
+
+    assert [(outcome['id'], outcome['queue_status_before'], outcome['outcome']) for outcome in outcomes] == \
+        [(3, 'enabled', 'unchanged'), (5, 'enabled', 'unchanged'), (4, 'enabled', 'would_update')]
+    endpoint_calls = dict((endpoint['endpoint'], endpoint['calls'])
+                          for endpoint in connection_registry.metrics.summary()['endpoints'])
+    assert 'BuildClient.get_definitions' not in endpoint_calls
+    assert endpoint_calls['BuildClient.get_definition'] == 3
+
+
+def test_test_result_attachments_are_downloaded_with_the_defaults(synthetic_ado, tmp_path):
+    our_res_client = ADOTestResultsObj(creds=BasicAuthentication('PAT', 'synthetic'))
+    # runs of builds 301 and 303, with 1 and 3 failed test results
+    run_ids = [3010, 3030]
+
+    assert [attachment.file_name for attachment in our_res_client.get_test_result_attachments(3030, None)] == \
+        ['run.log']
+
+    store = ContentAddressedStore(str(tmp_path / 'attachments'))
+    manifest_sink = ResultsCsvSink(str(tmp_path / 'manifest.csv'), fieldnames=ATTACHMENT_COLUMNS,
+                                   id_column='attachment_key')
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        downloaded = our_res_client.download_test_run_attachments(run_ids, store, manifest_sink, executor)
+    manifest_sink.close()
+
+    # each run's own attachment, and one per failed test result
+    assert downloaded == manifest_sink.rows_written == 2 + 4
+    assert (store.stats['stored'], store.stats['bytes_stored']) == (6, 6 * ado_replay.SYNTHETIC_ATTACHMENT_SIZE)
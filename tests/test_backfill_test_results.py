@@ -0,0 +1,45 @@
+import csv
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from msrest.authentication import BasicAuthentication
+
+from ado_utils import ADOBuildObj, ADOTestClientObj, DefinitionRef
+from backfill_test_results import BACKFILL_COLUMNS, BackfillCheckpoint, run_backfill
+from results_sink import ResultsCsvSink
+
+
+class InterruptingCsvSink(ResultsCsvSink):
+    """Stops the backfill (as a Ctrl-C would) on the first row of the interrupt_at'th definition written
+    """
+
+    def __init__(self, filename, interrupt_at):
+        super(InterruptingCsvSink, self).__init__(filename, fieldnames=BACKFILL_COLUMNS, id_column='build_id')
+        self.interrupt_at = interrupt_at
+        self.definition_ids = []
+
+    def append(self, row):
+        if row['id'] not in self.definition_ids:
+            self.definition_ids.append(row['id'])
+            if len(self.definition_ids) == self.interrupt_at:
+                raise KeyboardInterrupt()
+        super(InterruptingCsvSink, self).append(row)
+
+
+def test_csv_only_backfill_checkpoints_each_definition_as_it_is_written(synthetic_ado, tmp_path):
+    creds = BasicAuthentication('PAT', 'synthetic')
+    build_def_refs = [DefinitionRef(definition_id, 'SF_CloudTests_staging_%s' % definition_id,
+                                    '\\Automation\\MyDelivery', 'enabled') for definition_id in range(1, 7)]
+    csv_sink = InterruptingCsvSink(str(tmp_path / 'backfill.csv'), interrupt_at=4)
+    checkpoint = BackfillCheckpoint(str(tmp_path / 'checkpoint.json'))
+
+    with pytest.raises(KeyboardInterrupt):
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            run_backfill(executor, ADOBuildObj(creds=creds, v6_api=True), ADOTestClientObj(creds=creds, v6_api=True),
+                         {'staging': build_def_refs}, {'staging': csv_sink}, {}, checkpoint, max_builds=2)
+    csv_sink.close()
+
+    with open(str(tmp_path / 'backfill.csv'), newline='') as csv_file:
+        written_definition_ids = set(int(row['id']) for row in csv.DictReader(csv_file))
+    assert len(written_definition_ids) == 3
+    assert BackfillCheckpoint(str(tmp_path / 'checkpoint.json')).completed_definition_ids == written_definition_ids
@@ -0,0 +1,144 @@
+import csv
+import json
+import os
+from datetime import timedelta
+
+import pytest
+
+import ado_replay
+import get_pipeline_builds_test_results
+from ado_utils import connection_registry
+from conftest import SYNTHETIC_PIPELINES, TEST_REQUESTS_PER_SECOND
+
+
+def run_main(envt, *extra_args):
+    """
+    :return: list of the rows main wrote to envt's csv, as dicts
+    """
+    exit_code = get_pipeline_builds_test_results.main(
+        ['--pat', 'synthetic', '--envt', envt, '--max-requests-per-second', str(TEST_REQUESTS_PER_SECOND)] +
+        list(extra_args))
+    assert exit_code == 0
+
+    with open('auto_testrunners_report_%s.csv' % envt, newline='') as csv_file:
+        return list(csv.DictReader(csv_file))
+
+
+def test_main_reports_every_pipeline_of_the_envt(synthetic_ado, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    rows = run_main('staging')
+
+    # the synthetic pipelines alternate between staging and uatcopy1
+    assert [int(row['id']) for row in rows] == list(range(2, SYNTHETIC_PIPELINES + 1, 2))
+    for row in rows:
+        definition_id = int(row['id'])
+        latest_build_id = ado_replay.SyntheticADOBackend.build_ids_for_definition(definition_id)[0]
+        passed, failed = ado_replay.SyntheticADOBackend.test_counts_for_build(latest_build_id)
+        assert row['name'] == 'SF_CloudTests_staging_%05d' % definition_id
+        assert int(row['last_comp_build_id']) == latest_build_id
+        assert int(row['build_report_total']) == passed + failed
+        assert int(row['test_run_id']) == latest_build_id * 10
+        assert (int(row['test_run_statPassed']), int(row['test_run_statFailed'])) == (passed, failed)
+
+
+def test_main_retries_throttled_calls(synthetic_ado, tmp_path, monkeypatch):
+    (tmp_path / 'unthrottled').mkdir()
+    monkeypatch.chdir(tmp_path / 'unthrottled')
+    expected_rows = run_main('uatcopy1')
+
+    connection_registry.clear()
+    synthetic_ado.throttle_rate = 0.1
+    (tmp_path / 'throttled').mkdir()
+    monkeypatch.chdir(tmp_path / 'throttled')
+    rows = run_main('uatcopy1')
+
+    assert synthetic_ado.stats['throttled'] > 0
+    assert connection_registry.scheduler.stats['throttled'] == synthetic_ado.stats['throttled']
+    assert connection_registry.scheduler.stats['failed'] == 0
+    assert rows == expected_rows
+
+
+def test_main_writes_the_other_envts_when_one_fails(synthetic_ado, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    get_single_pipeline_build_results = get_pipeline_builds_test_results.get_single_pipeline_build_results
+
+    def fail_pipeline_4(our_client, build):
+        if build.id == 4:
+            raise BaseException('Pipeline 4 failed')
+        return get_single_pipeline_build_results(our_client, build)
+
+    monkeypatch.setattr(get_pipeline_builds_test_results, 'get_single_pipeline_build_results', fail_pipeline_4)
+
+    exit_code = get_pipeline_builds_test_results.main(
+        ['--pat', 'synthetic', '--envt', 'staging', 'uatcopy1', '--max-requests-per-second',
+         str(TEST_REQUESTS_PER_SECOND)])
+
+    assert exit_code == 1
+    with open('auto_testrunners_report_uatcopy1.csv', newline='') as csv_file:
+        assert [int(row['id']) for row in csv.DictReader(csv_file)] == list(range(1, SYNTHETIC_PIPELINES + 1, 2))
+    # staging has every pipeline too, but just the listing's columns for the failed one
+    with open('auto_testrunners_report_staging.csv', newline='') as csv_file:
+        rows = list(csv.DictReader(csv_file))
+    assert [int(row['id']) for row in rows] == list(range(2, SYNTHETIC_PIPELINES + 1, 2))
+    assert rows[1]['last_comp_build_id'] == '' and rows[0]['last_comp_build_id'] != ''
+
+
+def test_main_with_definition_ids_does_not_list_the_org_or_project(synthetic_ado, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    exit_code = get_pipeline_builds_test_results.main(
+        ['--pat', 'synthetic', '--definition-id', '3', '4', '--max-requests-per-second',
+         str(TEST_REQUESTS_PER_SECOND)])
+
+    assert exit_code == 0
+    with open(get_pipeline_builds_test_results.DEFINITION_IDS_OUTPUT_FILENAME, newline='') as csv_file:
+        assert [int(row['id']) for row in csv.DictReader(csv_file)] == [3, 4]
+    endpoint_calls = dict((endpoint['endpoint'], endpoint['calls'])
+                          for endpoint in connection_registry.metrics.summary()['endpoints'])
+    assert 'CoreClient.get_projects' not in endpoint_calls
+    assert 'BuildClient.get_definitions' not in endpoint_calls
+    assert endpoint_calls['CoreClient.get_project'] == 1
+
+
+def test_main_writes_a_parquet_file_per_partition_not_per_batch(synthetic_ado, tmp_path, monkeypatch):
+    pytest.importorskip('pyarrow')
+    monkeypatch.chdir(tmp_path)
+
+    run_main('staging', '--parquet-dir', 'parquet', '--batch-size', '3')
+
+    envt_path = os.path.join('parquet', 'envt=staging')
+    partitions = os.listdir(envt_path)
+    assert len(partitions) > 1
+    assert [len(os.listdir(os.path.join(envt_path, partition))) for partition in partitions] == [1] * len(partitions)
+
+
+def test_watch_writes_its_parquet_rows_once_and_then_marks_them_seen(synthetic_ado, tmp_path, monkeypatch):
+    pytest.importorskip('pyarrow')
+    monkeypatch.chdir(tmp_path)
+    # a new build, finished an hour after the rest, for pipelines 3 and 5 (uatcopy1) and 4 and 6 (staging)
+    backend = synthetic_ado.backend
+    build_ids_for_definition = backend.build_ids_for_definition
+    finish_time_for_build = backend.finish_time_for_build
+    monkeypatch.setattr(backend, 'build_ids_for_definition', lambda definition_id: (
+        [definition_id * 100 + 50] if definition_id in (3, 4, 5, 6) else []) + build_ids_for_definition(definition_id))
+    monkeypatch.setattr(backend, 'finish_time_for_build', lambda build_id: (
+        ado_replay.SYNTHETIC_LATEST_FINISH_TIME + timedelta(hours=1) if build_id % 100 == 50
+        else finish_time_for_build(build_id)))
+    with open('watch_state.json', 'w') as state_file:
+        json.dump({'high_water_mark': (ado_replay.SYNTHETIC_LATEST_FINISH_TIME + timedelta(minutes=30)).isoformat(),
+                   'recent_builds': {}}, state_file)
+
+    exit_code = get_pipeline_builds_test_results.main(
+        ['--pat', 'synthetic', '--envt', 'staging', 'uatcopy1', '--max-requests-per-second',
+         str(TEST_REQUESTS_PER_SECOND), '--watch', '--watch-polls', '3', '--watch-interval', '0',
+         '--watch-state-file', 'watch_state.json', '--parquet-dir', 'parquet', '--batch-size', '1'])
+
+    assert exit_code == 0
+    for envt, build_ids in (('staging', [450, 650]), ('uatcopy1', [350, 550])):
+        with open('auto_testrunners_watch_%s.csv' % envt, newline='') as csv_file:
+            assert sorted(int(row['last_comp_build_id']) for row in csv.DictReader(csv_file)) == build_ids
+        # not a file per batch
+        assert len(os.listdir(os.path.join('parquet', 'envt=%s' % envt, 'date=2026-01-31'))) == 1
+    with open('watch_state.json') as state_file:
+        assert sorted(json.load(state_file)['recent_builds']) == ['350', '450', '550', '650']
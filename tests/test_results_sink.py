@@ -0,0 +1,66 @@
+import csv
+import os
+
+import pytest
+
+from results_sink import ResultsCsvSink, ResultsParquetSink, ResultsTable, flush_parquet_sinks_if_due
+
+
+def read_csv(filename):
+    with open(filename, newline='') as csv_file:
+        reader = csv.DictReader(csv_file)
+        return reader.fieldnames, list(reader)
+
+
+def test_columns_not_in_the_file_are_added(tmp_path):
+    filename = str(tmp_path / 'results.csv')
+    sink = ResultsCsvSink(filename, fieldnames=('id', 'name'))
+    sink.append({'id': 1, 'name': 'one'})
+    sink.append({'id': 2, 'name': 'two', 'test_run_name': 'run two'})
+    sink.close()
+
+    fieldnames, rows = read_csv(filename)
+    assert fieldnames == ['id', 'name', 'test_run_name']
+    assert rows == [{'id': '1', 'name': 'one', 'test_run_name': ''},
+                    {'id': '2', 'name': 'two', 'test_run_name': 'run two'}]
+
+    # resuming keeps the added columns
+    sink = ResultsCsvSink(filename, fieldnames=('id', 'name'), resume=True)
+    assert sink.resumed_ids == {'1', '2'}
+    sink.append({'id': 3, 'name': 'three', 'test_run_name': 'run three'})
+    sink.close()
+
+    fieldnames, rows = read_csv(filename)
+    assert fieldnames == ['id', 'name', 'test_run_name']
+    assert rows[-1] == {'id': '3', 'name': 'three', 'test_run_name': 'run three'}
+
+
+def test_table_adds_columns_it_does_not_have():
+    table = ResultsTable(columns=('id', 'name'))
+    table.append({'id': 1, 'name': 'one'})
+    index = table.append({'id': 2})
+    table.update(index, {'test_run_name': 'run two'})
+
+    assert table.columns == ('id', 'name', 'test_run_name')
+    assert list(table) == [{'id': 1, 'name': 'one'}, {'id': 2, 'test_run_name': 'run two'}]
+    assert table.column('test_run_name') == [None, 'run two']
+
+
+def test_parquet_rows_are_held_until_a_flush_is_due(tmp_path):
+    pytest.importorskip('pyarrow')
+    root_path = str(tmp_path / 'parquet')
+    parquet_sinks = [ResultsParquetSink(root_path, envt, flush_rows=3) for envt in ('staging', 'uatcopy1')]
+
+    for build_id in (101, 102):
+        parquet_sinks[0].add_build_row(1, build_id, '2026-01-30T10:00:00+00:00', {'test_run_id': build_id * 10})
+    parquet_sinks[1].add_build_row(2, 201, '2026-01-30T11:00:00+00:00', {'test_run_id': 2010})
+    assert not flush_parquet_sinks_if_due(parquet_sinks)
+    assert not os.path.exists(root_path)
+
+    # a third row makes the first sink due, and both are flushed with it
+    parquet_sinks[0].add_build_row(1, 103, '2026-01-30T12:00:00+00:00', {'test_run_id': 1030})
+    assert flush_parquet_sinks_if_due(parquet_sinks)
+    assert [parquet_sink.rows_pending for parquet_sink in parquet_sinks] == [0, 0]
+    assert [parquet_sink.rows_written for parquet_sink in parquet_sinks] == [3, 1]
+    for envt in ('staging', 'uatcopy1'):
+        assert len(os.listdir(os.path.join(root_path, 'envt=%s' % envt, 'date=2026-01-30'))) == 1
@@ -0,0 +1,90 @@
+import json
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+
+
+logger = logging.getLogger()
+
+DEFAULT_WATCH_INTERVAL_SECONDS = 300
+# each poll looks back this far before the high water mark, for builds whose finish time came out of order
+# (e.g. a build published a little after a later one finished) - builds already seen are skipped
+WATCH_OVERLAP = timedelta(minutes=10)
+# polls a batch of new builds is tried in before it is given up on and skipped, so one build whose results can't be
+# got doesn't hold the watch up for good
+WATCH_MAX_FAILED_POLLS = 3
+
+
+class WatchState(object):
+    """The high water mark of a watch - the latest finish time of the builds it has seen - plus the ids of the
+    builds seen within WATCH_OVERLAP of it, kept in a small json file so a restarted watch carries on where it
+    stopped rather than emitting the same builds again.
+    """
+
+    def __init__(self, filename, start_time=None):
+        """
+        :param start_time: datetime to start watching from if there is no state file yet, now if None
+        """
+        self.filename = filename
+        self.high_water_mark = start_time or datetime.now(timezone.utc)
+        # build id: finish time (datetime) of the builds seen since high_water_mark - WATCH_OVERLAP
+        self.recent_builds = {}
+
+        if os.path.exists(filename):
+            with open(filename) as state_file:
+                state = json.load(state_file)
+            self.high_water_mark = datetime.fromisoformat(state['high_water_mark'])
+            self.recent_builds = dict((int(build_id), datetime.fromisoformat(finish_time))
+                                      for build_id, finish_time in state['recent_builds'].items())
+            logger.info('Watch state %s has a high water mark of %s' % (filename, self.high_water_mark.isoformat()))
+
+    def query_from(self):
+        """
+        :return: datetime to ask for builds finished after
+        """
+        return self.high_water_mark - WATCH_OVERLAP
+
+    def is_new(self, build):
+        return build.finish_time is not None and build.finish_time > self.query_from() \
+            and build.id not in self.recent_builds
+
+    def mark_seen(self, builds):
+        """
+        Raise the high water mark to the latest finish time of these builds, forget the builds now too old to be
+        returned again, and save the state
+        """
+        for build in builds:
+            self.recent_builds[build.id] = build.finish_time
+            self.high_water_mark = max(self.high_water_mark, build.finish_time)
+
+        query_from = self.query_from()
+        self.recent_builds = dict((build_id, finish_time) for build_id, finish_time in self.recent_builds.items()
+                                  if finish_time > query_from)
+
+        # written to a new file and swapped in, so a crash can't leave half a state file
+        temp_filename = self.filename + '.tmp'
+        with open(temp_filename, 'w') as state_file:
+            json.dump({'high_water_mark': self.high_water_mark.isoformat(),
+                       'recent_builds': dict((str(build_id), finish_time.isoformat())
+                                             for build_id, finish_time in self.recent_builds.items())},
+                      state_file)
+        os.replace(temp_filename, self.filename)
+
+
+def poll_new_builds(our_client, definition_ids, state):
+    """
+    Get the builds of our definitions completed since the last poll - a query per
+    ado_utils.BUILDS_QUERY_DEFINITIONS_PER_QUERY definitions, however many pipelines have new builds, and only
+    returning the builds we have not seen before.
+
+    :param our_client: ADOBuildObj
+    :param definition_ids: list of the definition ids being watched
+    :param state: WatchState - not updated, call its mark_seen once the builds' rows are written
+    :return: list of new Build objects, earliest finished first
+    """
+    new_builds = [build for build in our_client.iter_completed_builds_for_definitions(
+                      definition_ids, min_finish_time=state.query_from())
+                  if state.is_new(build)]
+    new_builds.sort(key=lambda build: build.finish_time)
+
+    return new_builds